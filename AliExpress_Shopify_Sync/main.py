@@ -1,13 +1,18 @@
-import shopify
 import json
 import os
+import sys
 import time
+import argparse
 import datetime
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-import pandas as pd
 from termcolor import colored
 
+# Shared components live in the sibling src/ package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from watch import Watcher
+from shopify_client import ShopifyClient
+from async_engine import AsyncShopifyClient, AsyncPipeline
+from carriers import classify_carriers
+
 # --- Constants & Setup ---
 CONFIG_PATH = 'config/config.json'
 LOG_DIR = 'logs'
@@ -37,27 +42,40 @@ def log_message(message, level="INFO"):
 
 # --- Shopify Connection ---
 def connect_shopify(config):
+    """Builds the shared ShopifyClient from config.json and checks the credentials."""
     try:
-        session = shopify.Session(
-            config['shopify']['shop_url'],
-            config['shopify']['api_version'],
-            config['shopify']['access_token']
+        settings = config['settings']
+        client = ShopifyClient(
+            shop_url=config['shopify']['shop_url'],
+            access_token=config['shopify']['access_token'],
+            api_version=config['shopify']['api_version'],
+            id_location=settings.get('ali_id_location_in_shopify'),
+            id_attribute=settings.get('ali_id_attribute_name'),
+            # Rows fulfilled by an earlier run are recognised by their tracking number
+            fetch_tracking=True,
         )
-        shopify.ShopifyResource.activate_session(session)
-        shop = shopify.Shop.current()
-        log_message(f"Connected to Shopify Store: {shop.name}", "SUCCESS")
-        return True
+        shop = client.get_shop()
+        log_message(f"Connected to Shopify Store: {shop.get('name')}", "SUCCESS")
+        return client
     except Exception as e:
         log_message(f"Failed to connect to Shopify: {str(e)}", "ERROR")
-        return False
+        return None
 
 # --- Google Sheets Connection ---
-def get_google_sheet_data(config):
+def build_sheets_service(config):
+    # The Google client libraries are slow to import; only load them when the sheet is read
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
+    creds_file = config['google_sheets']['credentials_file']
+    SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+    creds = service_account.Credentials.from_service_account_file(creds_file, scopes=SCOPES)
+    return build('sheets', 'v4', credentials=creds)
+
+def get_google_sheet_data(config, service=None):
     try:
-        creds_file = config['google_sheets']['credentials_file']
-        SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
-        creds = service_account.Credentials.from_service_account_file(creds_file, scopes=SCOPES)
-        service = build('sheets', 'v4', credentials=creds)
+        # Reusing the service keeps the OAuth token and HTTP connection between polls
+        service = service or build_sheets_service(config)
 
         sheet_id = config['google_sheets']['spreadsheet_id']
         range_name = config['google_sheets']['worksheet_name']
@@ -69,161 +87,140 @@ def get_google_sheet_data(config):
 
         if not values:
             log_message("No data found in Google Sheet.", "WARNING")
-            return pd.DataFrame()
+            return []
 
-        # Convert to Pandas DataFrame
-        df = pd.DataFrame(values[1:], columns=values[0])
-        return df
+        # One dict per row, keyed by the header; the API omits trailing empty cells
+        header = values[0]
+        return [dict(zip(header, row)) for row in values[1:]]
     except Exception as e:
         log_message(f"Failed to read Google Sheet: {str(e)}", "ERROR")
-        return pd.DataFrame()
+        return []
 
 # --- Core Logic ---
-def find_shopify_order(ali_order_id, config):
-    location = config['settings']['ali_id_location_in_shopify']
-    
-    # Strategy 1: Search by Note
-    if location == 'note':
-        orders = shopify.Order.find(limit=1, note=ali_order_id, status='any')
-        if orders: return orders[0]
-
-    # Strategy 2: Search by Tag
-    if location == 'tags':
-        # Shopify allows searching by tag
-        orders = shopify.Order.find(limit=1, tag=ali_order_id, status='any')
-        if orders: return orders[0]
-        
-    # Strategy 3: Note Attributes (Complex search, requires iteration or GraphQL ideally, but REST allows some filtering)
-    # REST API doesn't support filtering by specific note_attributes directly efficiently without iterating
-    # Fallback: Search all open orders (assuming recent) or use a broad search
-    # For now, we will perform a broad search of the last 50 orders if not found by direct query
-    # NOTE: This part implies we might need to iterate.
-    
-    # General Fallback: Search generic query
-    try:
-        # Search query matching common text fields
-        orders = shopify.Order.find(limit=5, query=ali_order_id, status='any')
-        if orders:
-            # Verify exact match in attributes if required
-            if location == 'note_attributes':
-                target_key = config['settings'].get('ali_id_attribute_name')
-                for order in orders:
-                    for attr in getattr(order, 'note_attributes', []):
-                        if attr.code == target_key and str(attr.value) == str(ali_order_id): # attr.code or attr.name depending on version
-                            return order
-                        # Sometimes key is 'name'
-                        if getattr(attr, 'name', '') == target_key and str(attr.value) == str(ali_order_id):
-                            return order
-            else:
-                return orders[0] # Return first match for other modes
-    except Exception:
-        pass
-        
-    return None
-
-def update_fulfillment(order, tracking_number, config):
+def find_shopify_orders(client, ali_order_ids, concurrency=4, should_stop=None):
+    """
+    Resolves AliExpress IDs with the shared batched lookup: one GraphQL
+    request per chunk of IDs, matched where config.json says the ID is
+    stored (see connect_shopify), plus one shared deep scan for the rest.
+
+    Returns:
+        dict: AliExpress ID -> order dict, for the IDs that were found.
+    """
+    chunk_size = client.lookup_batch_size
+    chunks = [ali_order_ids[i:i + chunk_size] for i in range(0, len(ali_order_ids), chunk_size)]
+    found = {}
+    if chunks:
+        async_client = AsyncShopifyClient(client)
+        AsyncPipeline(concurrency).run(chunks, async_client.find_orders_by_ali_ids, found.update, should_stop)
+    return found
+
+def update_fulfillments(client, rows, config):
+    """
+    Adds tracking to matched orders, several per request.
+
+    Fulfillment order IDs come with the lookup, so there is no per-order
+    fulfillment order or location request.
+
+    Args:
+        rows (list): (ali_id, tracking_number, carrier, order) tuples.
+
+    Returns:
+        list: True/False per row, in the same order.
+    """
     if config['settings']['dry_run']:
-        log_message(f"[DRY RUN] Would update Order #{order.order_number} with tracking {tracking_number}", "INFO")
-        return True
-
-    try:
-        # Check if already fulfilled with this tracking number to avoid duplicates
-        for fulfillment in order.fulfillments:
-            for tracking in fulfillment.tracking_numbers:
-                if tracking == tracking_number:
-                    log_message(f"Order #{order.order_number} already has tracking {tracking_number}. Skipping.", "WARNING")
-                    return True
-
-        # Create Fulfillment
-        new_fulfillment = shopify.Fulfillment(prefix_options={'order_id': order.id})
-        new_fulfillment.location_id = order.location_id if order.location_id else None # Often needs explicit location
-        
-        # If location is None, we might need to fetch locations
-        if not new_fulfillment.location_id:
-             locations = shopify.Location.find()
-             if locations:
-                 new_fulfillment.location_id = locations[0].id
-
-        new_fulfillment.tracking_info = {
-            "number": tracking_number,
-            # "company": "China Post" # Optional, can be auto-detected or mapped
-        }
-        
-        # In newer API versions requires line_items_by_fulfillment_order usually, 
-        # but for simple implementations keeping it legacy-compatible for 'Fulfillment' resource if possible.
-        # Actually, 2023-01+ deprecated fulfillment endpoints in favor of fulfillment_orders.
-        # Implementing robust FulfillmentOrder logic:
-        
-        fulfillment_orders = shopify.FulfillmentOrder.find(order_id=order.id)
-        if not fulfillment_orders:
-            log_message(f"No fulfillment orders found for #{order.order_number}", "ERROR")
-            return False
-
-        # Fulfill the first open fulfillment order
-        target_fo = None
-        for fo in fulfillment_orders:
-            if fo.status == 'open':
-                target_fo = fo
-                break
-        
-        if target_fo:
-            fulfillment = shopify.Fulfillment.create({
-                'line_items_by_fulfillment_order': [
-                    {
-                        "fulfillment_order_id": target_fo.id
-                    }
-                ],
-                'tracking_info': {
-                    'number': tracking_number
-                }
-            })
-            log_message(f"Successfully updated Order #{order.order_number}", "SUCCESS")
-            return True
+        for ali_id, tracking_number, carrier, order in rows:
+            log_message(f"[DRY RUN] Would update Order {order['name']} with tracking {tracking_number} ({carrier})", "INFO")
+        return [True] * len(rows)
+
+    outcomes = client.create_fulfillments([(order, tracking_number, carrier) for ali_id, tracking_number, carrier, order in rows])
+    results = []
+    for (ali_id, tracking_number, carrier, order), (ok, message) in zip(rows, outcomes):
+        if ok:
+            log_message(f"Successfully updated Order {order['name']}", "SUCCESS")
         else:
-             log_message(f"Order #{order.order_number} has no open fulfillment orders.", "WARNING")
-             return False
+            log_message(f"Failed to update {order['name']}: {message}", "ERROR")
+        results.append(ok)
+    return results
 
-    except Exception as e:
-        log_message(f"Failed to update #{order.order_number}: {str(e)}", "ERROR")
-        return False
-
-def main():
-    print(colored("Starting Shopify Tracking Automation...", "cyan"))
-    config = load_config()
-    if not config: return
-
-    if not connect_shopify(config): return
-    
-    df = get_google_sheet_data(config)
-    if df.empty: return
+def run_sync(config, client, service=None, should_stop=None):
+    """Processes every row of the sheet once. Returns the number of orders updated."""
+    records = get_google_sheet_data(config, service)
+    if not records: return 0
 
     ali_col = config['google_sheets']['columns']['aliexpress_order_id']
     track_col = config['google_sheets']['columns']['tracking_number']
+    concurrency = int(config['settings'].get('concurrency', 4))
 
-    log_message(f"Processing {len(df)} rows found in Sheet...", "INFO")
+    log_message(f"Processing {len(records)} rows found in Sheet...", "INFO")
 
-    processed_count = 0
-    
-    for index, row in df.iterrows():
+    # Fulfillment orders fetched in an earlier watch cycle may have changed
+    client.reset_run_caches()
+
+    rows = []
+    for row in records:
         ali_id = str(row.get(ali_col, '')).strip()
         tracking_num = str(row.get(track_col, '')).strip()
+        if ali_id and tracking_num:
+            rows.append((ali_id, tracking_num))
 
-        if not ali_id or not tracking_num:
-            continue
+    # Carrier of every tracking number, detected in one pass
+    carriers = classify_carriers([tracking_num for _, tracking_num in rows])
 
-        log_message(f"Processing AliExpress ID: {ali_id} -> Tracking: {tracking_num}", "INFO")
+    # Find the Shopify Orders, a chunk of IDs per request
+    orders = find_shopify_orders(client, list(dict.fromkeys(ali_id for ali_id, _ in rows)), concurrency, should_stop)
 
-        # Find the Shopify Order
-        order = find_shopify_order(ali_id, config)
-        
-        if order:
-            success = update_fulfillment(order, tracking_num, config)
-            if success:
-                processed_count += 1
-        else:
+    matched = []
+    skipped_count = 0
+    for (ali_id, tracking_num), carrier in zip(rows, carriers):
+        order = orders.get(ali_id)
+        if not order:
             log_message(f"Could not find Shopify Order for AliExpress ID: {ali_id}", "WARNING")
+        elif tracking_num in (order.get('tracking_numbers') or []):
+            # Fulfilled by an earlier run; its fulfillment order is already closed
+            log_message(f"Order {order['name']} already has tracking {tracking_num}. Skipping.", "WARNING")
+            skipped_count += 1
+        else:
+            log_message(f"Processing AliExpress ID: {ali_id} -> Tracking: {tracking_num} ({order['name']})", "INFO")
+            matched.append((ali_id, tracking_num, carrier, order))
+
+    processed_count = 0
+    batch_size = client.fulfillment_batch_size
+    for start in range(0, len(matched), batch_size):
+        # Finish the current batch, then stop cleanly
+        if should_stop and should_stop():
+            log_message("Stop requested, leaving remaining rows for the next run.", "WARNING")
+            break
+        processed_count += sum(update_fulfillments(client, matched[start:start + batch_size], config))
+
+    log_message(f"Job Complete. updated {processed_count} orders, skipped {skipped_count} already tracked.", "SUCCESS")
+    return processed_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Shopify Tracking Automation")
+    parser.add_argument("--watch", action="store_true", help="Keep running and poll the sheet until stopped (SIGTERM/Ctrl+C)")
+    parser.add_argument("--interval", type=float, default=300, help="Seconds between polls in watch mode")
+    args = parser.parse_args()
 
-    log_message(f"Job Complete. updated {processed_count} orders.", "SUCCESS")
+    print(colored("Starting Shopify Tracking Automation...", "cyan"))
+    config = load_config()
+    if not config: return
+
+    client = connect_shopify(config)
+    if not client: return
+
+    if not args.watch:
+        run_sync(config, client)
+        return
+
+    # The Shopify session and the Sheets service stay open between cycles
+    try:
+        service = build_sheets_service(config)
+    except Exception as e:
+        log_message(f"Failed to connect to Google Sheets: {str(e)}", "ERROR")
+        return
+    watcher = Watcher(interval=args.interval, max_interval=max(args.interval, 1800))
+    watcher.install_signal_handlers()
+    watcher.run(lambda: run_sync(config, client, service, watcher.is_stopping))
 
 if __name__ == "__main__":
     main()
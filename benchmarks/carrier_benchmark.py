@@ -0,0 +1,81 @@
+"""
+Throughput benchmark for carrier detection (src/carriers.py).
+
+Classifies a synthetic tracking column with a realistic mix of formats,
+including numbers no rule knows, the way build_work_items does, and fails
+when the best of several runs is below `--min-rate` numbers per second.
+
+Usage:
+    python benchmarks/carrier_benchmark.py --count 1000000
+    python benchmarks/carrier_benchmark.py --min-rate 1000000 --output carriers.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from carriers import CarrierClassifier
+
+# Share of each format in the synthetic column; '' is a row still waiting for its number
+FORMATS = [
+    (0.30, lambda r: f"LP00{r.randrange(10 ** 12):012d}"),
+    (0.15, lambda r: f"YT{r.randrange(10 ** 16):016d}"),
+    (0.10, lambda r: f"4PX{r.randrange(10 ** 13):013d}CN"),
+    (0.10, lambda r: f"{r.choice('LRU')}{r.choice('ABKT')}{r.randrange(10 ** 9):09d}CN"),
+    (0.05, lambda r: f"E{r.choice('ABLV')}{r.randrange(10 ** 9):09d}CN"),
+    (0.10, lambda r: f"94{r.randrange(10 ** 20):020d}"),
+    (0.05, lambda r: f"1Z{r.randrange(36 ** 10):016X}"),
+    (0.10, lambda r: f"ZX{r.randrange(10 ** 10)}"),
+    (0.05, lambda r: ''),
+]
+
+
+def make_numbers(count, seed=0):
+    rng = random.Random(seed)
+    weights = [w for w, _ in FORMATS]
+    makers = [m for _, m in FORMATS]
+    return [maker(rng) for maker in rng.choices(makers, weights, k=count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure carrier detection throughput")
+    parser.add_argument("--count", type=int, default=1000000, help="Tracking numbers per run")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-rate", type=float, default=1000000, help="Numbers/sec below which the benchmark fails")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    numbers = make_numbers(args.count)
+    started = time.perf_counter()
+    classifier = CarrierClassifier()
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    rates = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        carriers = classifier.classify_many(numbers)
+        rates.append(args.count / (time.perf_counter() - started))
+
+    counts = Counter(c or '(no number)' for c in carriers)
+    print(f"\n{'Carrier':<22} {'Numbers':>9}")
+    for carrier, count in counts.most_common():
+        print(f"{carrier:<22} {count:>9}")
+    print(f"\nCompiled in {compile_ms:.1f}ms; best {max(rates):,.0f} numbers/sec over {args.runs} runs of {args.count}.")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'count': args.count, 'compile_ms': compile_ms, 'best_rate': max(rates),
+                       'rates': rates, 'carriers': dict(counts)}, f, indent=2)
+        print(f"Results saved to: {args.output}")
+
+    if max(rates) < args.min_rate:
+        print(f"\n[REGRESSION] {max(rates):,.0f} numbers/sec is below the minimum of {args.min_rate:,.0f}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+"""
+Local stand-ins for the Shopify Admin API (REST + GraphQL) and the Google
+Sheets / Drive APIs, used by run_benchmarks.py.
+
+They implement only what the two entry points call, with configurable
+latency, Shopify's leaky-bucket throttling and GraphQL cost accounting.
+"""
+import re
+import json
+import time
+import threading
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket sizes and restore rates per Shopify plan
+PLANS = {
+    'standard': {'rest_limit': 40, 'rest_rate': 2, 'graphql_limit': 1000, 'graphql_rate': 50},
+    'plus': {'rest_limit': 400, 'rest_rate': 20, 'graphql_limit': 2000, 'graphql_rate': 100},
+}
+
+ALI_ATTRIBUTE = "AliExpress Order ID"
+SHEET_ID = "bench-sheet"
+SHEET_TITLE = "Sheet1"
+
+
+class Bucket:
+    """Server-side leaky bucket."""
+
+    def __init__(self, limit, rate):
+        self.limit = float(limit)
+        self.rate = float(rate)
+        self.available = float(limit)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, cost):
+        """Charges `cost` if available. Returns (ok, available_after)."""
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.limit, self.available + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if cost > self.available:
+                return False, self.available
+            self.available -= cost
+            return True, self.available
+
+    def refund(self, points):
+        with self.lock:
+            self.available = min(self.limit, self.available + points)
+
+
+class FakeShop:
+    """
+    Synthetic dataset: `order_count` open orders plus a matching sheet.
+
+    Every order stores its AliExpress ID as a note attribute and every
+    other order also as a tag. The sheet holds one row per order, with
+    about 5% unknown IDs and 5% rows without a tracking number.
+    """
+
+    def __init__(self, order_count):
+        self.order_count = order_count
+        self.orders = []
+        self.by_term = {}
+        self.lock = threading.Lock()
+
+        for i in range(order_count):
+            order_id = 100000 + i
+            ali_id = str(8000000000 + i)
+            order = {
+                'id': order_id,
+                'name': f"#{1000 + i}",
+                'ali_id': ali_id,
+                'tags': [ali_id] if i % 2 == 0 else [],
+                'attributes': [{'name': ALI_ATTRIBUTE, 'value': ali_id}],
+                'fulfillment_order_id': order_id * 10,
+                'fulfilled': False,
+                'tracking_numbers': [],
+            }
+            self.orders.append(order)
+            for term in self._terms(order):
+                self.by_term.setdefault(term, []).append(order)
+        self.by_id = {o['id']: o for o in self.orders}
+        self.by_fulfillment_order = {o['fulfillment_order_id']: o for o in self.orders}
+
+        self.sheet = [['Date', 'AliExpress Order No', 'Tracking Number']]
+        for i, order in enumerate(self.orders):
+            ali_id = order['ali_id'] if i % 20 != 7 else str(9000000000 + i)
+            tracking = f"LP{700000000000 + i}" if i % 20 != 13 else ''
+            self.sheet.append(['2026-01-01', ali_id, tracking])
+
+    @staticmethod
+    def _terms(order):
+        terms = {order['name'], order['name'].lstrip('#')}
+        terms.update(order['tags'])
+        terms.update(a['value'] for a in order['attributes'])
+        return terms
+
+    def reset(self):
+        with self.lock:
+            for order in self.orders:
+                order['fulfilled'] = False
+                order['tracking_numbers'] = []
+
+    def search(self, term):
+        return self.by_term.get(term, [])
+
+    def fulfill(self, fulfillment_order_id, tracking_number=None):
+        with self.lock:
+            order = self.by_fulfillment_order.get(int(fulfillment_order_id))
+            if not order or order['fulfilled']:
+                return False
+            order['fulfilled'] = True
+            if tracking_number:
+                order['tracking_numbers'].append(tracking_number)
+            return True
+
+    # --- Renderers ---
+    def graphql_node(self, order):
+        return {
+            'id': f"gid://shopify/Order/{order['id']}",
+            'legacyResourceId': str(order['id']),
+            'name': order['name'],
+            'tags': order['tags'],
+            'customAttributes': [{'key': a['name'], 'value': a['value']} for a in order['attributes']],
+            'displayFulfillmentStatus': 'FULFILLED' if order['fulfilled'] else 'UNFULFILLED',
+            'fulfillmentOrders': {'edges': [{'node': self.graphql_fulfillment_order(order)}]},
+            'fulfillments': [{'trackingInfo': [{'number': n} for n in order['tracking_numbers']]}] if order['fulfilled'] else [],
+        }
+
+    def graphql_fulfillment_order(self, order):
+        return {
+            'id': f"gid://shopify/FulfillmentOrder/{order['fulfillment_order_id']}",
+            'status': 'CLOSED' if order['fulfilled'] else 'OPEN',
+        }
+
+    def rest_order(self, order):
+        return {
+            'id': order['id'],
+            'order_number': int(order['name'].lstrip('#')),
+            'name': order['name'],
+            'tags': ', '.join(order['tags']),
+            'note_attributes': order['attributes'],
+            'fulfillments': [],
+            'location_id': None,
+        }
+
+
+class CallCounter:
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+class _BaseHandler(BaseHTTPRequestHandler):
+    # Keep-alive so pooled clients reuse connections, like the real APIs
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_shopify_server(shop, counter, latency=0.05, plan='plus', host='127.0.0.1', port=0):
+    limits = PLANS[plan]
+    rest_bucket = Bucket(limits['rest_limit'], limits['rest_rate'])
+    graphql_bucket = Bucket(limits['graphql_limit'], limits['graphql_rate'])
+
+    class ShopifyHandler(_BaseHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/bulk/orders.jsonl':
+                counter.add('shopify_bulk_download')
+                self._send_bulk_file()
+                return
+            self._rest('GET', url, None)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self._body()
+            if url.path.endswith('/graphql.json'):
+                self._graphql(json.loads(body or b'{}'))
+            else:
+                self._rest('POST', url, json.loads(body or b'{}'))
+
+        # --- REST ---
+        def _rest(self, method, url, payload):
+            counter.add('shopify_rest')
+            time.sleep(latency)
+            ok, available = rest_bucket.take(1)
+            limit_header = {'X-Shopify-Shop-Api-Call-Limit': f"{int(rest_bucket.limit - available)}/{int(rest_bucket.limit)}"}
+            if not ok:
+                counter.add('shopify_throttled')
+                self._send_json(429, {'errors': 'Exceeded call limit'}, {'Retry-After': '1.0', **limit_header})
+                return
+
+            path = re.sub(r'^/admin/api/[^/]+/', '', url.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            match = re.match(r'orders/(\d+)/fulfillment_orders\.json$', path)
+
+            if path == 'shop.json':
+                self._send_json(200, {'shop': {'id': 1, 'name': 'Benchmark Shop'}}, limit_header)
+            elif path == 'locations.json':
+                self._send_json(200, {'locations': [{'id': 1, 'name': 'Main'}]}, limit_header)
+            elif path == 'orders.json':
+                term = params.get('tag') or params.get('query') or params.get('note') or ''
+                limit = int(params.get('limit', 50))
+                orders = [shop.rest_order(o) for o in shop.search(term)[:limit]]
+                self._send_json(200, {'orders': orders}, limit_header)
+            elif match:
+                order = shop.by_id.get(int(match.group(1)))
+                fulfillment_orders = []
+                if order:
+                    fulfillment_orders = [{
+                        'id': order['fulfillment_order_id'],
+                        'order_id': order['id'],
+                        'status': 'closed' if order['fulfilled'] else 'open',
+                    }]
+                self._send_json(200, {'fulfillment_orders': fulfillment_orders}, limit_header)
+            elif path.endswith('fulfillments.json') and method == 'POST':
+                fulfillment = payload.get('fulfillment', payload)
+                line_items = fulfillment.get('line_items_by_fulfillment_order') or [{}]
+                tracking_number = (fulfillment.get('tracking_info') or {}).get('number')
+                if shop.fulfill(line_items[0].get('fulfillment_order_id', 0), tracking_number):
+                    self._send_json(201, {'fulfillment': {'id': 1, 'status': 'success'}}, limit_header)
+                else:
+                    self._send_json(422, {'errors': ['Fulfillment order is not open']}, limit_header)
+            else:
+                self._send_json(404, {'errors': 'Not Found'}, limit_header)
+
+        # --- GraphQL ---
+        def _graphql(self, request):
+            counter.add('shopify_graphql')
+            time.sleep(latency)
+            query = request.get('query', '')
+            variables = request.get('variables') or {}
+
+            handler, requested = self._route(query, variables)
+            ok, available = graphql_bucket.take(requested)
+            if not ok:
+                counter.add('shopify_throttled')
+                self._send_json(200, {
+                    'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+                    'extensions': {'cost': self._cost(requested, None, available)},
+                })
+                return
+
+            data, actual = handler(query, variables)
+            # Shopify refunds the difference between requested and actual cost
+            graphql_bucket.refund(max(0, requested - actual))
+            self._send_json(200, {
+                'data': data,
+                'extensions': {'cost': self._cost(requested, actual, graphql_bucket.available)},
+            })
+
+        def _cost(self, requested, actual, available):
+            return {
+                'requestedQueryCost': requested,
+                'actualQueryCost': actual,
+                'throttleStatus': {
+                    'maximumAvailable': graphql_bucket.limit,
+                    'currentlyAvailable': int(available),
+                    'restoreRate': graphql_bucket.rate,
+                },
+            }
+
+        def _route(self, query, variables):
+            """Returns (handler, requested cost) for the recognised query shapes."""
+            if 'bulkOperationRunQuery' in query:
+                return self._bulk_start, 10
+            if 'currentBulkOperation' in query:
+                return self._bulk_status, 1
+            if query.lstrip().startswith('mutation'):
+                return self._fulfill, 10 * max(1, len(variables))
+            if 'tagged: orders' in query:
+                return self._batch_lookup, 2 * (2 + int(variables.get('first', 50)) * 5)
+            if '$idQuery' in query:
+                return self._orders_by_id, 2 + int(variables.get('first', 50)) * 5
+            if 'after: $cursor' in query:
+                # Matching fields only: the order and its attributes
+                return self._deep_scan, 2 + 100 * 2
+            return self._search, 2 + 5 * 5
+
+        def _bulk_start(self, query, variables):
+            return {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': 'gid://shopify/BulkOperation/1', 'status': 'CREATED'},
+                'userErrors': [],
+            }}, 10
+
+        def _bulk_status(self, query, variables):
+            host, port = self.server.server_address[:2]
+            return {'currentBulkOperation': {
+                'id': 'gid://shopify/BulkOperation/1',
+                'status': 'COMPLETED',
+                'errorCode': None,
+                'objectCount': str(shop.order_count * 2),
+                'url': f"http://{host}:{port}/bulk/orders.jsonl",
+            }}, 1
+
+        def _send_bulk_file(self):
+            lines = []
+            for order in shop.orders:
+                if order['fulfilled']:
+                    continue
+                node = shop.graphql_node(order)
+                node.pop('fulfillmentOrders')
+                node.pop('fulfillments')
+                lines.append(json.dumps(node))
+                lines.append(json.dumps({**shop.graphql_fulfillment_order(order), '__parentId': node['id']}))
+            body = ('\n'.join(lines) + '\n').encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _batch_lookup(self, query, variables):
+            first = int(variables.get('first', 50))
+            tagged = []
+            for term in re.findall(r'tag:"([^"]*)"', variables.get('tagQuery', '')):
+                tagged.extend(o for o in shop.search(term) if term in o['tags'])
+            matched = []
+            for term in re.findall(r'"([^"]*)"', variables.get('textQuery', '')):
+                matched.extend(shop.search(term))
+            data = {
+                'tagged': {'edges': [{'node': shop.graphql_node(o)} for o in tagged[:first]]},
+                'matched': {'edges': [{'node': shop.graphql_node(o)} for o in matched[:first]]},
+            }
+            returned = min(first, len(tagged)) + min(first, len(matched))
+            return data, 4 + returned * 5
+
+        def _deep_scan(self, query, variables):
+            start = int(variables.get('cursor') or 0)
+            open_orders = [o for o in shop.orders if not o['fulfilled']]
+            page = open_orders[start:start + 100]
+            has_next = start + 100 < len(open_orders)
+            edges = []
+            for order in page:
+                node = shop.graphql_node(order)
+                node.pop('fulfillmentOrders')
+                node.pop('fulfillments')
+                edges.append({'node': node})
+            return {'orders': {
+                'edges': edges,
+                'pageInfo': {'hasNextPage': has_next, 'endCursor': str(start + 100) if has_next else None},
+            }}, 2 + len(page) * 2
+
+        def _orders_by_id(self, query, variables):
+            first = int(variables.get('first', 50))
+            orders = [shop.by_id[int(i)] for i in re.findall(r'id:(\d+)', variables.get('idQuery', ''))
+                      if int(i) in shop.by_id][:first]
+            return {'orders': {'edges': [{'node': shop.graphql_node(o)} for o in orders]}}, 2 + len(orders) * 5
+
+        def _search(self, query, variables):
+            term = (variables.get('query') or '')
+            if term.startswith('tag:'):
+                orders = [o for o in shop.search(term[4:]) if term[4:] in o['tags']]
+            else:
+                orders = shop.search(term)
+            return {'orders': {'edges': [{'node': shop.graphql_node(o)} for o in orders[:5]]}}, 2 + len(orders[:5]) * 5
+
+        def _fulfill(self, query, variables):
+            data = {}
+            for alias, fulfillment in variables.items():
+                fulfillment_order_gid = fulfillment['lineItemsByFulfillmentOrder'][0]['fulfillmentOrderId']
+                tracking_number = (fulfillment.get('trackingInfo') or {}).get('number')
+                if shop.fulfill(fulfillment_order_gid.rsplit('/', 1)[-1], tracking_number):
+                    data[alias] = {'fulfillment': {'id': 'gid://shopify/Fulfillment/1', 'status': 'SUCCESS'}, 'userErrors': []}
+                else:
+                    data[alias] = {'fulfillment': None, 'userErrors': [
+                        {'field': ['fulfillment'], 'message': 'Fulfillment order is not open'}
+                    ]}
+            return data, 10 * len(variables)
+
+    return ThreadingHTTPServer((host, port), ShopifyHandler)
+
+
+def make_sheets_server(shop, counter, latency=0.05, sheet_name='Benchmark Sheet', host='127.0.0.1', port=0):
+    """Serves the Drive files.list call and the Sheets v4 values endpoints."""
+    # Writes bump modifiedTime, like Drive does
+    grid = {'columns': len(shop.sheet[0]), 'revision': 0}
+
+    class SheetsHandler(_BaseHandler):
+        def do_GET(self):
+            counter.add('sheets')
+            time.sleep(latency)
+            url = urlparse(self.path)
+            path = unquote(url.path)
+            params = parse_qs(url.query)
+
+            if path.startswith('/drive/v3/files'):
+                drive_file = {
+                    'id': SHEET_ID,
+                    'name': sheet_name,
+                    'createdTime': '2026-01-01T00:00:00.000Z',
+                    'modifiedTime': f"2026-01-01T00:00:{grid['revision']:02d}.000Z",
+                }
+                # files.get for one file (get_lastUpdateTime), files.list otherwise
+                self._send_json(200, drive_file if path == f'/drive/v3/files/{SHEET_ID}' else {'files': [drive_file]})
+            elif path == f'/v4/spreadsheets/{SHEET_ID}/values:batchGet':
+                self._send_json(200, {'valueRanges': [
+                    {'range': r, 'majorDimension': 'ROWS', 'values': self._values(r)}
+                    for r in params.get('ranges', [])
+                ]})
+            elif path.startswith(f'/v4/spreadsheets/{SHEET_ID}/values/'):
+                a1 = path.split('/values/', 1)[1]
+                self._send_json(200, {'range': a1, 'majorDimension': 'ROWS', 'values': self._values(a1)})
+            elif path == f'/v4/spreadsheets/{SHEET_ID}':
+                self._send_json(200, {
+                    'spreadsheetId': SHEET_ID,
+                    'properties': {'title': sheet_name, 'locale': 'en_US', 'timeZone': 'Etc/UTC'},
+                    'sheets': [{'properties': {
+                        'sheetId': 0, 'title': SHEET_TITLE, 'index': 0, 'sheetType': 'GRID',
+                        'gridProperties': {'rowCount': len(shop.sheet), 'columnCount': grid['columns']},
+                    }}],
+                })
+            else:
+                self._send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+
+        def do_POST(self):
+            counter.add('sheets_write')
+            time.sleep(latency)
+            path = unquote(urlparse(self.path).path)
+            payload = json.loads(self._body() or b'{}')
+
+            if path == f'/v4/spreadsheets/{SHEET_ID}/values:batchUpdate':
+                for value_range in payload.get('data', []):
+                    self._write(value_range['range'], value_range['values'])
+                grid['revision'] += 1
+                self._send_json(200, {'spreadsheetId': SHEET_ID, 'responses': []})
+            elif path == f'/v4/spreadsheets/{SHEET_ID}:batchUpdate':
+                # Only the worksheet resize done by add_cols
+                for request in payload.get('requests', []):
+                    properties = request.get('updateSheetProperties', {}).get('properties', {})
+                    grid['columns'] = properties.get('gridProperties', {}).get('columnCount', grid['columns'])
+                self._send_json(200, {'spreadsheetId': SHEET_ID, 'replies': [{}]})
+            else:
+                self._send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+
+        def _write(self, a1, values):
+            """Writes a block of values at a range such as 'D2:F10' (or 'Sheet1!D2:F10')."""
+            cells = a1.split('!', 1)[1] if '!' in a1 else a1
+            start_col, start_row = re.match(r"'?([A-Z]+)(\d+)", cells).groups()
+            col, row = _column_index(start_col), int(start_row) - 1
+            with shop.lock:
+                for offset, row_values in enumerate(values):
+                    target = shop.sheet[row + offset]
+                    target.extend([''] * (col + len(row_values) - len(target)))
+                    target[col:col + len(row_values)] = row_values
+
+        def _values(self, a1):
+            """Slices the sheet for an A1 range such as 'Sheet1', 'A1:1' or 'B5:B'."""
+            cells = a1.split('!', 1)[1] if '!' in a1 else a1
+            if cells.strip("'") == SHEET_TITLE:
+                return shop.sheet
+            match = re.fullmatch(r'([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?', cells)
+            if not match:
+                return []
+            start_col, start_row, end_col, end_row = match.groups()
+            if end_col is None and end_row is None:
+                end_col, end_row = start_col, start_row
+
+            row_start = int(start_row or 1) - 1
+            row_end = int(end_row) if end_row else len(shop.sheet)
+            col_start = _column_index(start_col) if start_col else 0
+            col_end = _column_index(end_col) + 1 if end_col else None
+            return [row[col_start:col_end] for row in shop.sheet[row_start:row_end]]
+
+    return ThreadingHTTPServer((host, port), SheetsHandler)
+
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - 64)
+    return index - 1
+
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
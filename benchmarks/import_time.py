@@ -0,0 +1,105 @@
+"""
+Startup benchmark: how long each entry point takes to import.
+
+Every measurement runs in a fresh interpreter, so the numbers are cold
+imports (minus the OS file cache). Also checks that modules only some code
+paths need (pandas, the Google client libraries, rich) are not loaded at
+import time.
+
+Usage:
+    python benchmarks/import_time.py --output startup.json
+    python benchmarks/import_time.py --baseline startup.json --max-regression 0.3
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRIES = {
+    'src': (os.path.join(REPO_ROOT, 'src'), 'main'),
+    'legacy': (os.path.join(REPO_ROOT, 'AliExpress_Shopify_Sync'), 'main'),
+}
+
+# Loaded on demand by the code paths that need them, never at startup
+LAZY_MODULES = ('pandas', 'numpy', 'gspread', 'google.oauth2', 'googleapiclient', 'rich', 'openpyxl', 'setup_wizard')
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {path!r})
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': sorted(m for m in {lazy!r} if m in sys.modules)}}))
+"""
+
+
+def measure(entry, runs):
+    path, module = ENTRIES[entry]
+    code = PROBE.format(path=path, module=module, lazy=LAZY_MODULES)
+    samples = []
+    loaded = set()
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-c', code], cwd=path, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Importing {entry} failed:\n{completed.stderr[-2000:]}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        samples.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return {
+        'entry': entry,
+        'runs': runs,
+        # The fastest run is the least disturbed by other load on the machine
+        'best_ms': min(samples) * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'eagerly_loaded': sorted(loaded),
+    }
+
+
+def find_regressions(results, baseline, max_regression):
+    previous = {r['entry']: r for r in baseline}
+    regressions = []
+    for r in results:
+        before = previous.get(r['entry'])
+        if before and r['best_ms'] > before['best_ms'] * (1 + max_regression):
+            regressions.append(f"{r['entry']}: import time {before['best_ms']:.1f}ms -> {r['best_ms']:.1f}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the sync entry points")
+    parser.add_argument("--entries", nargs="+", choices=sorted(ENTRIES), default=sorted(ENTRIES))
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per entry point")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.3,
+                        help="Allowed relative rise in import time before failing")
+    args = parser.parse_args()
+
+    results = [measure(entry, args.runs) for entry in args.entries]
+
+    print(f"\n{'Entry':<8} {'Best ms':>8} {'Median ms':>10}  Loaded at import")
+    for r in results:
+        print(f"{r['entry']:<8} {r['best_ms']:>8.1f} {r['median_ms']:>10.1f}  {', '.join(r['eagerly_loaded']) or '-'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {args.output}")
+
+    failures = [f"{r['entry']}: imports {', '.join(r['eagerly_loaded'])} at startup" for r in results if r['eagerly_loaded']]
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += find_regressions(results, json.load(f), args.max_regression)
+    if failures:
+        print("\n[REGRESSION] " + "\n[REGRESSION] ".join(failures))
+        sys.exit(1)
+    if args.baseline:
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Memory benchmark for reading the sheet.
+
+Serves sheets of several sizes from the fake Sheets server and, in a fresh
+process per size, reads them the way sync_cycle does: chunk by chunk
+through SheetReader.iter_chunks, get_new_rows and build_work_items, with
+every row but `--new-rows` already processed. Peak memory is measured with
+tracemalloc around the read only, so the processed-ID set and module
+imports are not counted.
+
+With columnar chunked reads the peak should follow the chunk size and the
+number of new rows, not the total number of rows in the sheet.
+
+Usage:
+    python benchmarks/memory_benchmark.py --sizes 10000 100000 --output memory.json
+    python benchmarks/memory_benchmark.py --baseline memory.json --max-regression 0.3
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from fake_services import FakeShop, CallCounter, make_sheets_server, start_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+
+
+def read_sheet(args):
+    """Child process: one chunked read of the fake sheet under tracemalloc."""
+    import tracemalloc
+    sys.path.insert(0, SRC_DIR)
+    from run_entry import redirect_gspread
+    from sheets_client import SheetReader
+    from preprocess import HAVE_PANDAS, build_work_items
+
+    redirect_gspread(args.sheets_url)
+    if HAVE_PANDAS:
+        # Loaded lazily by get_new_rows; imported up front so it is not counted
+        import pandas  # noqa: F401
+    with open('credentials.json', 'w') as f:
+        json.dump({'type': 'service_account'}, f)
+
+    # Every row but the last `new_rows` was handled by earlier runs (see FakeShop.sheet)
+    new_from = args.size - args.new_rows
+    processed_ids = {str(8000000000 + i) if i % 20 != 7 else str(9000000000 + i) for i in range(new_from)}
+    reader = SheetReader(credentials_path='credentials.json', sheet_name=args.sheet_name,
+                         incremental=False, chunk_rows=args.chunk_rows)
+
+    tracemalloc.start()
+    work_items = 0
+    for chunk in reader.iter_chunks():
+        new_rows, id_col = reader.get_new_rows(chunk, processed_ids)
+        items, _ = build_work_items(new_rows, id_col)
+        work_items += len(items)
+        del chunk, new_rows, items
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    with open(args.result, 'w') as f:
+        json.dump({'work_items': work_items, 'peak_mb': peak / 1024 / 1024}, f)
+
+
+def run_case(size, args):
+    shop = FakeShop(size)
+    server = make_sheets_server(shop, CallCounter(), latency=0)
+    sheets_url = start_server(server)
+
+    workdir = tempfile.mkdtemp(prefix="bench_memory_")
+    result_path = os.path.join(workdir, 'result.json')
+    try:
+        with open(os.path.join(workdir, 'output.log'), 'w') as log:
+            completed = subprocess.run([
+                sys.executable, os.path.abspath(__file__), '--child',
+                '--size', str(size), '--new-rows', str(min(args.new_rows, size)),
+                '--chunk-rows', str(args.chunk_rows), '--sheets-url', sheets_url,
+                '--result', result_path,
+            ], cwd=workdir, stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout)
+        if completed.returncode != 0 or not os.path.exists(result_path):
+            with open(os.path.join(workdir, 'output.log')) as log:
+                tail = log.read()[-2000:]
+            raise RuntimeError(f"Reading {size} rows exited with {completed.returncode}:\n{tail}")
+        with open(result_path) as f:
+            result = json.load(f)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {'rows': size, 'new_rows': min(args.new_rows, size), 'chunk_rows': args.chunk_rows, **result}
+
+
+def find_regressions(results, baseline, max_regression):
+    previous = {(r['rows'], r['new_rows'], r['chunk_rows']): r for r in baseline}
+    regressions = []
+    for r in results:
+        before = previous.get((r['rows'], r['new_rows'], r['chunk_rows']))
+        if before and r['peak_mb'] > before['peak_mb'] * (1 + max_regression):
+            regressions.append(f"{r['rows']} rows: peak memory {before['peak_mb']:.1f}MB -> {r['peak_mb']:.1f}MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure peak memory while reading the sheet")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Sheet sizes in rows")
+    parser.add_argument("--new-rows", type=int, default=1000, help="Unprocessed rows at the end of each sheet")
+    parser.add_argument("--chunk-rows", type=int, default=int(os.getenv('SHEET_CHUNK_ROWS', 50000)),
+                        help="Rows per read (default: SHEET_CHUNK_ROWS or 50000)")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds before a single read is aborted")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.3,
+                        help="Allowed relative rise in peak memory before failing")
+    # Used by the per-size child processes
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--sheets-url", help=argparse.SUPPRESS)
+    parser.add_argument("--sheet-name", default="Benchmark Sheet", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        read_sheet(args)
+        return
+
+    results = []
+    for size in args.sizes:
+        print(f"Reading {size} rows ({min(args.new_rows, size)} new, chunks of {args.chunk_rows})...")
+        results.append(run_case(size, args))
+
+    print(f"\n{'Rows':>8} {'New':>7} {'Chunk':>7} {'Items':>7} {'Peak MB':>8}")
+    for r in results:
+        print(f"{r['rows']:>8} {r['new_rows']:>7} {r['chunk_rows']:>7} {r['work_items']:>7} {r['peak_mb']:>8.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\n[REGRESSION] " + "\n[REGRESSION] ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Offline benchmark for the sync entry points.
+
+Starts local Shopify and Google Sheets stand-ins (see fake_services.py),
+runs src/main.py and AliExpress_Shopify_Sync/main.py against synthetic
+datasets and reports rows/sec, API calls per row, p50/p99 per-row latency
+and peak RSS.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 1000 10000
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --max-regression 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from fake_services import FakeShop, CallCounter, PLANS, make_shopify_server, make_sheets_server, start_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_case(entry, mode, size, args):
+    shop = FakeShop(size)
+    counter = CallCounter()
+    latency = args.latency_ms / 1000
+    shopify_server = make_shopify_server(shop, counter, latency=latency, plan=args.plan)
+    sheets_server = make_sheets_server(shop, counter, latency=latency)
+    shopify_url = start_server(shopify_server)
+    sheets_url = start_server(sheets_server)
+
+    workdir = tempfile.mkdtemp(prefix=f"bench_{entry}_")
+    metrics_path = os.path.join(workdir, 'metrics.json')
+    try:
+        with open(os.path.join(workdir, 'output.log'), 'w') as log:
+            completed = subprocess.run([
+                sys.executable, os.path.join(BENCH_DIR, 'run_entry.py'),
+                '--entry', entry, '--mode', mode,
+                '--shopify-url', shopify_url, '--sheets-url', sheets_url,
+                '--concurrency', str(args.concurrency),
+                '--metrics', metrics_path,
+            ], cwd=workdir, stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout)
+        if completed.returncode != 0 or not os.path.exists(metrics_path):
+            with open(os.path.join(workdir, 'output.log')) as log:
+                tail = log.read()[-2000:]
+            raise RuntimeError(f"{entry}/{mode} exited with {completed.returncode}:\n{tail}")
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+    finally:
+        shopify_server.shutdown()
+        sheets_server.shutdown()
+        if not args.keep_workdirs:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    calls = counter.snapshot()
+    api_calls = sum(v for k, v in calls.items() if k != 'shopify_throttled')
+    return {
+        'entry': entry,
+        'mode': mode,
+        'rows': size,
+        'fulfilled': sum(1 for o in shop.orders if o['fulfilled']),
+        'rows_per_sec': size / metrics['wall_time'],
+        'api_calls_per_row': api_calls / size,
+        'calls': calls,
+        **metrics,
+    }
+
+
+def print_table(results):
+    print(f"\n{'Entry':<8} {'Mode':<7} {'Rows':>7} {'Fulfilled':>9} {'Rows/s':>9} {'Calls/row':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>7}")
+    for r in results:
+        p50 = f"{r['p50_row_latency'] * 1000:.1f}" if r['p50_row_latency'] is not None else '-'
+        p99 = f"{r['p99_row_latency'] * 1000:.1f}" if r['p99_row_latency'] is not None else '-'
+        print(f"{r['entry']:<8} {r['mode']:<7} {r['rows']:>7} {r['fulfilled']:>9} {r['rows_per_sec']:>9.1f} "
+              f"{r['api_calls_per_row']:>9.3f} {p50:>8} {p99:>8} {r['peak_rss_mb']:>7.1f}")
+    for r in results:
+        if r['error']:
+            print(f"[WARNING] {r['entry']}/{r['mode']}/{r['rows']} aborted after {r['wall_time']:.1f}s: {r['error'][:200]}")
+
+
+def find_regressions(results, baseline, max_regression):
+    """Compares throughput and calls per row with a previous --output file."""
+    previous = {(r['entry'], r['mode'], r['rows']): r for r in baseline}
+    regressions = []
+    for r in results:
+        before = previous.get((r['entry'], r['mode'], r['rows']))
+        if not before:
+            continue
+        if r['rows_per_sec'] < before['rows_per_sec'] * (1 - max_regression):
+            regressions.append(f"{r['entry']}/{r['mode']}/{r['rows']}: rows/sec "
+                               f"{before['rows_per_sec']:.1f} -> {r['rows_per_sec']:.1f}")
+        if r['api_calls_per_row'] > before['api_calls_per_row'] * (1 + max_regression):
+            regressions.append(f"{r['entry']}/{r['mode']}/{r['rows']}: calls/row "
+                               f"{before['api_calls_per_row']:.3f} -> {r['api_calls_per_row']:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync entry points against local fake services")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="Dataset sizes, e.g. 1000 10000 100000")
+    parser.add_argument("--entries", nargs="+", choices=("src", "legacy"), default=["src", "legacy"])
+    parser.add_argument("--modes", nargs="+", choices=("search", "bulk"), default=["search", "bulk"],
+                        help="Lookup modes for src/main.py (the legacy entry only searches)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Simulated latency per API call")
+    parser.add_argument("--plan", choices=sorted(PLANS), default="standard", help="Shopify rate limits to simulate")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds before a single run is aborted")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative drop in rows/sec or rise in calls/row before failing")
+    parser.add_argument("--keep-workdirs", action="store_true", help="Keep each run's working directory and output.log")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for entry in args.entries:
+            for mode in (args.modes if entry == 'src' else ['search']):
+                print(f"Running {entry}/{mode} with {size} rows...")
+                started = time.perf_counter()
+                results.append(run_case(entry, mode, size, args))
+                print(f"  done in {time.perf_counter() - started:.1f}s")
+
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\n[REGRESSION] " + "\n[REGRESSION] ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Runs one entry point against the fake services and writes its metrics.
+
+Started by run_benchmarks.py in a fresh process and working directory, so
+peak RSS and the on-disk state belong to this run only. Only the network
+endpoints are redirected; the sync code itself runs unmodified.
+
+Per-row latency is the time spent in the Shopify calls that carried the
+row: its lookup request plus its fulfillment request. Batched calls count
+in full for every row they carried.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import importlib.util
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, 'src')
+LEGACY_MAIN = os.path.join(REPO_ROOT, 'AliExpress_Shopify_Sync', 'main.py')
+
+GOOGLE_HOSTS = ('https://sheets.googleapis.com', 'https://www.googleapis.com')
+
+
+def instrument_client(latencies):
+    """Wraps the shared ShopifyClient's batched lookup and fulfillment calls with per-row timing."""
+    sys.path.insert(0, SRC_DIR)
+    import shopify_client
+
+    ShopifyClient = shopify_client.ShopifyClient
+    order_rows = {}
+    find_orders = ShopifyClient.find_orders_by_ali_ids
+    create_fulfillments = ShopifyClient.create_fulfillments
+
+    def timed_find(self, aliexpress_ids, errors=None):
+        started = time.perf_counter()
+        found = find_orders(self, aliexpress_ids, errors)
+        elapsed = time.perf_counter() - started
+        for ali_id in aliexpress_ids:
+            latencies[ali_id] += elapsed
+        for ali_id, order in found.items():
+            order_rows[order['id']] = ali_id
+        return found
+
+    def timed_create(self, fulfillments):
+        started = time.perf_counter()
+        outcomes = create_fulfillments(self, fulfillments)
+        elapsed = time.perf_counter() - started
+        for order, tracking_number, tracking_company in fulfillments:
+            latencies[order_rows.get(order['id'], order['id'])] += elapsed
+        return outcomes
+
+    ShopifyClient.find_orders_by_ali_ids = timed_find
+    ShopifyClient.create_fulfillments = timed_create
+
+
+def redirect_gspread(sheets_url):
+    """Points the gspread client that sheets_client builds at the fake Sheets server."""
+    import requests
+    import gspread
+    from google.auth.credentials import AnonymousCredentials
+    from google.oauth2.service_account import Credentials
+
+    class RedirectSession(requests.Session):
+        """Sends gspread's Sheets and Drive calls to the fake server."""
+
+        def request(self, method, url, *a, **kw):
+            for host in GOOGLE_HOSTS:
+                if url.startswith(host):
+                    url = sheets_url + url[len(host):]
+            return super().request(method, url, *a, **kw)
+
+    # sheets_client imports these when it connects
+    Credentials.from_service_account_file = lambda *a, **kw: AnonymousCredentials()
+    gspread.authorize = lambda creds: gspread.Client(
+        creds, http_client=lambda auth: gspread.HTTPClient(auth, session=RedirectSession())
+    )
+
+
+def run_src(args, latencies):
+    instrument_client(latencies)
+    import main as sync_main
+    redirect_gspread(args.sheets_url)
+
+    os.environ.update({
+        'SHOPIFY_SHOP_URL': args.shopify_url,
+        'SHOPIFY_ACCESS_TOKEN': 'benchmark',
+        'GOOGLE_SHEETS_CREDENTIALS_FILE': 'credentials.json',
+        'GOOGLE_SHEET_NAME': args.sheet_name,
+    })
+    sys.argv = ['main.py', '--no-precheck', '--full-read', '--concurrency', str(args.concurrency)]
+    if args.mode == 'bulk':
+        sys.argv.append('--bulk')
+    sync_main.main()
+
+
+def run_legacy(args, latencies):
+    instrument_client(latencies)
+    spec = importlib.util.spec_from_file_location('legacy_main', LEGACY_MAIN)
+    legacy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(legacy)
+
+    import googleapiclient.discovery
+    from google.auth.credentials import AnonymousCredentials
+    from google.oauth2.service_account import Credentials
+
+    # The legacy entry imports these when it builds the Sheets service
+    build = googleapiclient.discovery.build
+    googleapiclient.discovery.build = lambda *a, **kw: build(*a, **kw, client_options={'api_endpoint': args.sheets_url + '/'})
+    Credentials.from_service_account_file = lambda *a, **kw: AnonymousCredentials()
+
+    os.makedirs('config', exist_ok=True)
+    os.makedirs(legacy.LOG_DIR, exist_ok=True)
+    with open(legacy.CONFIG_PATH, 'w') as f:
+        json.dump({
+            'shopify': {'shop_url': args.shopify_url, 'api_version': '2024-01', 'access_token': 'benchmark'},
+            'google_sheets': {
+                'credentials_file': 'credentials.json',
+                'spreadsheet_id': args.sheet_id,
+                'worksheet_name': args.worksheet,
+                'columns': {'aliexpress_order_id': 'AliExpress Order No', 'tracking_number': 'Tracking Number'},
+            },
+            'settings': {
+                'ali_id_location_in_shopify': 'note_attributes',
+                'ali_id_attribute_name': 'AliExpress Order ID',
+                'dry_run': False,
+            },
+        }, f)
+    sys.argv = ['main.py']
+    legacy.main()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one sync entry point against the fake services")
+    parser.add_argument("--entry", choices=("src", "legacy"), required=True)
+    parser.add_argument("--mode", choices=("search", "bulk"), default="search")
+    parser.add_argument("--shopify-url", required=True)
+    parser.add_argument("--sheets-url", required=True)
+    parser.add_argument("--sheet-name", default="Benchmark Sheet")
+    parser.add_argument("--sheet-id", default="bench-sheet")
+    parser.add_argument("--worksheet", default="Sheet1")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--metrics", required=True, help="Where to write the metrics JSON")
+    args = parser.parse_args()
+
+    with open('credentials.json', 'w') as f:
+        json.dump({'type': 'service_account'}, f)
+
+    latencies = defaultdict(float)
+    error = None
+    started = time.perf_counter()
+    try:
+        if args.entry == 'src':
+            run_src(args, latencies)
+        else:
+            run_legacy(args, latencies)
+    except Exception as e:
+        # An entry point that dies mid-run (e.g. on an unhandled 429) is a result too
+        error = f"{type(e).__name__}: {e}"
+        print(f"[ERROR] Run aborted: {error}")
+    wall_time = time.perf_counter() - started
+
+    values = list(latencies.values())
+    with open(args.metrics, 'w') as f:
+        json.dump({
+            'wall_time': wall_time,
+            'error': error,
+            'rows_timed': len(values),
+            'p50_row_latency': percentile(values, 50),
+            'p99_row_latency': percentile(values, 99),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncShopifyClient:
+    """
+    Awaitable facade over ShopifyClient.
+
+    Each call runs the blocking client method on the pipeline's thread pool,
+    so many rows can wait on the network at the same time.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def find_orders_by_ali_ids(self, aliexpress_ids, errors=None):
+        return await asyncio.to_thread(self.client.find_orders_by_ali_ids, aliexpress_ids, errors)
+
+    async def create_fulfillments(self, fulfillments):
+        return await asyncio.to_thread(self.client.create_fulfillments, fulfillments)
+
+
+class AsyncPipeline:
+    """
+    Runs an async worker over many items with bounded concurrency.
+
+    Results are handed to on_result in input order, regardless of the order
+    in which workers finish, so reporting and processed-ID bookkeeping stay
+    identical to a sequential run.
+    """
+
+    def __init__(self, concurrency=4, lookahead=4):
+        self.concurrency = max(1, int(concurrency))
+        # How many items may be scheduled ahead of the oldest unfinished one
+        self.window = self.concurrency * max(1, int(lookahead))
+
+    def run(self, items, worker, on_result, should_stop=None):
+        """
+        Args:
+            items (iterable): Work items, consumed lazily.
+            worker (callable): Coroutine function called as worker(item).
+            on_result (callable): Called with each worker result, in input order.
+            should_stop (callable): Optional; once it returns True no new items
+                are started, but items already in flight still complete.
+        """
+        asyncio.run(self._run(items, worker, on_result, should_stop))
+
+    async def _run(self, items, worker, on_result, should_stop):
+        loop = asyncio.get_running_loop()
+        # Blocking client calls run on this pool; size it to the concurrency limit
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(item):
+            async with semaphore:
+                return await worker(item)
+
+        pending = deque()
+        for item in items:
+            if should_stop and should_stop():
+                break
+            pending.append(asyncio.ensure_future(run_one(item)))
+            if len(pending) >= self.window:
+                on_result(await pending.popleft())
+
+        while pending:
+            on_result(await pending.popleft())
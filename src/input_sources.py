@@ -0,0 +1,329 @@
+"""
+Where sheet rows come from.
+
+An input source hands main.sync_cycle its rows as ColumnTables of raw cell
+values indexed by row number (row 1 is the header), one chunk at a time:
+
+    check_for_changes(recheck_interval) -> (changed, reason)
+    iter_chunks()                       -> ColumnTables of rows, in order
+    get_new_rows(chunk, processed_ids)  -> (unprocessed rows, ID column)
+    save_watermark(chunk, processed_ids)   after each chunk is worked on
+    record_status(row_number, log_entry), write_statuses()
+                                        optional write-back of row outcomes
+    read_path, metrics
+
+SheetReader (sheets_client.py) reads a Google Sheet and LocalFileReader a
+local CSV or XLSX export. Both keep only the ID and tracking columns and
+read them in fixed-size chunks, so memory stays bounded however large the
+input is.
+"""
+import os
+import csv
+import json
+import time
+from preprocess import ID_COLUMNS, TRACKING_COLUMNS, ColumnTable, make_table, resolve_column, normalize_values
+from metrics import RunMetrics
+
+FILE_EXTENSIONS = ('.csv', '.xlsx')
+
+
+class InputSource:
+    """Shared row filtering and watermark bookkeeping for the input sources."""
+
+    read_path = None
+
+    def iter_chunks(self):
+        raise NotImplementedError
+
+    def record_status(self, row_number, log_entry):
+        """Queues a row's outcome for write_statuses(); sources that cannot be written to ignore it."""
+
+    def write_statuses(self):
+        """Writes the queued outcomes back into the source; returns how many rows were written."""
+        return 0
+
+    def get_new_rows(self, all_data, processed_ids):
+        """
+        Filters a chunk down to the rows that haven't been processed.
+
+        IDs are normalized and checked against `processed_ids` on the raw
+        value lists; only the surviving rows are copied into the returned
+        frame, so its size follows the number of new rows.
+
+        Args:
+            all_data (ColumnTable): A chunk from iter_chunks().
+            processed_ids (set): A set of AliExpress Order IDs that were already processed.
+
+        Returns:
+            tuple: (DataFrame of the new rows, or a ColumnTable without pandas; ID column name)
+        """
+        # Determine the ID column (flexible check)
+        id_col = resolve_column(list(all_data.columns), ID_COLUMNS)
+
+        if not id_col:
+            raise ValueError(f"Could not find an Order ID column. Available columns: {list(all_data.columns)}")
+
+        # Ensure IDs are treated as strings and stripped of whitespace (empty cells become '');
+        # written back so save_watermark sees the same values
+        ids = all_data[id_col] = normalize_values(all_data[id_col])
+        keep = [position for position, ali_id in enumerate(ids) if ali_id not in processed_ids]
+
+        data = {id_col: [ids[p] for p in keep]}
+        # Clean up tracking numbers if the column exists, for the new rows only
+        tracking_col = resolve_column(list(all_data.columns), TRACKING_COLUMNS, contains='tracking')
+        if tracking_col:
+            tracking = all_data[tracking_col]
+            data[tracking_col] = normalize_values([tracking[p] for p in keep])
+        index = all_data.index
+        return make_table(data, [index[p] for p in keep]), id_col
+
+
+def advance_watermark(data, processed_ids, watermark, anchor):
+    """
+    Moves the watermark past the leading rows of `data` that need no more
+    work (processed, or blank), stopping at the first pending row.
+
+    A row with a tracking number but no ID yet is pending too: the ID is
+    often filled in after the tracking number is pasted, and a row above
+    the watermark is never read again.
+
+    Returns:
+        tuple: (watermark row number, ID in that row, whether a pending row was found)
+    """
+    columns = list(data.columns)
+    id_col = resolve_column(columns, ID_COLUMNS) if not data.empty else None
+    if id_col:
+        tracking_col = resolve_column(columns, TRACKING_COLUMNS, contains='tracking')
+        tracking = normalize_values(data[tracking_col]) if tracking_col else [''] * len(data)
+        for row_number, value, tracking_number in zip(data.index, data[id_col], tracking):
+            ali_id = str(value).strip()
+            if (ali_id and ali_id not in processed_ids) or (not ali_id and tracking_number):
+                return watermark, anchor, True
+            watermark, anchor = row_number, ali_id
+    return watermark, anchor, False
+
+
+class LocalFileReader(InputSource):
+    """
+    Streams a local CSV or XLSX file (e.g. an AliExpress order export) in
+    chunks of `chunk_rows` rows.
+
+    Only the ID and tracking columns are kept. Like SheetReader, the last
+    row of the leading fully handled block is remembered in the state file,
+    so the next run (or a restarted backfill) skips straight past it.
+    """
+
+    def __init__(self, path, chunk_rows=50000, state_path=None, incremental=True, metrics=None):
+        self.path = path
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.state_path = state_path or os.getenv('SHEET_STATE_FILE', 'sheet_state.json')
+        self.state_key = f"file:{os.path.abspath(path)}"
+        self.incremental = incremental
+        self.read_path = None
+        self.metrics = metrics or RunMetrics()
+        self._last_read = None
+        self._pending = False
+
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in FILE_EXTENSIONS:
+            raise ValueError(f"Unsupported input file type {extension or '(none)'}; expected one of {', '.join(FILE_EXTENSIONS)}")
+        self.format = extension[1:]
+
+    def check_for_changes(self, recheck_interval=3600):
+        """Compares the file's size and modification time with the last completed run."""
+        stat = os.stat(self.path)
+        state = self._load_state() or {}
+        if state.get('signature') != [stat.st_size, stat.st_mtime]:
+            return True, "file modified"
+        if state.get('pending') and time.time() - state.get('checked_at', 0) >= recheck_interval:
+            return True, "retrying pending rows"
+        self.read_path = 'skipped'
+        return False, "file unchanged"
+
+    def iter_chunks(self):
+        """
+        Yields ColumnTables of at most `chunk_rows` rows holding the ID and
+        tracking columns, indexed by row number. Yields one empty table for a
+        file without data rows.
+        """
+        stat = os.stat(self.path)
+        header = self._read_header()
+        id_col = resolve_column(header, ID_COLUMNS)
+        if not id_col:
+            raise ValueError(f"Could not find an Order ID column. Available columns: {header}")
+        tracking_col = resolve_column(header, TRACKING_COLUMNS, contains='tracking')
+        columns = [c for c in (id_col, tracking_col) if c]
+
+        state = self._load_state() if self.incremental else None
+        watermark, anchor = 1, None
+        if state and state.get('header') == header and state.get('watermark', 1) > 1 and stat.st_size >= state.get('size', 0):
+            watermark, anchor = state['watermark'], state['anchor']
+        self._last_read = {'header': header, 'watermark': watermark, 'anchor': anchor,
+                           'signature': [stat.st_size, stat.st_mtime]}
+        self._pending = False
+
+        print(f"Reading {self.path} in chunks of {self.chunk_rows} rows...")
+        chunks = self._read_chunks(columns, watermark)
+        first = next(chunks, None)
+        if watermark > 1:
+            # The watermark row itself is re-read to verify nothing above it moved
+            if first is None or first.empty or normalize_values(first[id_col][:1])[0] != anchor:
+                print("Rows above the last watermark changed, reading the whole file.")
+                chunks.close()
+                self._last_read.update(watermark=1, anchor=None)
+                watermark = 1
+                chunks = self._read_chunks(columns, 1)
+                first = next(chunks, None)
+            else:
+                first = first.take(range(1, len(first)))
+                print(f"Incremental read from row {watermark + 1}.")
+        self.read_path = 'incremental' if watermark > 1 else 'full'
+
+        rows = 0
+        chunk = first
+        while chunk is not None:
+            rows += len(chunk)
+            self.metrics.inc('sheet_rows_read_total', len(chunk), path=self.read_path)
+            yield chunk
+            with self.metrics.timer('dataframe_build_seconds', path=self.format):
+                chunk = next(chunks, None)
+        if not rows:
+            yield ColumnTable({c: [] for c in columns}, [])
+        print(f"Finished reading {rows} rows from {self.path}.")
+
+        # Only a read that got to the end may let the next precheck skip the run
+        self._save_state({
+            'signature': self._last_read['signature'],
+            'checked_at': time.time(),
+            'pending': self._pending,
+        })
+
+    def _read_header(self):
+        if self.format == 'csv':
+            with open(self.path, newline='', encoding='utf-8-sig') as f:
+                return next(csv.reader(f), [])
+        workbook = _open_workbook(self.path)
+        try:
+            first_row = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        header = ['' if v is None else str(v) for v in first_row]
+        while header and header[-1] == '':
+            header.pop()
+        return header
+
+    def _read_chunks(self, columns, start_row):
+        """Yields tables from `start_row` (a sheet-style row number, 2 = first data row) down."""
+        next_row = max(start_row, 2)
+        if self.format == 'csv':
+            yield from self._read_csv(columns, next_row)
+            return
+
+        workbook = _open_workbook(self.path)
+        try:
+            sheet = workbook.active
+            header = [None if v is None else str(v) for v in next(sheet.iter_rows(max_row=1, values_only=True), ())]
+            positions = [header.index(c) for c in columns]
+            buffer = []
+            for values in sheet.iter_rows(min_row=next_row, values_only=True):
+                buffer.append(['' if i >= len(values) or values[i] is None else values[i] for i in positions])
+                if len(buffer) >= self.chunk_rows:
+                    yield _rows_to_table(buffer, columns, next_row)
+                    next_row += len(buffer)
+                    buffer = []
+            if buffer:
+                yield _rows_to_table(buffer, columns, next_row)
+        finally:
+            workbook.close()
+
+    def _read_csv(self, columns, next_row):
+        with open(self.path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            positions = [header.index(c) for c in columns]
+            for _ in range(next_row - 2):
+                if next(reader, None) is None:
+                    return
+            buffer = []
+            for values in reader:
+                buffer.append([values[i] if i < len(values) else '' for i in positions])
+                if len(buffer) >= self.chunk_rows:
+                    yield _rows_to_table(buffer, columns, next_row)
+                    next_row += len(buffer)
+                    buffer = []
+            if buffer:
+                yield _rows_to_table(buffer, columns, next_row)
+
+    def save_watermark(self, data, processed_ids):
+        """
+        Advances the watermark over this chunk's leading handled rows and
+        persists it. Once a pending row is seen, later chunks leave it alone.
+        The file signature checked by check_for_changes() is saved by
+        iter_chunks() after the last chunk.
+        """
+        if not self._last_read:
+            return
+        if not self._pending:
+            watermark, anchor, self._pending = advance_watermark(
+                data, processed_ids, self._last_read['watermark'], self._last_read['anchor'])
+            self._last_read.update(watermark=int(watermark), anchor=anchor)
+        self._save_state({
+            'header': self._last_read['header'],
+            'watermark': self._last_read['watermark'],
+            'anchor': self._last_read['anchor'],
+            'size': self._last_read['signature'][0],
+        })
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f).get(self.state_key)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Ignoring unreadable sheet state {self.state_path}: {e}")
+            return None
+
+    def _save_state(self, file_state):
+        state = {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+        state.setdefault(self.state_key, {}).update(file_state)
+
+        # Write-then-rename so a crash never leaves a truncated state file
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def _rows_to_table(rows, columns, first_row):
+    return ColumnTable({c: [row[i] for row in rows] for i, c in enumerate(columns)},
+                       range(first_row, first_row + len(rows)))
+
+
+def _open_workbook(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportError("Reading .xlsx files requires openpyxl (pip install openpyxl)")
+    # Read-only mode streams rows instead of loading the whole workbook
+    return load_workbook(path, read_only=True, data_only=True)
+
+
+def open_input_source(input_file=None, incremental=True, write_back=None):
+    """Returns a LocalFileReader for `input_file`, else the Google Sheet reader."""
+    if input_file:
+        if write_back:
+            print("[WARNING] Status write-back only applies to the Google Sheet, not to local files.")
+        return LocalFileReader(
+            input_file,
+            chunk_rows=int(os.getenv('INPUT_CHUNK_ROWS', 50000)),
+            incremental=incremental,
+        )
+    from sheets_client import SheetReader
+    return SheetReader(incremental=incremental, write_back=write_back)
@@ -1,52 +1,416 @@
 import os
-import json
 import argparse
-import csv
 from datetime import datetime
 from dotenv import load_dotenv
-from sheets_client import SheetReader
+from input_sources import open_input_source
 from shopify_client import ShopifyClient
+from async_engine import AsyncShopifyClient, AsyncPipeline
+from processed_store import ProcessedStore
+from preprocess import build_work_items
+from watch import Watcher
+from metrics import RunMetrics
+from reports import ReportWriter
+from work_queue import WorkQueue
+from negative_cache import NegativeCache, NEGATIVE_CACHE_DB
 
 # Constants
-PROCESSED_FILE = "processed_orders.json"
+PROCESSED_DB = "processed_orders.db"
+PROCESSED_FILE = "processed_orders.json" # Legacy store, migrated into PROCESSED_DB on first run
+WORK_QUEUE_DB = "work_queue.db"
 LOGS_DIR = "logs"
 
-def load_processed_ids():
-    if os.path.exists(PROCESSED_FILE):
-        try:
-            with open(PROCESSED_FILE, 'r') as f:
-                return set(json.load(f))
-        except:
-            return set()
-    return set()
-
-def save_processed_id(order_id):
-    current = load_processed_ids()
-    current.add(str(order_id))
-    with open(PROCESSED_FILE, 'w') as f:
-        json.dump(list(current), f)
-
-def generate_report(results):
-    if not os.path.exists(LOGS_DIR):
-        os.makedirs(LOGS_DIR)
-        
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = os.path.join(LOGS_DIR, f"report_{timestamp}.csv")
-    
-    headers = ['Timestamp', 'AliExpress ID', 'Tracking Number', 'Shopify Order Name', 'Status', 'Message']
-    
+def open_work_queue():
+    """Opens the per-row work queue that lets an interrupted run resume (see work_queue.WorkQueue)."""
+    return WorkQueue(
+        os.getenv('WORK_QUEUE_DB', WORK_QUEUE_DB),
+        commit_every=int(os.getenv('WORK_QUEUE_COMMIT_EVERY', 200)),
+        commit_interval=float(os.getenv('WORK_QUEUE_COMMIT_INTERVAL', 2)),
+    )
+
+def open_negative_cache():
+    """Opens the cache of IDs that matched no order, or None when disabled (NEGATIVE_CACHE_BASE_DELAY=0)."""
+    base_delay = float(os.getenv('NEGATIVE_CACHE_BASE_DELAY', 3600))
+    if base_delay <= 0:
+        return None
+    return NegativeCache(
+        os.getenv('NEGATIVE_CACHE_DB', NEGATIVE_CACHE_DB),
+        base_delay=base_delay,
+        max_delay=float(os.getenv('NEGATIVE_CACHE_MAX_DELAY', 7 * 86400)),
+    )
+
+def open_report():
+    """Starts this run's streaming report (see reports.ReportWriter)."""
+    formats = [f.strip() for f in os.getenv('REPORT_FORMATS', 'csv').split(',') if f.strip()]
+    return ReportWriter(
+        LOGS_DIR,
+        formats=formats,
+        fsync_interval=float(os.getenv('REPORT_FSYNC_INTERVAL', 5)),
+        keep=int(os.getenv('REPORT_KEEP', 30)),
+    ).open()
+
+async def process_batch(shopify, items, orders_by_id, dry_run, deferred=None, lookup_errors=None):
+    """
+    Updates the fulfillments of a batch of sheet rows whose orders were
+    already looked up; all fulfillments in the batch share one request.
+
+    Args:
+        shopify (AsyncShopifyClient): Client used for the update.
+        items (list): WorkItems, in sheet order.
+        orders_by_id (dict): AliExpress ID -> matched order.
+        deferred (dict): AliExpress ID -> next retry time, for rows skipped
+            because they matched nothing on earlier runs.
+        lookup_errors (set): AliExpress IDs whose order search failed.
+
+    Returns:
+        list: The report entries for these rows, in the same order.
+    """
+    log_entries = []
+    to_fulfill = []
+    for item in items:
+        log_entry = {
+            'Timestamp': datetime.now().isoformat(),
+            'AliExpress ID': item.ali_id,
+            'Tracking Number': item.tracking_number,
+            'Shopify Order Name': 'N/A',
+            'Status': 'Failed',
+            'Message': ''
+        }
+        log_entries.append(log_entry)
+        shopify_order = orders_by_id.get(item.ali_id)
+
+        if not item.tracking_number:
+            log_entry['Message'] = "No tracking number found in row."
+        elif deferred and item.ali_id in deferred:
+            log_entry['Status'] = 'Skipped'
+            log_entry['Message'] = f"No Shopify Order found on earlier runs, next retry after {deferred[item.ali_id]:%Y-%m-%d %H:%M}."
+        elif not shopify_order and lookup_errors and item.ali_id in lookup_errors:
+            log_entry['Message'] = "Shopify Order search failed, will retry next run."
+        elif not shopify_order:
+            log_entry['Message'] = "Could not find Shopify Order for AliExpress ID."
+        elif dry_run:
+            log_entry['Shopify Order Name'] = shopify_order['name']
+            log_entry['Status'] = 'Skipped'
+            log_entry['Message'] = "Dry Run - Match found, no update performed."
+        else:
+            log_entry['Shopify Order Name'] = shopify_order['name']
+            to_fulfill.append((log_entry, shopify_order, item))
+
+    # 4. Update Fulfillment
+    if to_fulfill:
+        outcomes = await shopify.create_fulfillments(
+            [(order, item.tracking_number, item.carrier) for log_entry, order, item in to_fulfill]
+        )
+        for (log_entry, order, item), (ok, message) in zip(to_fulfill, outcomes):
+            log_entry['Status'] = 'Success' if ok else 'Failed'
+            log_entry['Message'] = message
+
+    return log_entries
+
+def save_metrics(metrics, rows):
+    """
+    Writes the run's metrics to logs/metrics_<timestamp>.json, and to the
+    Prometheus textfile named by METRICS_TEXTFILE when set. Idle watch
+    cycles only refresh the textfile.
+    """
+    metrics.set_gauge('run_rows', rows)
     try:
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(results)
-        print(f"\n[REPORT] Detailed report saved to: {filename}")
+        if rows:
+            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            filename = os.path.join(LOGS_DIR, f"metrics_{timestamp}.json")
+            metrics.write_json(filename)
+            print(f"[METRICS] Run metrics saved to: {filename}")
+            summary = metrics.summary()
+            if summary:
+                print(summary)
+        textfile = os.getenv('METRICS_TEXTFILE')
+        if textfile:
+            metrics.write_prometheus(textfile)
     except Exception as e:
-        print(f"[ERROR] Failed to save report: {e}")
+        print(f"[WARNING] Failed to save metrics: {e}")
+
+def print_result(log_entry):
+    """Prints the outcome of one processed row."""
+    ali_id = log_entry['AliExpress ID']
+    if not log_entry['Tracking Number'] or (log_entry['Status'] == 'Skipped' and log_entry['Shopify Order Name'] == 'N/A'):
+        print(f"Skipping {ali_id}: {log_entry['Message']}")
+        return
+
+    print(f"Processing AliExpress Order: {ali_id} -> Tracking: {log_entry['Tracking Number']}")
+    if log_entry['Shopify Order Name'] == 'N/A':
+        print(f"  [X] {log_entry['Message']}")
+        return
+
+    print(f"  [!] Match Found: {log_entry['Shopify Order Name']}")
+    if log_entry['Status'] == 'Skipped':
+        print(f"  [DRY RUN] {log_entry['Message']}")
+    elif log_entry['Status'] == 'Success':
+        print(f"  [SUCCESS] {log_entry['Message']}")
+    else:
+        print(f"  [ERROR] {log_entry['Message']}")
+
+def run_sync(args, sheets, shopify, processed_store, processed_ids, concurrency, should_stop=None, metrics=None):
+    """
+    Runs one sync cycle: precheck, read, look up and fulfill.
+
+    Args:
+        processed_ids (set): Already processed IDs; updated in place.
+        should_stop (callable): When it returns True, no new batches are
+            started and in-flight ones are allowed to finish.
+        metrics (RunMetrics): Optional; collects this cycle's metrics
+            (a fresh instance is used otherwise).
+
+    Returns:
+        int: Number of rows that were worked on (0 for an idle cycle).
+    """
+    # Fresh metrics per cycle, shared by both clients
+    metrics = metrics or RunMetrics()
+    sheets.metrics = shopify.metrics = metrics
+    shopify.reset_run_caches()
+    try:
+        queue = open_work_queue()
+    except Exception as e:
+        print(f"[WARNING] Work queue unavailable, looking up every row: {e}")
+        queue = None
+    try:
+        negative_cache = open_negative_cache()
+    except Exception as e:
+        print(f"[WARNING] Negative cache unavailable, retrying every unmatched row: {e}")
+        negative_cache = None
+    rows = 0
+    try:
+        rows = sync_cycle(args, sheets, shopify, processed_store, processed_ids, concurrency, metrics, should_stop,
+                          queue, negative_cache)
+        return rows
+    finally:
+        if queue:
+            # Commits the transitions still buffered
+            queue.close()
+        if negative_cache:
+            negative_cache.close()
+        save_metrics(metrics, rows)
+
+def sync_cycle(args, sheets, shopify, processed_store, processed_ids, concurrency, metrics, should_stop=None,
+               queue=None, negative_cache=None):
+    # 0. Precheck: skip the whole run if the sheet has not changed
+    if not args.no_precheck:
+        try:
+            with metrics.phase('precheck'):
+                changed, reason = sheets.check_for_changes(int(os.getenv('SHEET_RECHECK_INTERVAL', 3600)))
+            print(f"Precheck: {reason}.")
+            if not changed:
+                print(f"\n--- Batch Complete ---")
+                print(f"Read path: {sheets.read_path}")
+                return 0
+        except Exception as e:
+            print(f"[WARNING] Precheck failed, reading sheet anyway: {e}")
+
+    counts = {'success': 0, 'fail': 0, 'skipped': 0}
+    async_shopify = AsyncShopifyClient(shopify)
+    report = None
+
+    def process_rows(new_rows, id_col):
+        """Steps 2-4 for one chunk of new rows; returns the number of rows worked on."""
+        nonlocal report
+
+        # 2. Process Rows
+        with metrics.phase('preprocess'):
+            items, dropped = build_work_items(new_rows, id_col)
+        if dropped['missing_id'] or dropped['duplicates']:
+            print(f"Ignored {dropped['missing_id']} rows without an ID and {dropped['duplicates']} duplicate rows.")
+
+        row_numbers = {item.ali_id: item.row_number for item in items}
+
+        # Resume: rows matched by an interrupted run keep their order and skip the lookup
+        orders_by_id = {}
+        if queue and items:
+            orders_by_id = queue.enqueue(items)
+            if orders_by_id:
+                print(f"Resuming {len(orders_by_id)} rows matched by a previous run.")
+
+        # Rows that matched nothing recently wait for their retry time instead of being searched again
+        deferred = {}
+        if negative_cache:
+            deferred = negative_cache.deferred(item.ali_id for item in items
+                                               if item.tracking_number and item.ali_id not in orders_by_id)
+            # Orders the webhook receiver has seen since are matched for free
+            if deferred and shopify.local_index is not None:
+                found = shopify.find_in_local_index(list(deferred))
+                if found:
+                    metrics.inc('shopify_lookups_total', len(found), source='local_index')
+                    orders_by_id.update(found)
+                    negative_cache.forget(found)
+                    if queue:
+                        queue.mark_matched(found)
+                    for ali_id in found:
+                        del deferred[ali_id]
+            metrics.inc('shopify_lookups_total', len(deferred), source='negative_cache')
+            if deferred:
+                print(f"Skipping {len(deferred)} rows that matched no order on earlier runs.")
+
+        # 3. Find Shopify Orders, one request per chunk of IDs
+        lookup_ids = [item.ali_id for item in items
+                      if item.tracking_number and item.ali_id not in orders_by_id and item.ali_id not in deferred]
+        chunk_size = shopify.lookup_batch_size
+        chunks = [lookup_ids[i:i + chunk_size] for i in range(0, len(lookup_ids), chunk_size)]
+
+        lookup_errors = set()
+
+        async def lookup(chunk):
+            errors = set()
+            return chunk, await async_shopify.find_orders_by_ali_ids(chunk, errors), errors
+
+        def on_lookup(result):
+            chunk, found, errors = result
+            orders_by_id.update(found)
+            lookup_errors.update(errors)
+            # Only searches that completed without a match count as misses
+            missing = [ali_id for ali_id in chunk if ali_id not in found and ali_id not in errors]
+            if queue:
+                queue.mark_matched(found)
+                for ali_id in missing:
+                    queue.mark_failed(ali_id, "Could not find Shopify Order for AliExpress ID.")
+                for ali_id in errors:
+                    queue.mark_failed(ali_id, "Shopify Order search failed, will retry next run.")
+            if negative_cache:
+                negative_cache.forget(found)
+                negative_cache.record_misses(missing)
+
+        if chunks:
+            print(f"  Searching Shopify for {len(lookup_ids)} orders in {len(chunks)} requests...")
+            with metrics.phase('lookup'):
+                AsyncPipeline(concurrency).run(chunks, lookup, on_lookup, should_stop)
+
+        async def worker(batch):
+            return await process_batch(async_shopify, batch, orders_by_id, args.dry_run, deferred, lookup_errors)
+
+        def on_result(log_entries):
+            # Called in sheet order, so reporting and saved IDs match a sequential run
+            for log_entry in log_entries:
+                print_result(log_entry)
+                if report:
+                    report.write(log_entry)
+                if not args.dry_run:
+                    sheets.record_status(row_numbers[log_entry['AliExpress ID']], log_entry)
+                metrics.inc('rows_total', status=log_entry['Status'].lower())
+                if log_entry['Status'] == 'Success':
+                    processed_store.add(log_entry['AliExpress ID'], log_entry['Shopify Order Name'], log_entry['Tracking Number'])
+                    processed_ids.add(log_entry['AliExpress ID'])
+                    if queue:
+                        queue.mark_fulfilled(log_entry['AliExpress ID'], log_entry['Message'])
+                elif log_entry['Status'] == 'Failed' and queue and log_entry['AliExpress ID'] in orders_by_id:
+                    queue.mark_failed(log_entry['AliExpress ID'], log_entry['Message'])
+                if log_entry['AliExpress ID'] in deferred and log_entry['Status'] == 'Skipped':
+                    counts['skipped'] += 1
+                elif log_entry['Status'] in ('Success', 'Skipped'):
+                    counts['success'] += 1
+                else:
+                    counts['fail'] += 1
+
+        # 4. Update Fulfillments
+        batch_size = shopify.fulfillment_batch_size
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        if batches:
+            if report is None:
+                # Rows are streamed to the report as they complete, so a crash keeps them
+                try:
+                    report = open_report()
+                except Exception as e:
+                    print(f"[ERROR] Failed to open report, continuing without one: {e}")
+                    report = False
+            with metrics.phase('fulfill'):
+                AsyncPipeline(concurrency).run(batches, worker, on_result, should_stop)
+        return len(items)
+
+    # 1. Read Data, one chunk at a time
+    rows = 0
+    read_any = False
+    snapshot_taken = False
+    completed = False
+    data_chunks = sheets.iter_chunks()
+    try:
+        while not (should_stop and should_stop()):
+            try:
+                with metrics.phase('read'):
+                    all_data = next(data_chunks, None)
+                if all_data is None:
+                    completed = True
+                    break
+                if all_data.empty:
+                    print("No data to process.")
+                    # Remember the sheet state so the next precheck can skip
+                    sheets.save_watermark(all_data, set())
+                    continue
+
+                # Pick up IDs recorded since the last chunk (or by another process)
+                processed_ids |= processed_store.load_new_ids()
+                with metrics.phase('filter'):
+                    new_rows, id_col = sheets.get_new_rows(all_data, processed_ids)
+
+                print(f"Found {len(new_rows)} new rows to process.")
+
+            except Exception as e:
+                print(f"Error reading sheets: {e}")
+                break
+            read_any = True
+
+            # Optional: resolve every lookup from a single bulk snapshot, taken once per run
+            if args.bulk and not new_rows.empty and not snapshot_taken:
+                snapshot_taken = True
+                shopify.order_index = None
+                try:
+                    print("Starting bulk snapshot of open orders...")
+                    with metrics.phase('bulk_snapshot'):
+                        shopify.load_open_orders_snapshot()
+                except Exception as e:
+                    print(f"[WARNING] Bulk snapshot failed, falling back to per-row search: {e}")
+            if shopify.order_index is not None:
+                # The snapshot answers every lookup for free, so it bypasses the negative cache
+                negative_cache = None
+
+            rows += process_rows(new_rows, id_col)
+
+            # Skip fully handled rows on the next read
+            try:
+                sheets.save_watermark(all_data, processed_ids)
+            except Exception as e:
+                print(f"[WARNING] Failed to save sheet watermark: {e}")
+            # Release this chunk before the next one is read, so only one is held at a time
+            del all_data, new_rows
+    finally:
+        data_chunks.close()
+        # 5. Write statuses back to the sheet (optional), all rows in one request
+        try:
+            with metrics.phase('write_back'):
+                written = sheets.write_statuses()
+            if written:
+                print(f"Wrote the status of {written} rows back to the sheet.")
+        except Exception as e:
+            print(f"[WARNING] Failed to write statuses back to the sheet: {e}")
+        if report:
+            report.close(complete=completed and not (should_stop and should_stop()))
+
+    if not read_any:
+        return 0
+
+    print(f"\n--- Batch Complete ---")
+    print(f"Read path: {sheets.read_path}")
+    print(f"Success: {counts['success']}")
+    print(f"Failed: {counts['fail']}")
+    if counts['skipped']:
+        print(f"Skipped (unmatched, awaiting retry): {counts['skipped']}")
+    return rows
 
 def main():
     parser = argparse.ArgumentParser(description="Sync AliExpress Tracking to Shopify")
     parser.add_argument("--dry-run", action="store_true", help="Run without making changes to Shopify")
+    parser.add_argument("--bulk", action="store_true", help="Snapshot open orders with one bulk operation instead of searching per row")
+    parser.add_argument("--full-read", action="store_true", help="Ignore the saved row watermark and read the whole sheet")
+    parser.add_argument("--input", help="Read rows from a local CSV/XLSX export instead of the Google Sheet (default: INPUT_FILE)")
+    parser.add_argument("--write-back", action="store_true", help="Write each row's status, Shopify order and message back into the sheet (default: SHEET_WRITE_BACK)")
+    parser.add_argument("--no-precheck", action="store_true", help="Always read the sheet, even if it has not changed since the last run")
+    parser.add_argument("--concurrency", type=int, help="Number of rows processed at once (default: SYNC_CONCURRENCY or 4)")
+    parser.add_argument("--watch", action="store_true", help="Keep running and poll the sheet until stopped (SIGTERM/Ctrl+C)")
+    parser.add_argument("--interval", type=float, help="Seconds between polls in watch mode (default: WATCH_INTERVAL or 300)")
     args = parser.parse_args()
 
     load_dotenv()
@@ -68,109 +432,35 @@ def main():
 
     # Initialize Clients
     try:
-        sheets = SheetReader()
-        shopify = ShopifyClient()
+        sheets = open_input_source(args.input or os.getenv('INPUT_FILE'), incremental=not args.full_read,
+                                   write_back=args.write_back or None)
+        concurrency = args.concurrency or int(os.getenv('SYNC_CONCURRENCY', 4))
+        # Every concurrent row needs its own pooled connection
+        shopify = ShopifyClient(pool_size=max(concurrency, int(os.getenv('SHOPIFY_POOL_SIZE', 10))))
+        webhook_db = os.getenv('WEBHOOK_INDEX_DB')
+        if webhook_db and os.path.exists(webhook_db):
+            from webhook_server import WebhookOrderIndex
+            shopify.local_index = WebhookOrderIndex(webhook_db, shopify.id_location, shopify.id_attribute)
+        processed_store = ProcessedStore(PROCESSED_DB, legacy_json_path=PROCESSED_FILE)
     except Exception as e:
         print(f"Initialization Error: {e}")
         return
 
-    # 1. Read Data
+    processed_ids = processed_store.load_ids()
     try:
-        all_data = sheets.get_data()
-        if all_data.empty:
-            print("No data to process.")
-            return
-            
-        processed_ids = load_processed_ids()
-        new_rows, id_col = sheets.get_new_rows(all_data, processed_ids)
-        
-        print(f"Found {len(new_rows)} new rows to process.")
-        
-    except Exception as e:
-        print(f"Error reading sheets: {e}")
-        return
-
-    # 2. Process Rows
-    success_count = 0
-    fail_count = 0
-    results = [] # Store results for reporting
-    
-    for index, row in new_rows.iterrows():
-        ali_id = str(row[id_col])
-        # Try to find tracking number column dynamically or assume standard
-        tracking_col = next((c for c in row.keys() if 'tracking' in c.lower()), None)
-        tracking_number = str(row[tracking_col]) if tracking_col else None
-        
-        log_entry = {
-            'Timestamp': datetime.now().isoformat(),
-            'AliExpress ID': ali_id,
-            'Tracking Number': tracking_number,
-            'Shopify Order Name': 'N/A',
-            'Status': 'Failed',
-            'Message': ''
-        }
-        
-        if not tracking_number:
-            msg = "No tracking number found in row."
-            print(f"Skipping {ali_id}: {msg}")
-            log_entry['Message'] = msg
-            results.append(log_entry)
-            fail_count += 1
-            continue
-
-        print(f"Processing AliExpress Order: {ali_id} -> Tracking: {tracking_number}")
-
-        # 3. Find Shopify Order
-        print(f"  Searching Shopify...")
-        # Use new robust search
-        shopify_order = shopify.find_order_by_ali_id(ali_id)
-        
-        if not shopify_order:
-            msg = "Could not find Shopify Order for AliExpress ID."
-            print(f"  [X] {msg}")
-            log_entry['Message'] = msg
-            results.append(log_entry)
-            fail_count += 1
-            continue
-            
-        shopify_order_id = shopify_order['id']
-        shopify_order_name = shopify_order['name']
-        log_entry['Shopify Order Name'] = shopify_order_name
-        
-        print(f"  [!] Match Found: {shopify_order_name} (ID: {shopify_order_id})")
-
-        # 4. Update Fulfillment
-        if args.dry_run:
-            msg = "Dry Run - Match found, no update performed."
-            print(f"  [DRY RUN] {msg}")
-            log_entry['Status'] = 'Skipped'
-            log_entry['Message'] = msg
-            results.append(log_entry)
-            success_count += 1
+        if args.watch:
+            # Clients, token and connection pools stay warm between cycles
+            watcher = Watcher(
+                interval=args.interval or float(os.getenv('WATCH_INTERVAL', 300)),
+                max_interval=float(os.getenv('WATCH_MAX_INTERVAL', 1800)),
+            )
+            watcher.install_signal_handlers()
+            watcher.run(lambda: run_sync(args, sheets, shopify, processed_store, processed_ids,
+                                         concurrency, watcher.is_stopping))
         else:
-            if shopify.update_fulfillment(shopify_order_id, tracking_number):
-                msg = "Successfully updated tracking."
-                print(f"  [SUCCESS] {msg}")
-                log_entry['Status'] = 'Success'
-                log_entry['Message'] = msg
-                results.append(log_entry)
-                
-                save_processed_id(ali_id)
-                success_count += 1
-            else:
-                msg = "Failed to update fulfillment via API."
-                print(f"  [ERROR] {msg}")
-                log_entry['Message'] = msg
-                results.append(log_entry)
-                fail_count += 1
-
-    # Generate Report
-    if results:
-        generate_report(results)
-
-    print(f"\n--- Batch Complete ---")
-    print(f"Success: {success_count}")
-    print(f"Failed: {fail_count}")
+            run_sync(args, sheets, shopify, processed_store, processed_ids, concurrency)
+    finally:
+        processed_store.close()
 
 if __name__ == "__main__":
     main()
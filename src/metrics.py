@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_PREFIX = "aliexpress_sync_"
+
+
+class RunMetrics:
+    """
+    Counters, gauges and latency histograms for one sync run.
+
+    Shared by SheetReader, ShopifyClient and main; every method is
+    thread-safe so pipeline workers can record into the same instance.
+    Written out as JSON after each run and, optionally, as a Prometheus
+    textfile for node_exporter's textfile collector.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'max': 0.0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the duration of the block into histogram `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def phase(self, name):
+        """Times one stage of the run (read, lookup, fulfill, ...)."""
+        return self.timer('phase_seconds', phase=name)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'duration': time.time() - self.started_at,
+                'counters': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.counters.items())],
+                'gauges': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(self.gauges.items())],
+                'histograms': [
+                    {'name': n, 'labels': dict(l), 'count': h['count'], 'sum': h['sum'], 'max': h['max'],
+                     'buckets': dict(zip(map(str, self.buckets), h['buckets']))}
+                    for (n, l), h in sorted(self.histograms.items())
+                ],
+            }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path):
+        """Writes the Prometheus text exposition format, with cumulative histogram buckets."""
+        lines = []
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                lines.extend(f"{METRIC_PREFIX}{name}{_labels(l)} {v}" for (n, l), v in sorted(self.counters.items()) if n == name)
+            for name in sorted({n for n, _ in self.gauges}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+                lines.extend(f"{METRIC_PREFIX}{name}{_labels(l)} {v}" for (n, l), v in sorted(self.gauges.items()) if n == name)
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                for (n, l), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, h['buckets']):
+                        cumulative += count
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{_labels(l + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_labels(l + (('le', '+Inf'),))} {h['count']}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{_labels(l)} {h['sum']}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{_labels(l)} {h['count']}")
+        lines.append(f"# TYPE {METRIC_PREFIX}last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}last_run_timestamp_seconds {self.started_at}")
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def summary(self):
+        """Short human-readable digest for the end-of-run output."""
+        data = self.to_dict()
+        lines = []
+        for h in data['histograms']:
+            if h['name'] == 'phase_seconds':
+                lines.append(f"  {h['labels']['phase']}: {h['sum']:.2f}s")
+        totals = {}
+        for c in data['counters']:
+            if c['name'] == 'shopify_graphql_cost_points_total' and c['labels'].get('kind') != 'actual':
+                continue
+            totals[c['name']] = totals.get(c['name'], 0) + c['value']
+        for name, label in (('shopify_requests_total', 'API requests'), ('shopify_retries_total', 'Retries'),
+                            ('shopify_throttle_wait_seconds_total', 'Throttle wait (s)'),
+                            ('shopify_graphql_cost_points_total', 'GraphQL cost used')):
+            if name in totals:
+                lines.append(f"  {label}: {round(totals[name], 2)}")
+        return "\n".join(lines)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (f'{k}="' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _write_atomic(path, text):
+    # The textfile collector may read at any time; never expose a partial file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,196 @@
+"""
+Runs the sync for several store/sheet pairs in parallel, one process each.
+
+Every store gets its own ShopifyClient (and so its own rate limiter), its
+own processed-orders database, sheet state, reports and log file under its
+state directory, and a combined summary is printed and saved at the end.
+Total wall time is that of the slowest store instead of the sum.
+
+Usage:
+    python src/multi_store.py --config stores.json
+    python src/multi_store.py --config stores.json --dry-run --processes 2
+
+stores.json:
+    {
+        "stores": [
+            {
+                "name": "store-a",
+                "shop_url": "store-a.myshopify.com",
+                "access_token_env": "STORE_A_TOKEN",
+                "credentials_file": "credentials.json",
+                "sheet_name": "Store A Tracking",
+                "env": {"SHOPIFY_LOOKUP_BATCH_SIZE": "50"}
+            }
+        ]
+    }
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from datetime import datetime
+from contextlib import redirect_stdout, redirect_stderr
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+LOGS_DIR = "logs"
+
+
+def load_stores(config_path):
+    """Reads and validates the store list. Relative paths are resolved against the config file."""
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    stores = config.get('stores', [])
+    names = set()
+    for store in stores:
+        missing = [k for k in ('name', 'shop_url', 'sheet_name') if not store.get(k)]
+        if missing:
+            raise ValueError(f"Store entry {store.get('name', '?')} is missing: {', '.join(missing)}")
+        if store['name'] in names:
+            raise ValueError(f"Duplicate store name: {store['name']}")
+        names.add(store['name'])
+        if not store.get('access_token') and not os.getenv(store.get('access_token_env', '')):
+            raise ValueError(f"Store {store['name']} has no access_token and its access_token_env is not set")
+
+        store['state_dir'] = os.path.join(base_dir, store.get('state_dir') or os.path.join('stores', store['name']))
+        credentials = store.get('credentials_file') or os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE', 'credentials.json')
+        store['credentials_file'] = os.path.join(base_dir, credentials)
+    return stores
+
+
+def run_store(store, options):
+    """
+    Syncs one store in the current (pool worker) process.
+
+    Relative state paths used by main.run_sync resolve inside the store's
+    state directory, and all output goes to <state_dir>/sync.log.
+
+    Returns:
+        dict: Summary row for the combined report.
+    """
+    # Imported here so the parent process stays light
+    from main import run_sync, PROCESSED_DB, PROCESSED_FILE
+    from sheets_client import SheetReader
+    from shopify_client import ShopifyClient
+    from processed_store import ProcessedStore
+    from metrics import RunMetrics
+
+    result = {'store': store['name'], 'rows': 0, 'success': 0, 'failed': 0, 'skipped': 0,
+              'error': None, 'state_dir': store['state_dir']}
+    started = time.perf_counter()
+
+    os.makedirs(store['state_dir'], exist_ok=True)
+    # Worker processes are not reused (max_tasks_per_child=1), so these do not leak into other stores
+    os.environ.update({k: str(v) for k, v in (store.get('env') or {}).items()})
+    os.chdir(store['state_dir'])
+
+    with open('sync.log', 'a') as log, redirect_stdout(log), redirect_stderr(log):
+        print(f"\n=== {datetime.now().isoformat()} {store['name']} ===")
+        try:
+            concurrency = int(store.get('concurrency') or options['concurrency'] or os.getenv('SYNC_CONCURRENCY', 4))
+            sheets = SheetReader(
+                credentials_path=store['credentials_file'],
+                sheet_name=store['sheet_name'],
+                incremental=not options['full_read'],
+                write_back=options['write_back'] or None,
+            )
+            shopify = ShopifyClient(
+                shop_url=store['shop_url'],
+                access_token=store.get('access_token') or os.getenv(store['access_token_env']),
+                api_version=store.get('api_version'),
+                pool_size=max(concurrency, int(os.getenv('SHOPIFY_POOL_SIZE', 10))),
+            )
+            processed_store = ProcessedStore(PROCESSED_DB, legacy_json_path=PROCESSED_FILE)
+            metrics = RunMetrics()
+            try:
+                args = argparse.Namespace(dry_run=options['dry_run'], bulk=options['bulk'],
+                                          no_precheck=options['no_precheck'])
+                result['rows'] = run_sync(args, sheets, shopify, processed_store, processed_store.load_ids(),
+                                          concurrency, metrics=metrics)
+            finally:
+                processed_store.close()
+
+            for counter in metrics.to_dict()['counters']:
+                if counter['name'] == 'rows_total' and counter['labels'].get('status') in ('success', 'failed', 'skipped'):
+                    result[counter['labels']['status']] = counter['value']
+        except Exception as e:
+            traceback.print_exc()
+            result['error'] = f"{type(e).__name__}: {e}"
+
+    result['wall_time'] = time.perf_counter() - started
+    return result
+
+
+def print_summary(results, wall_time):
+    print(f"\n{'Store':<24} {'Rows':>6} {'Success':>8} {'Failed':>7} {'Skipped':>8} {'Time (s)':>9}")
+    for r in results:
+        print(f"{r['store']:<24} {r['rows']:>6} {r['success']:>8} {r['failed']:>7} {r['skipped']:>8} {r['wall_time']:>9.1f}"
+              + (f"  [ERROR] {r['error']}" if r['error'] else ""))
+    print(f"\nTotal wall time: {wall_time:.1f}s (stores combined: {sum(r['wall_time'] for r in results):.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync several Shopify stores and sheets in parallel")
+    parser.add_argument("--config", default=os.getenv('STORES_CONFIG', 'stores.json'), help="Store list (default: STORES_CONFIG or stores.json)")
+    parser.add_argument("--processes", type=int, help="Stores synced at once (default: one per store, up to the CPU count)")
+    parser.add_argument("--dry-run", action="store_true", help="Run without making changes to Shopify")
+    parser.add_argument("--bulk", action="store_true", help="Snapshot open orders with one bulk operation per store")
+    parser.add_argument("--full-read", action="store_true", help="Ignore the saved row watermarks and read whole sheets")
+    parser.add_argument("--write-back", action="store_true", help="Write row statuses back into each store's sheet")
+    parser.add_argument("--no-precheck", action="store_true", help="Always read the sheets, even if unchanged")
+    parser.add_argument("--concurrency", type=int, help="Rows processed at once within each store (default: SYNC_CONCURRENCY or 4)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    try:
+        stores = load_stores(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Failed to load store config {args.config}: {e}")
+        sys.exit(1)
+    if not stores:
+        print(f"No stores configured in {args.config}.")
+        return
+
+    options = {'dry_run': args.dry_run, 'bulk': args.bulk, 'full_read': args.full_read,
+               'no_precheck': args.no_precheck, 'concurrency': args.concurrency, 'write_back': args.write_back}
+    processes = args.processes or min(len(stores), os.cpu_count() or 1)
+    print(f"Syncing {len(stores)} stores with {processes} processes...")
+
+    started = time.perf_counter()
+    results = []
+    # A fresh process per store: separate limiter, connections, state and working directory
+    with ProcessPoolExecutor(max_workers=processes, max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_store, store, options): store for store in stores}
+        for future in as_completed(futures):
+            store = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'store': store['name'], 'rows': 0, 'success': 0, 'failed': 0, 'skipped': 0,
+                          'error': f"{type(e).__name__}: {e}", 'state_dir': store['state_dir'], 'wall_time': 0.0}
+            print(f"  {result['store']}: {'failed' if result['error'] else 'done'} "
+                  f"in {result['wall_time']:.1f}s (log: {os.path.join(result['state_dir'], 'sync.log')})")
+            results.append(result)
+    wall_time = time.perf_counter() - started
+
+    # Keep config order in the summary
+    order = [s['name'] for s in stores]
+    results.sort(key=lambda r: order.index(r['store']))
+    print_summary(results, wall_time)
+
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    filename = os.path.join(LOGS_DIR, f"multi_store_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    with open(filename, 'w') as f:
+        json.dump({'wall_time': wall_time, 'stores': results}, f, indent=2)
+    print(f"\n[REPORT] Combined summary saved to: {filename}")
+
+    if any(r['error'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
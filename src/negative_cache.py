@@ -0,0 +1,155 @@
+"""
+Negative cache for AliExpress IDs that matched no Shopify order.
+
+Each miss pushes the ID's next lookup further out: `base_delay` after the
+first miss, doubling with every further miss up to `max_delay`. Rows whose
+retry time has not come yet are skipped without any API call; a later match
+(or a flush) removes the entry.
+
+Usage:
+    python src/negative_cache.py list --limit 20
+    python src/negative_cache.py flush              # retry everything next run
+    python src/negative_cache.py flush 8123456789   # retry specific IDs
+"""
+import os
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from processed_store import connect_db
+
+NEGATIVE_CACHE_DB = "negative_cache.db"
+
+
+class NegativeCache:
+    """SQLite-backed AliExpress ID -> (misses, next retry time) map."""
+
+    def __init__(self, db_path=NEGATIVE_CACHE_DB, base_delay=3600, max_delay=7 * 86400):
+        self.db_path = db_path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.conn = connect_db(db_path)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS misses (
+                    ali_id TEXT PRIMARY KEY,
+                    misses INTEGER NOT NULL,
+                    first_miss_at TEXT,
+                    last_miss_at TEXT,
+                    next_retry_at TEXT NOT NULL
+                )
+            """)
+
+    def delay_for(self, misses):
+        """Seconds to wait after the `misses`-th consecutive miss."""
+        return min(self.base_delay * 2 ** (misses - 1), self.max_delay)
+
+    def deferred(self, ali_ids, now=None):
+        """
+        Returns:
+            dict: AliExpress ID -> next retry time (datetime), for the IDs
+                that should not be looked up yet.
+        """
+        now = (now or datetime.now()).isoformat()
+        ali_ids = list(ali_ids)
+        found = {}
+        for start in range(0, len(ali_ids), 500):
+            chunk = ali_ids[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT ali_id, next_retry_at FROM misses WHERE next_retry_at > ? "
+                f"AND ali_id IN ({','.join('?' * len(chunk))})",
+                [now, *chunk],
+            ).fetchall()
+            found.update((ali_id, datetime.fromisoformat(retry_at)) for ali_id, retry_at in rows)
+        return found
+
+    def record_misses(self, ali_ids, now=None):
+        """Counts one more miss for each ID and schedules its next retry."""
+        now = now or datetime.now()
+        ali_ids = [str(i) for i in ali_ids]
+        if not ali_ids:
+            return
+        with self.conn:
+            counts = {}
+            for start in range(0, len(ali_ids), 500):
+                chunk = ali_ids[start:start + 500]
+                counts.update(self.conn.execute(
+                    f"SELECT ali_id, misses FROM misses WHERE ali_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+            rows = []
+            for ali_id in ali_ids:
+                misses = counts.get(ali_id, 0) + 1
+                retry_at = now + timedelta(seconds=self.delay_for(misses))
+                rows.append((ali_id, misses, now.isoformat(), now.isoformat(), retry_at.isoformat()))
+            self.conn.executemany(
+                """
+                INSERT INTO misses (ali_id, misses, first_miss_at, last_miss_at, next_retry_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (ali_id) DO UPDATE SET
+                    misses = excluded.misses,
+                    last_miss_at = excluded.last_miss_at,
+                    next_retry_at = excluded.next_retry_at
+                """,
+                rows,
+            )
+
+    def forget(self, ali_ids):
+        """Drops IDs from the cache (they matched, or were flushed by hand); returns how many were cached."""
+        ali_ids = [str(i) for i in ali_ids]
+        with self.conn:
+            return self.conn.executemany("DELETE FROM misses WHERE ali_id = ?", [(i,) for i in ali_ids]).rowcount
+
+    def flush(self):
+        """Drops every entry; returns how many there were."""
+        with self.conn:
+            return self.conn.execute("DELETE FROM misses").rowcount
+
+    def entries(self, limit=20):
+        """Cached IDs with the most misses first."""
+        cursor = self.conn.execute(
+            "SELECT ali_id, misses, first_miss_at, last_miss_at, next_retry_at FROM misses "
+            "ORDER BY misses DESC, next_retry_at DESC LIMIT ?", (limit,)
+        )
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or flush the cache of unmatched AliExpress IDs")
+    parser.add_argument("--db", help="Cache database (default: NEGATIVE_CACHE_DB or negative_cache.db)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="Show cached IDs, most misses first")
+    list_parser.add_argument("--limit", type=int, default=20)
+
+    flush_parser = subparsers.add_parser("flush", help="Retry IDs on the next run (all of them if none are given)")
+    flush_parser.add_argument("ali_ids", nargs="*")
+    args = parser.parse_args()
+
+    load_dotenv()
+    db_path = args.db or os.getenv('NEGATIVE_CACHE_DB', NEGATIVE_CACHE_DB)
+    if not os.path.exists(db_path):
+        print(f"No negative cache found at {db_path}.")
+        return
+
+    cache = NegativeCache(db_path)
+    try:
+        if args.command == "list":
+            entries = cache.entries(args.limit)
+            if not entries:
+                print("The negative cache is empty.")
+            for entry in entries:
+                print(f"{entry['ali_id']}  misses={entry['misses']}  first={entry['first_miss_at']}  "
+                      f"next retry={entry['next_retry_at']}")
+        elif args.ali_ids:
+            print(f"Flushed {cache.forget(args.ali_ids)} of {len(args.ali_ids)} IDs.")
+        else:
+            print(f"Flushed {cache.flush()} IDs.")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
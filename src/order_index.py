@@ -0,0 +1,67 @@
+import re
+
+# Separators between words of a free-text order note
+_NOTE_SEPARATORS = re.compile(r'[\s,;:#|/]+')
+
+
+class OrderIndex:
+    """
+    In-memory AliExpress ID -> Shopify order map.
+
+    Orders are indexed under every value that may hold an AliExpress ID:
+    tags, the order name (with and without '#') and customAttributes values.
+    Passing `location` restricts the keys to one place ('tags', 'name',
+    'note' or 'note_attributes', optionally only the attribute named
+    `attribute_name`), for shops that always store the ID there.
+    """
+
+    def __init__(self, location=None, attribute_name=None):
+        self._orders = {}
+        self.location = location
+        self.attribute_name = attribute_name
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, aliexpress_id):
+        return str(aliexpress_id).strip() in self._orders
+
+    def add(self, node, order):
+        """Indexes a parsed order under all candidate keys found in its GraphQL node."""
+        for key in self.keys_for_node(node, self.location, self.attribute_name):
+            self._orders[key] = order
+
+    def get(self, aliexpress_id):
+        return self._orders.get(str(aliexpress_id).strip())
+
+    @staticmethod
+    def keys_for_node(node, location=None, attribute_name=None):
+        keys = set()
+
+        if location in (None, 'tags'):
+            tags = node.get('tags') or []
+            if isinstance(tags, str):
+                # REST payloads return tags as a comma separated string
+                tags = tags.split(',')
+            for tag in tags:
+                keys.add(str(tag).strip())
+
+        if location in (None, 'name'):
+            name = node.get('name')
+            if name:
+                keys.add(name.strip())
+                keys.add(name.strip().lstrip('#'))
+
+        if location in (None, 'note_attributes'):
+            for attr in node.get('customAttributes') or []:
+                if location and attribute_name and attr.get('key') != attribute_name:
+                    continue
+                if attr.get('value'):
+                    keys.add(str(attr['value']).strip())
+
+        if location == 'note':
+            # Free text: every word of the note is a candidate ID
+            keys.update(_NOTE_SEPARATORS.split(node.get('note') or ''))
+
+        keys.discard('')
+        return keys
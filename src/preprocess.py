@@ -0,0 +1,182 @@
+import importlib.util
+from carriers import DEFAULT_CARRIER, classify_carriers
+
+# Header names accepted for the AliExpress order ID and tracking number columns
+ID_COLUMNS = ['AliExpress Order No', 'Order Number', 'Order No', 'AliExpress Order ID', 'AliExpress ID']
+TRACKING_COLUMNS = ['Tracking Number', 'Tracking No', 'Tracking', 'Number']
+
+# What astype(str) makes of empty cells
+_EMPTY_VALUES = ['nan', 'NaN', 'None', 'none', 'null', '<NA>']
+_EMPTY_SET = frozenset(_EMPTY_VALUES)
+
+# pandas is imported on first use only; without it rows are kept in ColumnTables
+HAVE_PANDAS = importlib.util.find_spec('pandas') is not None
+
+
+class WorkItem:
+    """One validated sheet row, ready for the network stage."""
+
+    __slots__ = ('row_number', 'ali_id', 'tracking_number', 'carrier')
+
+    def __init__(self, row_number, ali_id, tracking_number, carrier=DEFAULT_CARRIER):
+        self.row_number = row_number
+        self.ali_id = ali_id
+        self.tracking_number = tracking_number
+        # Tracking company sent with the fulfillment (see carriers.py)
+        self.carrier = carrier
+
+    def __repr__(self):
+        return (f"WorkItem(row={self.row_number}, ali_id={self.ali_id!r}, tracking={self.tracking_number!r}, "
+                f"carrier={self.carrier!r})")
+
+
+class ColumnTable:
+    """
+    Minimal stand-in for a DataFrame when pandas is not installed: equal
+    length value lists per column, indexed by sheet row number.
+    """
+
+    __slots__ = ('data', 'index')
+
+    def __init__(self, data, index):
+        self.data = dict(data)
+        self.index = list(index)
+
+    @property
+    def columns(self):
+        return list(self.data)
+
+    @property
+    def empty(self):
+        return not self.index or not self.data
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, column):
+        return self.data[column]
+
+    def __setitem__(self, column, values):
+        self.data[column] = list(values)
+
+    def take(self, positions):
+        """A new table holding only the rows at `positions`."""
+        return ColumnTable({c: [v[p] for p in positions] for c, v in self.data.items()},
+                           [self.index[p] for p in positions])
+
+
+def make_table(data, index):
+    """Builds a DataFrame from column lists, or a ColumnTable without pandas."""
+    if not HAVE_PANDAS:
+        return ColumnTable(data, index)
+    import pandas as pd
+    return pd.DataFrame(data, index=index)
+
+
+def resolve_column(header, candidates, contains=None):
+    """Returns the first candidate present in header, else the first header containing `contains`."""
+    col = next((c for c in candidates if c in header), None)
+    if not col and contains:
+        col = next((c for c in header if contains in str(c).lower()), None)
+    return col
+
+
+def normalize_column(series):
+    """
+    Converts a sheet column to stripped strings, column-wise.
+    Empty cells become '' instead of 'nan', and whole numbers read as
+    floats lose their '.0' suffix.
+    """
+    import pandas as pd
+    values = series.astype(str).str.strip()
+    if pd.api.types.is_float_dtype(series):
+        # Integer IDs in a column with blanks come back as floats
+        whole = series.notna() & (series % 1 == 0)
+        values[whole] = series[whole].astype('int64').astype(str)
+    return values.mask(values.isin(_EMPTY_VALUES), '')
+
+
+def normalize_values(values):
+    """normalize_column for a plain list of cell values."""
+    normalized = []
+    for value in values:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        text = str(value).strip()
+        normalized.append('' if value is None or text in _EMPTY_SET else text)
+    return normalized
+
+
+def build_work_items(new_rows, id_col):
+    """
+    Turns the frame from SheetReader.get_new_rows into WorkItems.
+
+    Columns are resolved once and rows are validated and de-duplicated
+    column-wise; rows without an ID are dropped, and when an ID appears
+    more than once only its first row with a tracking number is kept.
+    The carrier of every kept tracking number is detected in one pass over
+    the column.
+
+    Returns:
+        tuple: (list of WorkItem in sheet order, dict of drop counts)
+    """
+    stats = {'missing_id': 0, 'duplicates': 0}
+    if new_rows.empty:
+        return [], stats
+    if isinstance(new_rows, ColumnTable):
+        return _build_from_table(new_rows, id_col, stats)
+
+    import pandas as pd
+    ids = normalize_column(new_rows[id_col])
+    tracking_col = resolve_column(list(new_rows.columns), TRACKING_COLUMNS, contains='tracking')
+    if tracking_col:
+        tracking = normalize_column(new_rows[tracking_col])
+    else:
+        tracking = pd.Series('', index=new_rows.index)
+
+    has_id = ids != ''
+    stats['missing_id'] = int((~has_id).sum())
+    ids, tracking = ids[has_id], tracking[has_id]
+
+    # Rows with a tracking number take precedence over earlier blank duplicates
+    priority = (tracking == '').to_numpy().argsort(kind='stable')
+    duplicated = pd.Series(ids.iloc[priority].duplicated().to_numpy(), index=ids.index[priority])
+    keep = ~duplicated.reindex(ids.index)
+    stats['duplicates'] = int((~keep).sum())
+    ids, tracking = ids[keep], tracking[keep]
+
+    tracking_numbers = tracking.tolist()
+    items = [
+        WorkItem(row_number, ali_id, tracking_number or None, carrier)
+        for row_number, ali_id, tracking_number, carrier in zip(
+            ids.index.tolist(), ids.tolist(), tracking_numbers, classify_carriers(tracking_numbers))
+    ]
+    return items, stats
+
+
+def _build_from_table(table, id_col, stats):
+    """build_work_items for a ColumnTable, with the same de-duplication rules."""
+    ids = normalize_values(table[id_col])
+    tracking_col = resolve_column(table.columns, TRACKING_COLUMNS, contains='tracking')
+    tracking = normalize_values(table[tracking_col]) if tracking_col else [''] * len(ids)
+
+    chosen = {}
+    with_id = 0
+    for position, (ali_id, tracking_number) in enumerate(zip(ids, tracking)):
+        if not ali_id:
+            continue
+        with_id += 1
+        previous = chosen.get(ali_id)
+        # Rows with a tracking number take precedence over earlier blank duplicates
+        if previous is None or (tracking_number and not tracking[previous]):
+            chosen[ali_id] = position
+    stats['missing_id'] = len(ids) - with_id
+    stats['duplicates'] = with_id - len(chosen)
+
+    positions = sorted(chosen.values())
+    carriers = classify_carriers([tracking[position] for position in positions])
+    items = [
+        WorkItem(table.index[position], ids[position], tracking[position] or None, carrier)
+        for position, carrier in zip(positions, carriers)
+    ]
+    return items, stats
@@ -0,0 +1,96 @@
+import os
+import json
+import sqlite3
+from datetime import datetime
+
+
+class ProcessedStore:
+    """
+    Durable record of AliExpress orders that were already fulfilled.
+
+    Backed by SQLite in WAL mode: each add() is a single-row atomic commit,
+    so a crash never leaves a half-written file behind, and startup only
+    needs one indexed scan to rebuild the in-memory set.
+    """
+
+    def __init__(self, db_path="processed_orders.db", legacy_json_path=None):
+        self.db_path = db_path
+        self.conn = connect_db(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed (
+                ali_id TEXT PRIMARY KEY,
+                processed_at TEXT,
+                shopify_order TEXT,
+                tracking_number TEXT
+            )
+        """)
+        self.conn.commit()
+        # Highest rowid already returned by load_ids()/load_new_ids()
+        self._last_rowid = 0
+
+        if legacy_json_path:
+            self.migrate_json(legacy_json_path)
+
+    def load_ids(self):
+        """Returns every processed AliExpress ID as a set."""
+        self._last_rowid = 0
+        return self.load_new_ids()
+
+    def load_new_ids(self):
+        """Returns the IDs recorded since the previous load, by this or any other process."""
+        rows = self.conn.execute(
+            "SELECT rowid, ali_id FROM processed WHERE rowid > ? ORDER BY rowid", (self._last_rowid,)
+        ).fetchall()
+        if rows:
+            self._last_rowid = rows[-1][0]
+        return {row[1] for row in rows}
+
+    def add(self, ali_id, shopify_order=None, tracking_number=None):
+        """Records one processed order and commits immediately."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO processed (ali_id, processed_at, shopify_order, tracking_number) VALUES (?, ?, ?, ?)",
+                (str(ali_id), datetime.now().isoformat(), shopify_order, tracking_number),
+            )
+
+    def migrate_json(self, json_path):
+        """
+        One-time import of the legacy processed_orders.json list.
+
+        The JSON file is renamed to *.migrated afterwards. A corrupt file
+        raises instead of being treated as empty, since an empty history
+        would re-fulfill every order in the sheet.
+
+        Returns:
+            int: Number of IDs imported.
+        """
+        if not os.path.exists(json_path):
+            return 0
+
+        with open(json_path, 'r') as f:
+            try:
+                legacy_ids = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Cannot migrate {json_path}: file is corrupt ({e})") from e
+
+        with self.conn:
+            # Legacy entries carry no timestamp or order details
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO processed (ali_id) VALUES (?)",
+                ((str(ali_id),) for ali_id in legacy_ids),
+            )
+        os.replace(json_path, json_path + ".migrated")
+        print(f"Migrated {len(legacy_ids)} processed IDs from {json_path} to {self.db_path}.")
+        return len(legacy_ids)
+
+    def close(self):
+        self.conn.close()
+
+
+def connect_db(db_path, **kwargs):
+    """Opens a SQLite database tuned for frequent small commits."""
+    conn = sqlite3.connect(db_path, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL stays crash-safe for the database; only the last commits can be lost on power failure
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,354 @@
+import re
+import threading
+import time
+from functools import lru_cache
+
+# GraphQL tokens: block strings, strings, spreads, punctuation, names/variables and numbers
+_TOKEN = re.compile(r'"""[\s\S]*?"""|"(?:\\.|[^"\\])*"|\.\.\.|[{}()\[\]:!=@$,]|[A-Za-z_][A-Za-z0-9_]*|-?\d+(?:\.\d+)?')
+
+
+class LeakyBucket:
+    """
+    Client-side mirror of one Shopify leaky bucket.
+
+    Callers charge a cost before sending a request; the bucket refills at the
+    restore rate and is re-synced from the server's own numbers after every
+    response, so the local view never drifts far from Shopify's. Waiting
+    callers are woken whenever a response or release changes the balance.
+    """
+
+    def __init__(self, maximum, restore_rate):
+        self.maximum = float(maximum)
+        self.restore_rate = float(restore_rate)
+        self.available = float(maximum)
+        self.in_flight = 0.0
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.last_sent_at = float('-inf')
+        self.lock = threading.Lock()
+        # Notified by sync(), release() and throttled(), so waiters re-check early
+        self.changed = threading.Condition(self.lock)
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.available = min(self.maximum, self.available + elapsed * self.restore_rate)
+        self.updated_at = now
+
+    def acquire(self, cost):
+        """Blocks until `cost` points are available, then reserves them. Returns seconds waited."""
+        cost = min(float(cost), self.maximum)
+        started = time.monotonic()
+        with self.changed:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.available >= cost:
+                    self.available -= cost
+                    self.in_flight += cost
+                    return now - started
+                delay = max(self.paused_until - now, (cost - self.available) / self.restore_rate)
+                self.changed.wait(delay)
+
+    def sync(self, currently_available, charged, cost=None, sent_at=None, maximum=None, restore_rate=None):
+        """
+        Replaces the local estimate with the server-reported state after a request completes.
+
+        `sent_at` (time.perf_counter() when the request went out) orders the
+        readings: responses can arrive out of order, and one for a request sent
+        before the last reading taken was made before the server saw the
+        requests in between, so it may only lower the estimate. `cost` is what
+        the server kept for the request (defaults to `charged`).
+        """
+        with self.lock:
+            if maximum:
+                self.maximum = float(maximum)
+            if restore_rate:
+                self.restore_rate = float(restore_rate)
+            now = time.monotonic()
+            self._refill(now)
+            self.in_flight = max(0.0, self.in_flight - charged)
+            # Requests still in flight have not been seen by the server yet
+            reported = float(currently_available) - self.in_flight
+            if sent_at is not None and sent_at < self.last_sent_at:
+                if cost is not None:
+                    self.available += charged - float(cost)
+                reported = min(self.available, reported)
+            elif sent_at is not None:
+                self.last_sent_at = sent_at
+            self.available = min(self.maximum, max(0.0, reported))
+            self.updated_at = now
+            self.changed.notify_all()
+
+    def release(self, charged):
+        """Returns the reservation of a request that produced no throttle information."""
+        with self.lock:
+            self.in_flight = max(0.0, self.in_flight - charged)
+            self.changed.notify_all()
+
+    def throttled(self, retry_after=None):
+        """Empties the bucket and pauses every caller after a throttled response."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.available = 0.0
+            pause = retry_after if retry_after is not None else 1.0 / self.restore_rate
+            self.paused_until = max(self.paused_until, now + pause)
+            self.changed.notify_all()
+
+
+class ShopifyRateLimiter:
+    """
+    Shared limiter for one shop, covering the REST and GraphQL Admin APIs.
+
+    REST is tracked from the X-Shopify-Shop-Api-Call-Limit header (one point
+    per call); GraphQL from extensions.cost.throttleStatus. Each query is
+    charged before it is sent: the requestedQueryCost last reported for the
+    same query and page sizes, or, for one not seen yet, the cost computed
+    from its text (see estimate_query_cost), so even the first concurrent
+    wave of a run stays within the budget.
+    """
+
+    def __init__(self, rest_limit=40, rest_restore_rate=2, graphql_limit=1000, graphql_restore_rate=50):
+        self.rest = LeakyBucket(rest_limit, rest_restore_rate)
+        self.graphql = LeakyBucket(graphql_limit, graphql_restore_rate)
+        # (query, page-size variables) -> last requestedQueryCost
+        self._query_costs = {}
+
+    # --- REST ---
+    def acquire_rest(self):
+        return self.rest.acquire(1)
+
+    def release_rest(self):
+        """Returns the reservation of a REST call that never reached the server."""
+        self.rest.release(1)
+
+    def record_rest_response(self, response):
+        header = response.headers.get('X-Shopify-Shop-Api-Call-Limit')
+        if response.status_code == 429:
+            self.rest.release(1)
+            self.rest.throttled(_retry_after(response))
+            return
+        if not header:
+            self.rest.release(1)
+            return
+        try:
+            used, maximum = (float(part) for part in header.split('/'))
+        except ValueError:
+            self.rest.release(1)
+            return
+        self.rest.sync(maximum - used, 1, maximum=maximum)
+
+    # --- GraphQL ---
+    def estimate_cost(self, query, variables=None):
+        learned = self._query_costs.get(_cost_key(query, variables))
+        return learned if learned is not None else estimate_query_cost(query, variables)
+
+    def acquire_graphql(self, query, variables=None):
+        """Reserves the expected cost of `query`. Returns (charged_cost, seconds_waited)."""
+        cost = self.estimate_cost(query, variables)
+        return cost, self.graphql.acquire(cost)
+
+    def release_graphql(self, charged):
+        """Returns the reservation of a GraphQL call that never reached the server."""
+        self.graphql.release(charged)
+
+    def record_graphql_response(self, query, charged, response, payload=None, variables=None, sent_at=None):
+        """
+        Updates the GraphQL bucket from a response.
+
+        Returns:
+            bool: True if the request was throttled and should be retried.
+        """
+        if response.status_code == 429:
+            self.graphql.release(charged)
+            self.graphql.throttled(_retry_after(response))
+            return True
+
+        cost = ((payload or {}).get('extensions') or {}).get('cost') or {}
+        if cost.get('requestedQueryCost') is not None:
+            self._query_costs[_cost_key(query, variables)] = cost['requestedQueryCost']
+
+        errors = (payload or {}).get('errors') or []
+        throttled = any((e.get('extensions') or {}).get('code') == 'THROTTLED' for e in errors)
+
+        status = cost.get('throttleStatus')
+        if status:
+            # A throttled request is not charged; otherwise Shopify keeps the actual cost
+            kept = 0 if throttled else cost.get('actualQueryCost')
+            if kept is None:
+                kept = cost.get('requestedQueryCost')
+            self.graphql.sync(
+                status['currentlyAvailable'],
+                charged,
+                cost=kept,
+                sent_at=sent_at,
+                maximum=status.get('maximumAvailable'),
+                restore_rate=status.get('restoreRate'),
+            )
+        else:
+            self.graphql.release(charged)
+
+        if throttled:
+            self.graphql.throttled()
+            return True
+        return False
+
+
+def _cost_key(query, variables):
+    # Only numeric variables (page sizes) change what a query costs
+    return query, tuple(sorted((k, v) for k, v in (variables or {}).items() if isinstance(v, int)))
+
+
+def estimate_query_cost(query, variables=None):
+    """
+    Shopify's requested cost of a GraphQL document, computed from its text:
+    objects cost 1, a connection 2 plus `first` times the cost of one node,
+    scalars nothing, and each mutation field 10. Fields left out by
+    @include/@skip cost nothing. Used for queries whose real cost has not
+    been reported yet.
+    """
+    operation, root, fragments = _parse_document(query)
+    if operation == 'mutation':
+        return 10 * max(1, len(root))
+    return max(1, _selection_cost(root, fragments, variables or {}))
+
+
+def _selection_cost(selections, fragments, variables, seen=()):
+    total = 0
+    for name, first, children, conditions in selections:
+        if not _included(conditions, variables):
+            continue
+        if name == '...':
+            # Fragment spread (children holds its name) or inline fragment
+            if isinstance(children, str):
+                if children in fragments and children not in seen:
+                    total += _selection_cost(fragments[children], fragments, variables, seen + (children,))
+            else:
+                total += _selection_cost(children, fragments, variables, seen)
+        elif not children:
+            continue
+        elif first is not None:
+            size = variables.get(first[1:], 0) if first.startswith('$') else int(first)
+            total += 2 + int(size or 0) * _selection_cost(children, fragments, variables, seen)
+        elif name in ('edges', 'pageInfo'):
+            total += _selection_cost(children, fragments, variables, seen)
+        else:
+            total += 1 + _selection_cost(children, fragments, variables, seen)
+    return total
+
+
+def _included(conditions, variables):
+    """Evaluates a field's @include/@skip directives, given as (directive, `if` value) pairs."""
+    for directive, value in conditions:
+        if value is None:
+            continue
+        flag = bool(variables.get(value[1:])) if value.startswith('$') else value == 'true'
+        if (directive == 'include' and not flag) or (directive == 'skip' and flag):
+            return False
+    return True
+
+
+@lru_cache(maxsize=64)
+def _parse_document(query):
+    """
+    Returns (operation type, root selections, fragments by name); selections
+    are (name, first, children, conditions).
+    """
+    tokens = _TOKEN.findall(query)
+    position = 0
+    operation, root, fragments = 'query', [], {}
+
+    def selection_set():
+        nonlocal position
+        position += 1  # '{'
+        selections = []
+        while position < len(tokens) and tokens[position] != '}':
+            token = tokens[position]
+            if token == '...':
+                position += 1
+                if tokens[position] == 'on' or tokens[position] == '{' or tokens[position] == '@':
+                    if tokens[position] == 'on':
+                        position += 2
+                    conditions = directives()
+                    selections.append(('...', None, selection_set(), conditions))
+                else:
+                    spread = tokens[position]
+                    position += 1
+                    selections.append(('...', None, spread, directives()))
+                continue
+            name = token
+            position += 1
+            if position < len(tokens) and tokens[position] == ':':
+                # Alias
+                name = tokens[position + 1]
+                position += 2
+            first = None
+            if position < len(tokens) and tokens[position] == '(':
+                first = arguments().get('first')
+            conditions = directives()
+            children = selection_set() if position < len(tokens) and tokens[position] == '{' else []
+            selections.append((name, first, children, conditions))
+        position += 1  # '}'
+        return selections
+
+    def directives():
+        """Skips the directives at `position`; returns (name, `if` value) for each."""
+        nonlocal position
+        conditions = []
+        while position < len(tokens) and tokens[position] == '@':
+            directive = tokens[position + 1]
+            position += 2
+            value = None
+            if position < len(tokens) and tokens[position] == '(':
+                value = arguments().get('if')
+            conditions.append((directive, value))
+        return tuple(conditions)
+
+    def arguments():
+        """Skips a parenthesized argument list; returns its top-level scalar values by name."""
+        nonlocal position
+        values, depth = {}, 0
+        while position < len(tokens):
+            token = tokens[position]
+            if token in ('(', '{', '['):
+                depth += 1
+            elif token in (')', '}', ']'):
+                depth -= 1
+                if depth == 0:
+                    position += 1
+                    return values
+            elif depth == 1 and position + 2 < len(tokens) and tokens[position + 1] == ':':
+                value = tokens[position + 2]
+                values[token] = value + tokens[position + 3] if value == '$' else value
+            position += 1
+        return values
+
+    while position < len(tokens):
+        token = tokens[position]
+        if token == 'fragment':
+            name = tokens[position + 1]
+            while tokens[position] != '{':
+                position += 1
+            fragments[name] = selection_set()
+        elif token == '{':
+            root = selection_set()
+        elif token in ('query', 'mutation', 'subscription'):
+            operation = token
+            position += 1
+            while tokens[position] != '{':
+                if tokens[position] == '(':
+                    arguments()
+                else:
+                    position += 1
+            root = selection_set()
+        else:
+            position += 1
+    return operation, root, fragments
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
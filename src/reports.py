@@ -0,0 +1,320 @@
+"""
+Streaming run reports.
+
+Each run's report rows are appended to logs/report_<timestamp>.csv (and/or
+.jsonl) as rows complete, so a crash keeps everything written so far.
+Older reports are gzip-compressed and pruned, and a SQLite index in
+logs/reports.db records every run and row for querying past runs.
+
+Usage:
+    python src/reports.py runs --limit 20
+    python src/reports.py find 8123456789
+"""
+import os
+import re
+import csv
+import json
+import gzip
+import time
+import shutil
+import argparse
+from datetime import datetime
+from processed_store import connect_db
+
+REPORT_HEADERS = ['Timestamp', 'AliExpress ID', 'Tracking Number', 'Shopify Order Name', 'Status', 'Message']
+INDEX_FILE = "reports.db"
+# Files written by ReportWriter; other report_* files in logs/ are left alone
+REPORT_NAME = re.compile(r'^report_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}(?:_\d+)?)\.(csv|jsonl)(\.gz)?$')
+
+
+class ReportIndex:
+    """SQLite index of past runs and their rows, kept next to the report files."""
+
+    def __init__(self, logs_dir="logs"):
+        self.conn = connect_db(os.path.join(logs_dir, INDEX_FILE))
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    files TEXT,
+                    rows INTEGER DEFAULT 0,
+                    success INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    skipped INTEGER DEFAULT 0,
+                    complete INTEGER DEFAULT 0
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS report_rows (
+                    run_id TEXT,
+                    ali_id TEXT,
+                    tracking_number TEXT,
+                    shopify_order TEXT,
+                    status TEXT,
+                    message TEXT,
+                    timestamp TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS report_rows_ali_id ON report_rows (ali_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS report_rows_run_id ON report_rows (run_id)")
+
+    def start_run(self, run_id, files):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runs (run_id, started_at, files) VALUES (?, ?, ?)",
+                (run_id, datetime.now().isoformat(), json.dumps(files)),
+            )
+
+    def add_rows(self, run_id, log_entries):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO report_rows VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, e['AliExpress ID'], e['Tracking Number'], e['Shopify Order Name'], e['Status'],
+                  e['Message'], e['Timestamp']) for e in log_entries],
+            )
+
+    def finish_run(self, run_id, counts, complete):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE runs SET finished_at = ?, rows = ?, success = ?, failed = ?, skipped = ?, complete = ? WHERE run_id = ?",
+                (datetime.now().isoformat(), sum(counts.values()), counts.get('Success', 0),
+                 counts.get('Failed', 0), counts.get('Skipped', 0), int(complete), run_id),
+            )
+
+    def update_files(self, renamed):
+        """Points runs at their files after compression. `renamed` maps old path -> new path."""
+        rows = self.conn.execute("SELECT run_id, files FROM runs").fetchall()
+        with self.conn:
+            for run_id, files in rows:
+                paths = json.loads(files or '[]')
+                updated = [renamed.get(p, p) for p in paths]
+                if updated != paths:
+                    self.conn.execute("UPDATE runs SET files = ? WHERE run_id = ?", (json.dumps(updated), run_id))
+
+    def forget_files(self, removed):
+        """
+        Drops pruned report files from their runs. A run left without any
+        file is deleted from the index along with its rows, so the index is
+        kept to the same runs as the reports.
+
+        Returns:
+            int: Number of runs deleted.
+        """
+        rows = self.conn.execute("SELECT run_id, files FROM runs").fetchall()
+        deleted = 0
+        with self.conn:
+            for run_id, files in rows:
+                paths = json.loads(files or '[]')
+                kept = [p for p in paths if p not in removed]
+                if kept == paths:
+                    continue
+                if kept:
+                    self.conn.execute("UPDATE runs SET files = ? WHERE run_id = ?", (json.dumps(kept), run_id))
+                else:
+                    self.conn.execute("DELETE FROM report_rows WHERE run_id = ?", (run_id,))
+                    self.conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+                    deleted += 1
+        return deleted
+
+    def has_run(self, run_id):
+        return self.conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone() is not None
+
+    def unfinished_files(self):
+        """Paths of runs that have not finished, possibly still being written by another process."""
+        rows = self.conn.execute("SELECT files FROM runs WHERE finished_at IS NULL").fetchall()
+        return {path for (files,) in rows for path in json.loads(files or '[]')}
+
+    def runs(self, limit=20):
+        """Returns the most recent runs as dicts, newest first."""
+        cursor = self.conn.execute(
+            "SELECT run_id, started_at, finished_at, files, rows, success, failed, skipped, complete "
+            "FROM runs ORDER BY started_at DESC LIMIT ?", (limit,)
+        )
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def find(self, ali_id):
+        """Returns every report row for one AliExpress ID, oldest first."""
+        cursor = self.conn.execute(
+            "SELECT run_id, timestamp, tracking_number, shopify_order, status, message "
+            "FROM report_rows WHERE ali_id = ? ORDER BY timestamp", (str(ali_id),)
+        )
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self):
+        self.conn.close()
+
+
+class ReportWriter:
+    """
+    Appends report rows to disk as they complete.
+
+    Files are flushed every `flush_every` rows and fsynced at most every
+    `fsync_interval` seconds; close() always flushes and fsyncs. Opening a
+    writer compresses earlier reports and keeps the newest `keep` of them.
+    """
+
+    def __init__(self, logs_dir="logs", formats=('csv',), flush_every=50, fsync_interval=5.0, keep=30):
+        self.logs_dir = logs_dir
+        self.formats = [f for f in formats if f in ('csv', 'jsonl')] or ['csv']
+        self.flush_every = max(1, int(flush_every))
+        self.fsync_interval = fsync_interval
+        self.keep = keep
+        self.run_id = None
+        self.paths = []
+        self.counts = {}
+        self._files = {}
+        self._csv = None
+        self._pending = []
+        self._last_fsync = 0.0
+        self.index = None
+
+    def open(self):
+        os.makedirs(self.logs_dir, exist_ok=True)
+        self.index = ReportIndex(self.logs_dir)
+        rotate_reports(self.logs_dir, self.keep, self.index)
+
+        self.run_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        # Two runs in the same second (watch mode, several processes) get distinct files
+        suffix = 1
+        while self.index.has_run(self.run_id) or any(
+                os.path.exists(os.path.join(self.logs_dir, f"report_{self.run_id}.{fmt}")) for fmt in self.formats):
+            suffix += 1
+            self.run_id = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{suffix}"
+        for fmt in self.formats:
+            path = os.path.join(self.logs_dir, f"report_{self.run_id}.{fmt}")
+            f = open(path, 'a', newline='', encoding='utf-8')
+            self._files[fmt] = f
+            self.paths.append(path)
+            if fmt == 'csv':
+                self._csv = csv.DictWriter(f, fieldnames=REPORT_HEADERS)
+                self._csv.writeheader()
+        self.index.start_run(self.run_id, self.paths)
+        self._last_fsync = time.monotonic()
+        return self
+
+    def write(self, log_entry):
+        if 'csv' in self._files:
+            self._csv.writerow(log_entry)
+        if 'jsonl' in self._files:
+            self._files['jsonl'].write(json.dumps(log_entry) + "\n")
+        self.counts[log_entry['Status']] = self.counts.get(log_entry['Status'], 0) + 1
+        self._pending.append(log_entry)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self, fsync=False):
+        """Pushes buffered rows to the OS and the index; fsyncs when due or asked to."""
+        for f in self._files.values():
+            f.flush()
+        if self._pending:
+            self.index.add_rows(self.run_id, self._pending)
+            self._pending = []
+        now = time.monotonic()
+        if fsync or now - self._last_fsync >= self.fsync_interval:
+            for f in self._files.values():
+                os.fsync(f.fileno())
+            self._last_fsync = now
+
+    def close(self, complete=True):
+        """
+        Args:
+            complete (bool): False when the run stopped early; the index keeps
+                the rows written so far but marks the run incomplete.
+        """
+        if not self._files:
+            return
+        self.flush(fsync=True)
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self.index.finish_run(self.run_id, self.counts, complete)
+        self.index.close()
+        for path in self.paths:
+            print(f"\n[REPORT] Detailed report saved to: {path}")
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+
+def rotate_reports(logs_dir, keep, index=None):
+    """
+    Gzips finished reports in `logs_dir` and deletes all but the newest
+    `keep` compressed runs (0 keeps everything), together with their rows in
+    the index. Reports of unfinished runs are left alone for a day, since
+    another process may still be writing them.
+    """
+    unfinished = index.unfinished_files() if index else set()
+    renamed = {}
+    for name in os.listdir(logs_dir):
+        match = REPORT_NAME.match(name)
+        if match and not match.group(3):
+            path = os.path.join(logs_dir, name)
+            if path in unfinished and time.time() - os.path.getmtime(path) < 86400:
+                continue
+            with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + '.gz.tmp', path + '.gz')
+            os.remove(path)
+            renamed[path] = path + '.gz'
+    if index and renamed:
+        index.update_files(renamed)
+
+    if keep:
+        runs = {}
+        for name in os.listdir(logs_dir):
+            match = REPORT_NAME.match(name)
+            if match and match.group(3):
+                runs.setdefault(match.group(1), []).append(os.path.join(logs_dir, name))
+        removed = set()
+        # Run IDs are timestamps, so they sort chronologically
+        for run_id in sorted(runs)[:-keep]:
+            for path in runs[run_id]:
+                os.remove(path)
+                removed.add(path)
+        if index and removed:
+            index.forget_files(removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query past sync reports")
+    parser.add_argument("--logs-dir", default="logs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    runs_parser = subparsers.add_parser("runs", help="List recent runs")
+    runs_parser.add_argument("--limit", type=int, default=20)
+
+    find_parser = subparsers.add_parser("find", help="Show every report row for an AliExpress ID")
+    find_parser.add_argument("ali_id")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.logs_dir, INDEX_FILE)):
+        print(f"No report index found in {args.logs_dir}.")
+        return
+
+    index = ReportIndex(args.logs_dir)
+    try:
+        if args.command == "runs":
+            for run in index.runs(args.limit):
+                state = "complete" if run['complete'] else "INCOMPLETE"
+                print(f"{run['run_id']}  rows={run['rows']} success={run['success']} failed={run['failed']} "
+                      f"skipped={run['skipped']}  {state}  {', '.join(json.loads(run['files'] or '[]'))}")
+        else:
+            rows = index.find(args.ali_id)
+            if not rows:
+                print(f"No report rows for {args.ali_id}.")
+            for row in rows:
+                print(f"{row['timestamp']}  run {row['run_id']}  {row['status']}  {row['shopify_order']}  "
+                      f"{row['tracking_number']}  {row['message']}")
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
-import gspread
-import pandas as pd
 import os
-from google.oauth2.service_account import Credentials
+import json
+import time
+from preprocess import ID_COLUMNS, TRACKING_COLUMNS, ColumnTable, resolve_column, normalize_values
+from metrics import RunMetrics
+from input_sources import InputSource, advance_watermark
 
-class SheetReader:
-    def __init__(self, credentials_path=None, sheet_name=None):
+# Columns that write-back fills in, appended after the last header column when missing
+STATUS_COLUMNS = ['Sync Status', 'Shopify Order', 'Sync Message']
+# Ranges per batchGet request; they are sent in the URL
+MAX_RANGES_PER_REQUEST = 200
+
+class SheetReader(InputSource):
+    def __init__(self, credentials_path=None, sheet_name=None, state_path=None, incremental=True, metrics=None,
+                 chunk_rows=None, write_back=None):
         self.credentials_path = credentials_path or os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE')
         self.sheet_name = sheet_name or os.getenv('GOOGLE_SHEET_NAME')
         self.scope = [
@@ -13,76 +21,404 @@ class SheetReader:
         ]
         self.client = None
         self.sheet = None
+        # Row watermark persisted between runs (see save_watermark)
+        self.state_path = state_path or os.getenv('SHEET_STATE_FILE', 'sheet_state.json')
+        self.incremental = incremental
+        self.chunk_rows = max(1, int(chunk_rows or os.getenv('SHEET_CHUNK_ROWS', 50000)))
+        self._last_read = None
+        self._pending = False
+        # Row outcomes queued by record_status(), written by write_statuses()
+        if write_back is None:
+            write_back = os.getenv('SHEET_WRITE_BACK', '').lower() in ('1', 'true', 'yes')
+        self.write_back = write_back
+        self.write_chunk_rows = max(1, int(os.getenv('SHEET_WRITE_CHUNK_ROWS', 10000)))
+        self._statuses = {}
+        # Drive modifiedTime seen at the start of this run, and how the sheet was read
+        self.modified_time = None
+        self.read_path = None
+        # Download and DataFrame build timings; main swaps in a fresh instance per run
+        self.metrics = metrics or RunMetrics()
 
     def connect(self):
         """Authenticates with Google Sheets API."""
         if not self.credentials_path or not os.path.exists(self.credentials_path):
             raise FileNotFoundError(f"Credentials file not found at: {self.credentials_path}")
-        
+
+        # gspread and google-auth are only loaded by runs that talk to Google
+        import gspread
+        from google.oauth2.service_account import Credentials
         creds = Credentials.from_service_account_file(self.credentials_path, scopes=self.scope)
         self.client = gspread.authorize(creds)
         print(f"Connected to Google Sheets services.")
 
-    def get_data(self):
-        """Reads all records from the sheet and returns a DataFrame."""
+    def check_for_changes(self, recheck_interval=3600):
+        """
+        Cheap precheck: compares the spreadsheet's Drive modifiedTime with the
+        value saved by the last completed run, using a single Drive files.list
+        call and without opening the sheet.
+
+        A sheet that is unchanged but still had pending rows last time is
+        re-run once `recheck_interval` seconds have passed, so unmatched rows
+        keep being retried.
+
+        Returns:
+            tuple: (changed, reason)
+        """
+        if not self.client:
+            self.connect()
+
+        with self.metrics.timer('sheet_request_seconds', call='drive_files_list'):
+            files = self.client.list_spreadsheet_files(self.sheet_name)
+        info = next((f for f in files if f.get('name') == self.sheet_name), None)
+        if not info:
+            # Let iter_chunks() raise the usual not-found error
+            return True, "spreadsheet not found"
+
+        self.modified_time = info.get('modifiedTime')
+        state = self._load_state() or {}
+
+        if not self.modified_time or state.get('modified_time') != self.modified_time:
+            return True, "sheet modified"
+        if state.get('pending') and time.time() - state.get('checked_at', 0) >= recheck_interval:
+            return True, "retrying pending rows"
+
+        self.read_path = 'skipped'
+        return False, "sheet unchanged"
+
+    def iter_chunks(self):
+        """
+        Reads the sheet `chunk_rows` rows at a time and yields ColumnTables
+        of raw cell values indexed by sheet row number.
+
+        Only the ID and tracking columns are fetched, so memory follows the
+        chunk size rather than the sheet size. When a watermark from a
+        previous run exists, reading starts below it; it falls back to
+        reading from the top if the header changed or rows above the
+        watermark were removed.
+        """
         if not self.client:
             self.connect()
-        
+
         try:
             # Open the spreadsheet
             print(f"Opening sheet: {self.sheet_name}")
-            spreadsheet = self.client.open(self.sheet_name)
-            
+            with self.metrics.timer('sheet_request_seconds', call='open'):
+                spreadsheet = self.client.open(self.sheet_name)
+
             # Select the first worksheet (assuming data is there)
             self.sheet = spreadsheet.sheet1
-            
-            # Get all values
-            data = self.sheet.get_all_records()
-            
-            if not data:
-                print("No data found in the sheet.")
-                return pd.DataFrame()
-                
-            df = pd.DataFrame(data)
-            print(f"Successfully loaded {len(df)} rows.")
-            return df
-            
+            if not self.modified_time:
+                # The precheck was skipped, so ask Drive once
+                with self.metrics.timer('sheet_request_seconds', call='drive_files_get'):
+                    self.modified_time = spreadsheet.get_lastUpdateTime()
+
+            chunks = self._read_incremental() if self.incremental else None
+            self.read_path = 'incremental'
+            if chunks is None:
+                chunks = self._read_full()
+                self.read_path = 'full'
+            self._pending = False
+
+            rows = 0
+            for chunk in chunks:
+                rows += len(chunk)
+                self.metrics.inc('sheet_rows_read_total', len(chunk), path=self.read_path)
+                yield chunk
         except Exception as e:
             print(f"Error reading Google Sheet: {e}")
             raise
 
-    def get_new_rows(self, all_data, processed_ids):
+        if not rows:
+            print("No data found in the sheet.")
+            yield ColumnTable({}, [])
+        else:
+            print(f"Successfully loaded {rows} rows.")
+
+        # Only a read that got to the end may let the next precheck skip the run
+        if self._last_read:
+            self._save_state({
+                'modified_time': self.modified_time,
+                'checked_at': time.time(),
+                'pending': self._pending,
+            })
+
+    def _read_full(self):
+        """Reads the ID and tracking columns from row 2 down."""
+        with self.metrics.timer('sheet_request_seconds', call='row_values'):
+            header = _trim_header(self.sheet.row_values(1))
+        id_col = resolve_column(header, ID_COLUMNS)
+        # Row 1 holds the ID column's name, which is what a watermark of 1 is checked against
+        self._last_read = {'header': header, 'watermark': 1, 'anchor': id_col}
+        if not header:
+            return iter(())
+        if not id_col:
+            raise ValueError(f"Could not find an Order ID column. Available columns: {header}")
+
+        tracking_col = resolve_column(header, TRACKING_COLUMNS, contains='tracking')
+        columns = [c for c in (id_col, tracking_col) if c]
+        return self._column_chunks(header, columns, 2)
+
+    def _read_incremental(self):
         """
-        Filters the dataframe to return only rows that haven't been processed.
-        Assumes 'AliExpress Order No' or similar unique ID exists.
-        
+        Reads the ID and tracking columns from the watermark row down. The
+        header check and the first chunk share one batch request.
+
+        Returns:
+            generator or None: None when a full read is required.
+        """
+        state = self._load_state()
+        if not state or 'header' not in state:
+            return None
+
+        header = state['header']
+        watermark = state['watermark']
+        id_col = resolve_column(header, ID_COLUMNS)
+        tracking_col = resolve_column(header, TRACKING_COLUMNS, contains='tracking')
+        if not id_col:
+            return None
+
+        columns = [c for c in (id_col, tracking_col) if c]
+        # The watermark row itself is re-read to verify nothing above it moved
+        end_row = watermark + self.chunk_rows
+        ranges = ['1:1'] + [_column_range(header.index(c), watermark, end_row) for c in columns]
+        with self.metrics.timer('sheet_request_seconds', call='batch_get'):
+            header_values, *column_values = self.sheet.batch_get(ranges, value_render_option='UNFORMATTED_VALUE')
+
+        current_header = _trim_header(header_values[0] if header_values else [])
+        if current_header != header:
+            print("Sheet header changed since last run, reading full sheet.")
+            return None
+
+        cells = [[row[0] if row else '' for row in values] for values in column_values]
+        # An empty anchor cell is left out of the response altogether
+        anchor = normalize_values(cells[0][:1])[0] if cells[0] else ''
+        if anchor != (state['anchor'] or ''):
+            print("Rows above the last watermark changed, reading full sheet.")
+            return None
+
+        self._last_read = {'header': header, 'watermark': watermark, 'anchor': state['anchor']}
+        print(f"Incremental read from row {watermark + 1}.")
+        return self._column_chunks(header, columns, watermark + 1, ([values[1:] for values in cells], end_row))
+
+    def _column_chunks(self, header, columns, start_row, first=None):
+        """
+        Yields ColumnTables for `columns` from `start_row` to the end of the
+        worksheet, one batch_get per `chunk_rows` rows.
+
         Args:
-            all_data (pd.DataFrame): The full dataset from the sheet.
-            processed_ids (set): A set of AliExpress Order IDs that were already processed.
-        
+            first (tuple): (cells, end row) of a first chunk already fetched.
+        """
+        last_row = self.sheet.row_count
+        while start_row <= last_row:
+            if first:
+                (cells, end_row), first = first, None
+            else:
+                end_row = start_row + self.chunk_rows - 1
+                ranges = [_column_range(header.index(c), start_row, end_row) for c in columns]
+                with self.metrics.timer('sheet_request_seconds', call='batch_get'):
+                    column_values = self.sheet.batch_get(ranges, value_render_option='UNFORMATTED_VALUE')
+                cells = [[row[0] if row else '' for row in values] for values in column_values]
+
+            with self.metrics.timer('dataframe_build_seconds', path=self.read_path):
+                # Trailing empty cells are left out of each column's values
+                row_count = max((len(c) for c in cells), default=0)
+                chunk = ColumnTable({col: values + [''] * (row_count - len(values)) for col, values in zip(columns, cells)},
+                                    range(start_row, start_row + row_count))
+            del cells
+            if row_count:
+                yield chunk
+            start_row = end_row + 1
+
+    def save_watermark(self, data, processed_ids):
+        """
+        Advances the watermark past the leading block of rows in this chunk
+        that need no more work (processed, or without an ID) and persists it.
+
+        Rows that are still pending, e.g. waiting for a tracking number,
+        stop the watermark so they are read again next run. The modifiedTime
+        used by check_for_changes() is only saved once iter_chunks() has read
+        the last chunk, so an interrupted run is never skipped next time.
+
+        Args:
+            data (ColumnTable): A chunk from iter_chunks().
+            processed_ids (set): AliExpress IDs processed so far, including this run.
+        """
+        if not self._last_read:
+            return
+
+        # Once a chunk has a pending row, later chunks cannot move the watermark
+        if not self._pending:
+            watermark, anchor, self._pending = advance_watermark(
+                data, processed_ids, self._last_read['watermark'], self._last_read['anchor'])
+            self._last_read.update(watermark=int(watermark), anchor=anchor)
+
+        self._save_state({
+            'header': self._last_read['header'],
+            'watermark': self._last_read['watermark'],
+            'anchor': self._last_read['anchor'],
+        })
+
+    def record_status(self, row_number, log_entry):
+        """Queues a row's Status, Shopify order name and message for write_statuses()."""
+        if self.write_back:
+            self._statuses[int(row_number)] = (
+                log_entry['AliExpress ID'],
+                [log_entry['Status'], log_entry['Shopify Order Name'], log_entry['Message']],
+            )
+
+    def write_statuses(self):
+        """
+        Writes the queued row outcomes into the STATUS_COLUMNS of the sheet.
+
+        Every queued row goes out in one values.batchUpdate request (one per
+        `write_chunk_rows` rows for very large runs), with one range per run
+        of consecutive rows, instead of a request per cell. Missing status
+        columns are added to the header in the same request.
+
+        The ID and status columns of the rows to write are read first, one
+        range per run of consecutive rows (a single batchGet for most runs).
+        Rows that moved since they were read (rows inserted or deleted above
+        them) are left alone. So are rows whose cells already hold the same
+        status, because every write bumps the sheet's modifiedTime and would
+        defeat the next run's precheck.
+
         Returns:
-            pd.DataFrame: A dataframe containing only the new rows.
+            int: Number of rows written.
         """
-        # Determine the ID column (flexible check)
-        # Determine the ID column (flexible check)
-        possible_id_cols = ['AliExpress Order No', 'Order Number', 'Order No', 'AliExpress Order ID', 'AliExpress ID']
-        id_col = next((col for col in possible_id_cols if col in all_data.columns), None)
-        
+        statuses, self._statuses = self._statuses, {}
+        if not statuses or not self.sheet or not self._last_read:
+            return 0
+
+        header = list(self._last_read['header'])
+        id_col = resolve_column(header, ID_COLUMNS)
         if not id_col:
-            raise ValueError(f"Could not find an Order ID column. Available columns: {all_data.columns.tolist()}")
-            
-        # Filter rows
-        # Ensure IDs are treated as strings and stripped of whitespace
-        all_data[id_col] = all_data[id_col].astype(str).str.strip()
-        
-        # Clean up tracking numbers if the column exists
-        possible_tracking_cols = ['Tracking Number', 'Tracking No', 'Tracking', 'Number']
-        tracking_col = next((col for col in possible_tracking_cols if col in all_data.columns), None)
-        if tracking_col:
-             all_data[tracking_col] = all_data[tracking_col].astype(str).str.strip()
-
-        # Filter where ID is NOT in processed_ids
-        # We check if the ID is present in the processed_ids set
-        new_rows = all_data[~all_data[id_col].isin(processed_ids)].copy()
-        
-        return new_rows, id_col
+            return 0
+
+        # Skip rows whose ID is no longer where it was read, or whose status is already there.
+        # Only the runs of rows being written are read back, so this follows the write's size.
+        existing = [c for c in STATUS_COLUMNS if c in header]
+        columns = [id_col] + existing
+        current, existing_values = {}, {}
+        runs = _consecutive_runs(sorted(statuses))
+        runs_per_request = max(1, MAX_RANGES_PER_REQUEST // len(columns))
+        for start in range(0, len(runs), runs_per_request):
+            batch = runs[start:start + runs_per_request]
+            ranges = [_column_range(header.index(c), run[0], run[-1]) for run in batch for c in columns]
+            with self.metrics.timer('sheet_request_seconds', call='batch_get'):
+                values = self.sheet.batch_get(ranges, value_render_option='UNFORMATTED_VALUE')
+            for position, run in enumerate(batch):
+                id_values, *status_values = values[position * len(columns):(position + 1) * len(columns)]
+                ids = normalize_values([row[0] if row else '' for row in id_values])
+                cells = [[str(row[0]) if row else '' for row in column] for column in status_values]
+                for offset, row in enumerate(run):
+                    current[row] = ids[offset] if offset < len(ids) else None
+                    existing_values[row] = [column[offset] if offset < len(column) else '' for column in cells]
+
+        moved = unchanged = 0
+        for row, (ali_id, values) in list(statuses.items()):
+            if current.get(row) != ali_id:
+                moved += 1
+                del statuses[row]
+            elif len(existing) == len(STATUS_COLUMNS) and existing_values[row] == [str(v) for v in values]:
+                unchanged += 1
+                del statuses[row]
+        if moved:
+            print(f"[WARNING] {moved} rows moved since they were read; their status was not written back.")
+        self.metrics.inc('sheet_rows_unchanged_total', unchanged)
+        if not statuses:
+            return 0
+
+        data = []
+        missing = [c for c in STATUS_COLUMNS if c not in header]
+        if missing:
+            if len(header) + len(missing) > self.sheet.col_count:
+                with self.metrics.timer('sheet_request_seconds', call='add_cols'):
+                    self.sheet.add_cols(len(header) + len(missing) - self.sheet.col_count)
+            data.append({'range': _block_range(len(header), len(header) + len(missing) - 1, 1, 1), 'values': [missing]})
+            header += missing
+        positions = [header.index(c) for c in STATUS_COLUMNS]
+        # The status columns are normally adjacent, so each run of rows is a single range
+        adjacent = positions == list(range(positions[0], positions[0] + len(positions)))
+
+        rows = sorted(statuses)
+        written = 0
+        for start in range(0, len(rows), self.write_chunk_rows):
+            chunk = rows[start:start + self.write_chunk_rows]
+            for run in _consecutive_runs(chunk):
+                values = [statuses[row][1] for row in run]
+                if adjacent:
+                    data.append({'range': _block_range(positions[0], positions[-1], run[0], run[-1]), 'values': values})
+                else:
+                    for i, position in enumerate(positions):
+                        data.append({'range': _column_range(position, run[0], run[-1]),
+                                     'values': [[v[i]] for v in values]})
+            with self.metrics.timer('sheet_request_seconds', call='batch_update'):
+                self.sheet.batch_update(data, value_input_option='RAW')
+            written += len(chunk)
+            data = []
+
+        self.metrics.inc('sheet_rows_written_total', written)
+        if missing:
+            # Keep the saved header in step so the next run can still read incrementally
+            self._last_read['header'] = header
+            self._save_state({'header': header})
+        return written
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f).get(self.sheet_name)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Ignoring unreadable sheet state {self.state_path}: {e}")
+            return None
+
+    def _save_state(self, sheet_state):
+        state = {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+        state.setdefault(self.sheet_name, {}).update(sheet_state)
+
+        # Write-then-rename so a crash never leaves a truncated state file
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+def _trim_header(values):
+    header = [str(v) for v in values]
+    while header and header[-1] == '':
+        header.pop()
+    return header
+
+def _column_range(index, first_row, last_row):
+    """A1 range of one column between two rows, e.g. 'B2:B50001'."""
+    return _block_range(index, index, first_row, last_row)
+
+def _block_range(first_index, last_index, first_row, last_row):
+    """A1 range of a block of columns between two rows, e.g. 'D2:F10'."""
+    return f"{_column_letter(first_index)}{first_row}:{_column_letter(last_index)}{last_row}"
+
+def _consecutive_runs(rows):
+    """Splits sorted row numbers into lists of consecutive rows."""
+    runs = []
+    for row in rows:
+        if runs and row == runs[-1][-1] + 1:
+            runs[-1].append(row)
+        else:
+            runs.append([row])
+    return runs
+
+def _column_letter(index):
+    """0-based column index -> A1 column letters."""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
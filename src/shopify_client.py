@@ -1,15 +1,159 @@
 import requests
 import os
 import json
+import time
+import random
+import threading
+from requests.adapters import HTTPAdapter
+from order_index import OrderIndex
+from rate_limiter import ShopifyRateLimiter, estimate_query_cost
+from metrics import RunMetrics
+
+# Transient server errors worth retrying on idempotent requests
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Shopify rejects any single query whose requested cost is above this
+MAX_QUERY_COST = 1000
+# Share of that limit kept free when sizing batched lookups
+LOOKUP_COST_MARGIN = 0.1
+
+# Bulk query used to snapshot every open order in a single operation.
+# Fields mirror the per-row search so the index sees the same data.
+BULK_OPEN_ORDERS_QUERY = """
+{
+    orders(query: "status:open") {
+        edges {
+            node {
+                id
+                legacyResourceId
+                name
+                note
+                tags
+                customAttributes {
+                    key
+                    value
+                }
+                displayFulfillmentStatus
+                fulfillmentOrders {
+                    edges {
+                        node {
+                            id
+                            status
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+"""
+
+# Pages through all open orders for the deep scan fallback. Only what matching
+# needs is selected; the few matched orders are re-read with ORDERS_BY_ID_QUERY.
+DEEP_SCAN_QUERY = """
+query($cursor: String) {
+    orders(first: 100, after: $cursor, query: "status:open") {
+        edges {
+            node {
+                id
+                legacyResourceId
+                name
+                note
+                tags
+                customAttributes {
+                    key
+                    value
+                }
+            }
+        }
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+    }
+}
+"""
+
+# Fields every lookup returns for a matched order.
+# Tracking numbers are only fetched for clients created with fetch_tracking.
+# Fulfillment orders are filtered to OPEN by Shopify, so an order split across
+# locations still returns its open one however many closed ones come first;
+# only the first open one is fulfilled, so one is all that is fetched.
+LOOKUP_FIELDS_FRAGMENT = """
+fragment LookupFields on Order {
+    id
+    legacyResourceId
+    name
+    note
+    tags
+    customAttributes {
+        key
+        value
+    }
+    displayFulfillmentStatus
+    fulfillmentOrders(first: 1, query: "status:OPEN") {
+        edges {
+            node {
+                id
+                status
+            }
+        }
+    }
+    fulfillments @include(if: $withTracking) {
+        trackingInfo {
+            number
+        }
+    }
+}
+"""
+
+# Resolves a chunk of AliExpress IDs in one request (see find_orders_by_ali_ids)
+BATCH_LOOKUP_QUERY = """
+query($first: Int!, $tagQuery: String!, $textQuery: String!, $withTracking: Boolean = false) {
+    tagged: orders(first: $first, query: $tagQuery) {
+        edges {
+            node {
+                ...LookupFields
+            }
+        }
+    }
+    matched: orders(first: $first, query: $textQuery) {
+        edges {
+            node {
+                ...LookupFields
+            }
+        }
+    }
+}
+""" + LOOKUP_FIELDS_FRAGMENT
+
+# Re-reads the orders a deep scan matched, by order ID
+ORDERS_BY_ID_QUERY = """
+query($first: Int!, $idQuery: String!, $withTracking: Boolean = false) {
+    orders(first: $first, query: $idQuery) {
+        edges {
+            node {
+                ...LookupFields
+            }
+        }
+    }
+}
+""" + LOOKUP_FIELDS_FRAGMENT
+
+def _escape_search(value):
+    """Escapes a value for use inside a quoted Shopify search term."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
 
 class ShopifyClient:
-    def __init__(self, shop_url=None, access_token=None, api_version=None):
+    def __init__(self, shop_url=None, access_token=None, api_version=None, rate_limiter=None, max_retries=5,
+                 pool_size=None, connect_timeout=None, read_timeout=None, lookup_batch_size=None,
+                 local_index=None, metrics=None, id_location=None, id_attribute=None, fetch_tracking=False):
         self.shop_url = shop_url or os.getenv('SHOPIFY_SHOP_URL')
         self.access_token = access_token or os.getenv('SHOPIFY_ACCESS_TOKEN')
         self.api_version = api_version or os.getenv('SHOPIFY_API_VERSION', '2024-01')
         
         # Clean up shop URL
-        if self.shop_url and not self.shop_url.startswith('https://'):
+        if self.shop_url and not self.shop_url.startswith(('https://', 'http://')):
             self.shop_url = f"https://{self.shop_url}"
         
         self.base_url = f"{self.shop_url}/admin/api/{self.api_version}"
@@ -17,141 +161,592 @@ class ShopifyClient:
             "X-Shopify-Access-Token": self.access_token,
             "Content-Type": "application/json"
         }
+        # Populated by load_open_orders_snapshot(); None means live search mode
+        self.order_index = None
+        # Where orders hold the AliExpress ID (see OrderIndex); None matches tags, name and attributes
+        if id_location not in (None, 'tags', 'name', 'note', 'note_attributes'):
+            print(f"[WARNING] Unknown AliExpress ID location '{id_location}', matching tags, name and attributes.")
+            id_location = None
+        self.id_location = id_location
+        self.id_attribute = id_attribute
+        # Whether lookups also return the tracking numbers already on each order
+        self.fetch_tracking = fetch_tracking
+        # Optional webhook-fed index (WebhookOrderIndex built with the same id_location), consulted before any API search
+        self.local_index = local_index
+        # One limiter per shop, shared by every thread using this client
+        self.rate_limiter = rate_limiter or ShopifyRateLimiter()
+        # Request, retry, throttle and cost metrics; main swaps in a fresh instance per run
+        self.metrics = metrics or RunMetrics()
+        self.max_retries = max_retries
+        # IDs per batched lookup request, lowered if needed so each query stays under the cost limit
+        self.lookup_batch_size = self._fit_lookup_batch_size(
+            lookup_batch_size or int(os.getenv('SHOPIFY_LOOKUP_BATCH_SIZE', 50)))
+        # Aliased fulfillment mutations per request (10 points each)
+        self.fulfillment_batch_size = int(os.getenv('SHOPIFY_FULFILLMENT_BATCH_SIZE', 10))
+        # Run-scoped deep scan index: (OrderIndex or None, built at)
+        self.open_orders_ttl = float(os.getenv('SHOPIFY_OPEN_ORDERS_TTL', 600))
+        self._open_orders_cache = (None, 0.0)
+        self._open_orders_lock = threading.Lock()
+        # Run-scoped REST fulfillment orders per order ID, for the update_fulfillment fallback
+        self._fulfillment_orders = {}
+        self.backoff_base = 0.5
+        self.backoff_cap = 30
+
+        # Pooled keep-alive session: one TLS handshake per connection, not per call
+        pool_size = pool_size or int(os.getenv('SHOPIFY_POOL_SIZE', 10))
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (
+            float(connect_timeout or os.getenv('SHOPIFY_CONNECT_TIMEOUT', 5)),
+            float(read_timeout or os.getenv('SHOPIFY_READ_TIMEOUT', 30)),
+        )
+
+    def _new_index(self):
+        return OrderIndex(self.id_location, self.id_attribute)
+
+    def _fit_lookup_batch_size(self, requested):
+        """Largest batch size up to `requested` whose lookup query is estimated below the cost limit."""
+        limit = min(MAX_QUERY_COST, self.rate_limiter.graphql.maximum) * (1 - LOOKUP_COST_MARGIN)
+        size = max(1, int(requested))
+        while size > 1 and estimate_query_cost(BATCH_LOOKUP_QUERY, self._lookup_variables(size)) > limit:
+            size -= 1
+        if size < int(requested):
+            print(f"[WARNING] Lookup batch size {requested} would exceed the query cost limit, using {size}.")
+        return size
+
+    def _lookup_variables(self, id_count):
+        """Page size and flags of a batched lookup for `id_count` IDs (the search strings are added per chunk)."""
+        # A little room for extra matches while keeping the query cost bounded
+        return {"first": min(100, id_count + 10), "withTracking": self.fetch_tracking}
+
+    def get_shop(self):
+        """Returns the shop resource; doubles as a credentials check."""
+        return self._get("shop.json").get('shop', {})
+
+    def reset_run_caches(self):
+        """Forgets per-run state; called at the start of every sync cycle."""
+        self._fulfillment_orders.clear()
 
     def _get(self, endpoint, params=None):
         """Helper for GET requests"""
         url = f"{self.base_url}/{endpoint}"
-        response = requests.get(url, headers=self.headers, params=params)
-        response.raise_for_status()
+        response = self._send_rest('GET', url, params=params)
         return response.json()
 
     def _post(self, endpoint, data):
         """Helper for POST requests"""
         url = f"{self.base_url}/{endpoint}"
-        response = requests.post(url, headers=self.headers, json=data)
-        response.raise_for_status()
+        response = self._send_rest('POST', url, json=data)
         return response.json()
 
+    def _send_rest(self, method, url, **kwargs):
+        """
+        Sends a REST request through the rate limiter on the pooled session.
+        Throttled (429) responses are always retried; network errors and 5xx
+        only for idempotent GETs.
+        """
+        idempotent = method == 'GET'
+        for attempt in range(self.max_retries + 1):
+            waited = self.rate_limiter.acquire_rest()
+            self.metrics.inc('shopify_throttle_wait_seconds_total', waited, api='rest')
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=self.headers, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                self.rate_limiter.release_rest()
+                self.metrics.inc('shopify_requests_total', api='rest', method=method, status='error')
+                if attempt == self.max_retries or not self._can_retry_error(e, idempotent):
+                    raise
+                print(f"  [RETRY] {method} {url} failed ({e}), retrying ({attempt + 1}/{self.max_retries})")
+                self.metrics.inc('shopify_retries_total', api='rest', reason='error')
+                self._backoff(attempt)
+                continue
+
+            self.metrics.observe('shopify_request_seconds', time.perf_counter() - started, api='rest', method=method)
+            self.metrics.inc('shopify_requests_total', api='rest', method=method, status=response.status_code)
+            self.rate_limiter.record_rest_response(response)
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable or attempt == self.max_retries:
+                break
+            print(f"  [RETRY] {method} {url} returned {response.status_code}, retrying ({attempt + 1}/{self.max_retries})")
+            self.metrics.inc('shopify_retries_total', api='rest', reason='throttled' if response.status_code == 429 else 'status')
+            self._backoff(attempt)
+
+        response.raise_for_status()
+        return response
+
     def _graphql(self, query, variables=None):
-        """Executes a GraphQL query."""
+        """
+        Executes a GraphQL query.
+        Queries are retried like GETs; mutations only when throttled.
+        """
         url = f"{self.shop_url}/admin/api/{self.api_version}/graphql.json"
-        response = requests.post(url, headers=self.headers, json={'query': query, 'variables': variables})
+        idempotent = not query.lstrip().startswith('mutation')
+        operation = 'query' if idempotent else 'mutation'
+        for attempt in range(self.max_retries + 1):
+            charged, waited = self.rate_limiter.acquire_graphql(query, variables)
+            self.metrics.inc('shopify_throttle_wait_seconds_total', waited, api='graphql')
+            started = time.perf_counter()
+            try:
+                response = self.session.post(url, headers=self.headers, timeout=self.timeout,
+                                             json={'query': query, 'variables': variables})
+            except requests.RequestException as e:
+                self.rate_limiter.release_graphql(charged)
+                self.metrics.inc('shopify_requests_total', api='graphql', method=operation, status='error')
+                if attempt == self.max_retries or not self._can_retry_error(e, idempotent):
+                    raise
+                print(f"  [RETRY] GraphQL request failed ({e}), retrying ({attempt + 1}/{self.max_retries})")
+                self.metrics.inc('shopify_retries_total', api='graphql', reason='error')
+                self._backoff(attempt)
+                continue
+
+            self.metrics.observe('shopify_request_seconds', time.perf_counter() - started, api='graphql', method=operation)
+            self.metrics.inc('shopify_requests_total', api='graphql', method=operation, status=response.status_code)
+            payload = None
+            if response.status_code == 200:
+                try:
+                    payload = response.json()
+                except ValueError:
+                    # An HTML or proxy error page; nothing to sync the bucket from
+                    self.rate_limiter.release_graphql(charged)
+                    if attempt == self.max_retries or not idempotent:
+                        raise RuntimeError(f"GraphQL response is not JSON: {response.text[:200]!r}")
+                    print(f"  [RETRY] GraphQL response is not JSON, retrying ({attempt + 1}/{self.max_retries})")
+                    self.metrics.inc('shopify_retries_total', api='graphql', reason='invalid_json')
+                    self._backoff(attempt)
+                    continue
+            self._record_graphql_cost(payload)
+            throttled = self.rate_limiter.record_graphql_response(
+                query, charged, response, payload, variables, sent_at=started)
+            retryable = throttled or (idempotent and response.status_code in RETRY_STATUSES)
+            if not retryable or attempt == self.max_retries:
+                break
+            print(f"  [RETRY] GraphQL request {'throttled' if throttled else f'returned {response.status_code}'}, retrying ({attempt + 1}/{self.max_retries})")
+            self.metrics.inc('shopify_retries_total', api='graphql', reason='throttled' if throttled else 'status')
+            self._backoff(attempt)
+
         response.raise_for_status()
-        return response.json()
+        return payload
 
-    def find_order_by_ali_id(self, aliexpress_id):
-        """
-        Robust search for Shopify Order by AliExpress ID using GraphQL.
-        Checks: tags, customAttributes (note_attributes), and name.
-        """
-        # GraphQL Query to find orders by tag or generic search
-        # Note: 'query' filter matches against name, email, tags, etc.
-        gql_query = """
-        query($query: String!) {
-            orders(first: 5, query: $query) {
-                edges {
-                    node {
-                        id
-                        legacyResourceId
-                        name
-                        tags
-                        customAttributes {
-                            key
-                            value
-                        }
-                        displayFulfillmentStatus
-                    }
+    def _record_graphql_cost(self, payload):
+        """Tracks query cost consumed and the cost budget Shopify reports as available."""
+        cost = ((payload or {}).get('extensions') or {}).get('cost') or {}
+        if cost.get('requestedQueryCost') is not None:
+            self.metrics.inc('shopify_graphql_cost_points_total', cost['requestedQueryCost'], kind='requested')
+        if cost.get('actualQueryCost') is not None:
+            self.metrics.inc('shopify_graphql_cost_points_total', cost['actualQueryCost'], kind='actual')
+        status = cost.get('throttleStatus')
+        if status:
+            self.metrics.set_gauge('shopify_graphql_budget_points', status['currentlyAvailable'], kind='available')
+            self.metrics.set_gauge('shopify_graphql_budget_points', status['maximumAvailable'], kind='maximum')
+
+    @staticmethod
+    def _can_retry_error(error, idempotent):
+        # A connect timeout means the request never left, so even a POST is safe to resend
+        return idempotent or isinstance(error, requests.ConnectTimeout)
+
+    def _backoff(self, attempt):
+        """Sleeps with full-jitter exponential backoff."""
+        time.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt))))
+
+    def load_open_orders_snapshot(self, poll_interval=2, timeout=600):
+        """
+        Snapshots all open orders with a bulkOperationRunQuery and builds
+        an in-memory AliExpress ID -> order index from the JSONL result.
+
+        Once loaded, find_orders_by_ali_ids answers from the index without
+        any network call.
+
+        Returns:
+            int: Number of orders indexed.
+        """
+        mutation = """
+        mutation($query: String!) {
+            bulkOperationRunQuery(query: $query) {
+                bulkOperation {
+                    id
+                    status
+                }
+                userErrors {
+                    field
+                    message
                 }
             }
         }
         """
-        
-        try:
-            # 1. Search by Tag (most reliable if tagged)
-            data = self._graphql(gql_query, variables={"query": f"tag:{aliexpress_id}"})
-            orders = data.get('data', {}).get('orders', {}).get('edges', [])
-            
-            if orders:
-                return self._parse_gql_order(orders[0]['node'])
+        data = self._graphql(mutation, variables={"query": BULK_OPEN_ORDERS_QUERY})
+        result = (data.get('data') or {}).get('bulkOperationRunQuery') or {}
+        errors = result.get('userErrors') or data.get('errors')
+        if errors:
+            raise RuntimeError(f"Bulk operation could not be started: {errors}")
 
-            # 2. General Search (Matches Name, Note Attributes in some cases)
-            data = self._graphql(gql_query, variables={"query": str(aliexpress_id)})
-            orders = data.get('data', {}).get('orders', {}).get('edges', [])
-            
-            for edge in orders:
-                order = edge['node']
-                # Verify exact match in attributes or name to avoid partial matches
-                if self._verify_match(order, aliexpress_id):
-                    return self._parse_gql_order(order)
-            
-            # 3. Fallback: Scan recent open orders (Deep Scan)
-            # Only do this if we really expect it in note_attributes but it wasn't indexed
-            return self._deep_scan_open_orders(aliexpress_id)
-            
-        except Exception as e:
-            print(f"Error searching for order {aliexpress_id}: {e}")
-            return None
+        operation = self._wait_for_bulk_operation(poll_interval, timeout)
 
-    def _verify_match(self, order, target_id):
-        """Verifies if the order actually matches the target ID"""
-        target_id = str(target_id)
-        
-        # Check Name
-        if target_id in order['name']:
-            return True
-            
-        # Check Tags
-        if target_id in order['tags']:
-            return True
-            
-        # Check Attributes
-        for attr in order['customAttributes']:
-            if attr['value'] == target_id:
-                return True
-                
-        return False
-
-    def _deep_scan_open_orders(self, target_id):
-        """Fetches recent open orders to check non-indexed attributes."""
+        index = self._new_index()
+        orders_by_gid = {}
+        if operation.get('url'):
+            for node in self._stream_jsonl(operation['url']):
+                # Fulfillment orders arrive as separate lines after their order, linked by __parentId
+                if '__parentId' in node:
+                    parent = orders_by_gid.get(node['__parentId'])
+                    if parent is not None and node.get('status') == 'OPEN':
+                        parent['fulfillment_order_ids'].append(node['id'])
+                    continue
+                order = self._parse_gql_order(node)
+                order['fulfillment_order_ids'] = []
+                orders_by_gid[node['id']] = order
+                index.add(node, order)
+        order_count = len(orders_by_gid)
+
+        self.order_index = index
+        print(f"Indexed {order_count} open orders from bulk snapshot.")
+        return order_count
+
+    def _wait_for_bulk_operation(self, poll_interval, timeout):
+        """Polls currentBulkOperation until it reaches a terminal status."""
         query = """
         {
-            orders(first: 50, query: "status:open") {
-                edges {
-                    node {
-                        id
-                        legacyResourceId
-                        name
-                        customAttributes {
-                            key
-                            value
-                        }
-                    }
-                }
+            currentBulkOperation {
+                id
+                status
+                errorCode
+                objectCount
+                url
             }
         }
         """
-        try:
+        deadline = time.monotonic() + timeout
+        while True:
             data = self._graphql(query)
-            orders = data.get('data', {}).get('orders', {}).get('edges', [])
-            
-            for edge in orders:
-                order = edge['node']
-                for attr in order['customAttributes']:
-                    if attr['value'] == str(target_id):
-                        return self._parse_gql_order(order)
-            return None
+            operation = (data.get('data') or {}).get('currentBulkOperation') or {}
+            status = operation.get('status')
+
+            if status == 'COMPLETED':
+                return operation
+            if status in ('FAILED', 'CANCELED', 'EXPIRED'):
+                raise RuntimeError(f"Bulk operation {status.lower()}: {operation.get('errorCode')}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Bulk operation still {status} after {timeout}s")
+
+            time.sleep(poll_interval)
+
+    def _stream_jsonl(self, url):
+        """Yields one parsed object per line without loading the whole file."""
+        # Signed storage URL: no Shopify headers, but reuse the pooled connection
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def find_orders_by_ali_ids(self, aliexpress_ids, errors=None):
+        """
+        Finds the Shopify orders of several AliExpress IDs, matched in tags,
+        customAttributes (note_attributes) and name, or only where
+        `id_location` says the ID is stored.
+
+        Each chunk of IDs is resolved with one GraphQL request holding two
+        aliased orders() fields: an OR-combined tag search and an OR-combined
+        general search. IDs already in the webhook-fed local index are
+        answered without a request, and IDs still unmatched share a single
+        deep scan.
+
+        Args:
+            aliexpress_ids (list): AliExpress order IDs, at most `lookup_batch_size` per request.
+            errors (set): Optional; receives the IDs whose search failed (request
+                error, outage), as opposed to a search that found no order.
+
+        Returns:
+            dict: AliExpress ID -> parsed order, for the IDs that were found.
+        """
+        errors = set() if errors is None else errors
+        ids = list(dict.fromkeys(str(i).strip() for i in aliexpress_ids if str(i).strip()))
+        if self.order_index is not None:
+            found = {i: self.order_index.get(i) for i in ids if i in self.order_index}
+            self.metrics.inc('shopify_lookups_total', len(found), source='bulk_index')
+            self.metrics.inc('shopify_lookups_total', len(ids) - len(found), source='miss')
+            return found
+
+        found = {}
+        if self.local_index is not None:
+            found = self.find_in_local_index(ids)
+            self.metrics.inc('shopify_lookups_total', len(found), source='local_index')
+            ids = [i for i in ids if i not in found]
+
+        for start in range(0, len(ids), self.lookup_batch_size):
+            chunk = ids[start:start + self.lookup_batch_size]
+            try:
+                with self.metrics.timer('shopify_lookup_seconds', strategy='batch'):
+                    matched = self._lookup_chunk(chunk)
+            except Exception as e:
+                print(f"Error searching for orders {chunk[0]}..{chunk[-1]}: {e}")
+                errors.update(chunk)
+                continue
+            self.metrics.inc('shopify_lookups_total', len(matched), source='batch')
+            found.update(matched)
+
+        missing = [i for i in ids if i not in found]
+        if missing:
+            try:
+                with self.metrics.timer('shopify_lookup_seconds', strategy='deep_scan'):
+                    scanned = self._scan_open_orders(missing)
+            except Exception as e:
+                print(f"Deep scan error: {e}")
+                scanned = {}
+                errors.update(missing)
+            found.update(scanned)
+            # IDs whose batch search failed are not misses even if the deep scan ran
+            errors.difference_update(found)
+            self.metrics.inc('shopify_lookups_total', len(scanned), source='deep_scan')
+            self.metrics.inc('shopify_lookups_total', len([i for i in missing if i not in found and i not in errors]), source='miss')
+            self.metrics.inc('shopify_lookups_total', len([i for i in missing if i in errors]), source='error')
+        return found
+
+    def _lookup_chunk(self, chunk):
+        """Resolves one chunk of IDs in a single request; raises when the request fails."""
+        tag_query = " OR ".join(f'tag:"{_escape_search(i)}"' for i in chunk)
+        text_query = " OR ".join(f'"{_escape_search(i)}"' for i in chunk)
+
+        data = self._graphql(BATCH_LOOKUP_QUERY, variables={
+            **self._lookup_variables(len(chunk)),
+            "tagQuery": tag_query,
+            "textQuery": text_query,
+        })
+        if not (data or {}).get('data'):
+            raise RuntimeError(f"No data in response: {(data or {}).get('errors')}")
+
+        results = data['data']
+        index = self._new_index()
+        # Tag matches are the most reliable, so they are added last and win
+        for alias in ('matched', 'tagged'):
+            for edge in (results.get(alias) or {}).get('edges', []):
+                node = edge['node']
+                index.add(node, self._parse_gql_order(node))
+
+        return {i: index.get(i) for i in chunk if i in index}
+
+    def _scan_open_orders(self, target_ids):
+        """
+        Checks several IDs at once against the run-scoped open-order index,
+        then fetches the fulfillment details of the matched orders.
+
+        Returns:
+            dict: AliExpress ID -> parsed order for every ID found.
+        """
+        index = self._get_open_orders_index()
+        matched = {str(i): index.get(i) for i in target_ids if str(i) in index}
+        if not matched:
+            return {}
+        details = self._get_orders_by_id([order['id'] for order in matched.values()])
+        return {ali_id: details[order['id']] for ali_id, order in matched.items() if order['id'] in details}
+
+    def find_in_local_index(self, aliexpress_ids):
+        """
+        Looks AliExpress IDs up in the webhook-fed local index.
+
+        Hits whose open fulfillment orders the index does not know are
+        re-read in batches, so they are fulfilled with fulfillmentCreate
+        rather than the per-order REST path, and what was read is stored in
+        the index for later runs. If the re-read fails, the indexed orders
+        are returned as they are.
+
+        Returns:
+            dict: AliExpress ID -> parsed order, for the IDs that were found.
+        """
+        found = self.local_index.get_many(aliexpress_ids)
+        unknown = {str(order['id']) for order in found.values() if order['fulfillment_order_ids'] is None}
+        if not unknown:
+            return found
+        try:
+            with self.metrics.timer('shopify_lookup_seconds', strategy='local_index'):
+                orders = self._get_orders_by_id(unknown)
         except Exception as e:
-            print(f"Deep scan error: {e}")
-            return None
+            print(f"Error reading fulfillment orders of indexed orders: {e}")
+            return found
+        for order_id, order in orders.items():
+            self.local_index.record_fulfillment_orders(order_id, order['fulfillment_order_ids'])
+        return {ali_id: orders.get(str(order['id']), order) for ali_id, order in found.items()}
+
+    def _get_orders_by_id(self, order_ids):
+        """
+        Reads orders with the full lookup selection (open fulfillment order,
+        tracking numbers), `lookup_batch_size` per request. Raises when a
+        request fails.
+
+        Returns:
+            dict: Order ID (legacyResourceId) -> parsed order.
+        """
+        order_ids = list(dict.fromkeys(str(i) for i in order_ids))
+        orders = {}
+        for start in range(0, len(order_ids), self.lookup_batch_size):
+            chunk = order_ids[start:start + self.lookup_batch_size]
+            data = self._graphql(ORDERS_BY_ID_QUERY, variables={
+                "first": len(chunk),
+                "idQuery": " OR ".join(f"id:{i}" for i in chunk),
+                "withTracking": self.fetch_tracking,
+            })
+            if not (data or {}).get('data'):
+                raise RuntimeError(f"No data in response: {(data or {}).get('errors')}")
+            for edge in (data['data'].get('orders') or {}).get('edges', []):
+                order = self._parse_gql_order(edge['node'])
+                orders[str(order['id'])] = order
+        return orders
+
+    def _get_open_orders_index(self):
+        """
+        Pages through every open order once and indexes it by customAttributes
+        values (and name). The index is reused by later fallbacks until it is
+        older than `open_orders_ttl` seconds. Raises when a page fails, so an
+        incomplete scan is never taken for a miss.
+        """
+        # Concurrent lookups wait for a single scan instead of starting their own
+        with self._open_orders_lock:
+            cached_index, built_at = self._open_orders_cache
+            if cached_index is not None and time.monotonic() - built_at < self.open_orders_ttl:
+                return cached_index
+
+            index = self._new_index()
+            cursor = None
+            pages = 0
+            while True:
+                data = self._graphql(DEEP_SCAN_QUERY, variables={"cursor": cursor})
+                if not (data or {}).get('data'):
+                    raise RuntimeError(f"No data in response: {(data or {}).get('errors')}")
+                orders = data['data'].get('orders') or {}
+                for edge in orders.get('edges', []):
+                    node = edge['node']
+                    index.add(node, self._parse_gql_order(node))
+                pages += 1
+
+                page_info = orders.get('pageInfo') or {}
+                if not page_info.get('hasNextPage'):
+                    break
+                cursor = page_info['endCursor']
+
+            print(f"  Deep scan indexed open orders ({pages} pages).")
+            self._open_orders_cache = (index, time.monotonic())
+            return index
 
     def _parse_gql_order(self, node):
         """Converts GraphQL node to simple dict format used by the app"""
+        # Open fulfillment order IDs, when the query asked for them (None = unknown)
+        fulfillment_order_ids = None
+        if node.get('fulfillmentOrders') is not None:
+            fulfillment_order_ids = [
+                edge['node']['id'] for edge in node['fulfillmentOrders'].get('edges', [])
+                if edge['node'].get('status') == 'OPEN'
+            ]
+        # Tracking numbers already on the order, likewise None when not asked for
+        tracking_numbers = None
+        if node.get('fulfillments') is not None:
+            tracking_numbers = [
+                info['number'] for fulfillment in node['fulfillments']
+                for info in fulfillment.get('trackingInfo') or [] if info.get('number')
+            ]
         return {
             "id": node['legacyResourceId'],  # REST ID is needed for REST fulfillment endpoint
             "name": node['name'],
-            "graphql_id": node['id']
+            "graphql_id": node['id'],
+            "fulfillment_order_ids": fulfillment_order_ids,
+            "tracking_numbers": tracking_numbers
         }
 
+    def create_fulfillments(self, fulfillments):
+        """
+        Creates fulfillments for several orders with aliased GraphQL
+        fulfillment mutations, `fulfillment_batch_size` per request.
+
+        Orders looked up without fulfillment order IDs fall back to the REST
+        path in update_fulfillment.
+
+        Args:
+            fulfillments (list): (order, tracking_number, tracking_company) tuples,
+                where order is a dict from the lookup methods.
+
+        Returns:
+            list: (success, message) per request, in the same order.
+        """
+        results = [None] * len(fulfillments)
+        paths = ['graphql'] * len(fulfillments)
+        batchable = []
+        for position, (order, tracking_number, tracking_company) in enumerate(fulfillments):
+            fulfillment_order_ids = order.get('fulfillment_order_ids')
+            if fulfillment_order_ids is None:
+                paths[position] = 'rest'
+                with self.metrics.timer('shopify_fulfillment_seconds', path='rest'):
+                    ok = self.update_fulfillment(order['id'], tracking_number, tracking_company)
+                results[position] = (ok, "Successfully updated tracking." if ok else "Failed to update fulfillment via API.")
+            elif not fulfillment_order_ids:
+                paths[position] = 'none'
+                results[position] = (False, "No open fulfillment orders found.")
+            else:
+                batchable.append((position, fulfillment_order_ids[0], tracking_number, tracking_company))
+
+        for start in range(0, len(batchable), self.fulfillment_batch_size):
+            chunk = batchable[start:start + self.fulfillment_batch_size]
+            with self.metrics.timer('shopify_fulfillment_seconds', path='graphql'):
+                outcomes = self._create_fulfillment_chunk(chunk)
+            for position, outcome in zip((c[0] for c in chunk), outcomes):
+                results[position] = outcome
+
+        for path, (ok, message) in zip(paths, results):
+            self.metrics.inc('shopify_fulfillments_total', path=path, result='success' if ok else 'failed')
+        return results
+
+    def _create_fulfillment_chunk(self, chunk):
+        """Sends one request holding an aliased fulfillment mutation per entry."""
+        # fulfillmentCreateV2 was replaced by fulfillmentCreate in 2024-07
+        if self.api_version >= '2024-07':
+            mutation_name, input_type = 'fulfillmentCreate', 'FulfillmentInput'
+        else:
+            mutation_name, input_type = 'fulfillmentCreateV2', 'FulfillmentV2Input'
+
+        declarations = []
+        fields = []
+        variables = {}
+        for i, (position, fulfillment_order_id, tracking_number, tracking_company) in enumerate(chunk):
+            declarations.append(f"$f{i}: {input_type}!")
+            fields.append(f"""
+            f{i}: {mutation_name}(fulfillment: $f{i}) {{
+                fulfillment {{
+                    id
+                    status
+                }}
+                userErrors {{
+                    field
+                    message
+                }}
+            }}""")
+            variables[f"f{i}"] = {
+                "lineItemsByFulfillmentOrder": [{"fulfillmentOrderId": fulfillment_order_id}],
+                "trackingInfo": {"number": tracking_number, "company": tracking_company},
+            }
+        mutation = f"mutation({', '.join(declarations)}) {{{''.join(fields)}\n        }}"
+
+        try:
+            data = self._graphql(mutation, variables=variables)
+        except Exception as e:
+            print(f"Error creating fulfillments: {e}")
+            return [(False, f"Failed to update fulfillment via API: {e}")] * len(chunk)
+
+        payload = data.get('data') or {}
+        outcomes = []
+        for i in range(len(chunk)):
+            result = payload.get(f"f{i}")
+            if result is None:
+                outcomes.append((False, f"Failed to update fulfillment via API: {data.get('errors')}"))
+                continue
+            user_errors = result.get('userErrors') or []
+            if user_errors:
+                details = "; ".join(f"{'.'.join(e.get('field') or [])}: {e.get('message')}" for e in user_errors)
+                outcomes.append((False, f"Fulfillment rejected: {details}"))
+            else:
+                outcomes.append((True, "Successfully updated tracking."))
+        return outcomes
+
     def update_fulfillment(self, order_id, tracking_number, tracking_company="Other"):
         """
         Updates the fulfillment status of an order.
@@ -166,8 +761,7 @@ class ShopifyClient:
         try:
             # Step 1: Get Fulfillment Orders (New mechanism as of 2023)
             # We need the fulfillment_order_id to create a fulfillment.
-            f_orders_resp = self._get(f"orders/{order_id}/fulfillment_orders.json")
-            fulfillment_orders = f_orders_resp.get("fulfillment_orders", [])
+            fulfillment_orders = self._get_fulfillment_orders(order_id)
             
             target_f_order = None
             for fo in fulfillment_orders:
@@ -195,6 +789,8 @@ class ShopifyClient:
             }
             
             self._post("fulfillments.json", payload)
+            # The fulfillment order is closed now
+            self._fulfillment_orders.pop(str(order_id), None)
             print(f"Successfully fulfilled Order {order_id} with Tracking {tracking_number}")
             return True
 
@@ -202,3 +798,10 @@ class ShopifyClient:
             print(f"Error updating fulfillment for Order {order_id}: {e}")
             # Fallback to legacy (if the shop is on an older version, though deprecated)
             return False
+
+    def _get_fulfillment_orders(self, order_id):
+        """REST fulfillment orders of one order, fetched at most once per run."""
+        key = str(order_id)
+        if key not in self._fulfillment_orders:
+            self._fulfillment_orders[key] = self._get(f"orders/{order_id}/fulfillment_orders.json").get("fulfillment_orders", [])
+        return self._fulfillment_orders[key]
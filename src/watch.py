@@ -0,0 +1,60 @@
+import random
+import signal
+import threading
+
+
+class Watcher:
+    """
+    Repeats a sync cycle until SIGTERM or SIGINT.
+
+    Polls every `interval` seconds (with jitter) while there is work, and
+    doubles the wait after each idle cycle up to `max_interval`. A first
+    signal lets the current cycle finish its in-flight rows; a second one
+    stops immediately.
+    """
+
+    def __init__(self, interval=300, max_interval=1800, jitter=0.2):
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.jitter = jitter
+        self._stop = threading.Event()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        if self._stop.is_set():
+            raise KeyboardInterrupt
+        print(f"\n[WATCH] Received {signal.Signals(signum).name}, finishing in-flight rows...")
+        self._stop.set()
+
+    def is_stopping(self):
+        return self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, cycle):
+        """
+        Args:
+            cycle (callable): Runs one sync; returns the number of rows worked on.
+        """
+        idle_cycles = 0
+        while not self._stop.is_set():
+            try:
+                worked = cycle()
+            except Exception as e:
+                print(f"[WATCH] Cycle failed: {e}")
+                worked = 0
+
+            idle_cycles = 0 if worked else idle_cycles + 1
+            delay = min(self.max_interval, self.interval * (2 ** max(0, idle_cycles - 1)))
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+
+            if self._stop.is_set():
+                break
+            print(f"[WATCH] Next check in {delay:.0f}s.")
+            self._stop.wait(delay)
+
+        print("[WATCH] Stopped.")
@@ -0,0 +1,411 @@
+"""
+Optional receiver for Shopify order and fulfillment order webhooks.
+
+Keeps a local AliExpress ID -> order index (SQLite) current as orders
+arrive, so the sync can resolve most IDs without searching Shopify.
+orders/create and orders/updated index the order; fulfillment_orders/*
+topics keep its open fulfillment orders current, so indexed orders can be
+fulfilled in batches.
+
+Usage:
+    python src/webhook_server.py serve --port 8080
+    python src/webhook_server.py replay recorded_order.json --topic orders/create
+"""
+import os
+import hmac
+import json
+import base64
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+from dotenv import load_dotenv
+from order_index import OrderIndex
+from processed_store import connect_db
+
+ORDER_TOPICS = ('orders/create', 'orders/updated')
+# Topics that open, close or replace fulfillment orders
+FULFILLMENT_ORDER_TOPICS = (
+    'fulfillment_orders/order_routing_complete',
+    'fulfillment_orders/placed_on_hold',
+    'fulfillment_orders/hold_released',
+    'fulfillment_orders/scheduled_fulfillment_order_ready',
+    'fulfillment_orders/rescheduled',
+    'fulfillment_orders/moved',
+    'fulfillment_orders/split',
+    'fulfillment_orders/merged',
+    'fulfillment_orders/cancelled',
+)
+TOPICS = ORDER_TOPICS + FULFILLMENT_ORDER_TOPICS
+KEY_LOCATIONS = ('tags', 'name', 'note', 'note_attributes')
+
+
+class WebhookOrderIndex:
+    """
+    Persistent AliExpress ID -> order index fed by webhooks.
+
+    The receiver writes to it and ShopifyClient reads from it before any API
+    search; SQLite WAL lets both processes use the file at the same time.
+    Keys are stored with the place they came from, and `location` /
+    `attribute_name` restrict lookups like they do for OrderIndex.
+    """
+
+    def __init__(self, db_path="order_index.db", location=None, attribute_name=None):
+        self.db_path = db_path
+        self.location = location
+        self.attribute_name = attribute_name
+        self.conn = connect_db(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(webhook_orders)")]
+            if 'ali_key' in columns:
+                # Earlier one-table layout without key locations; orders are re-indexed by their next webhook
+                self.conn.execute("DROP TABLE webhook_orders")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_orders (
+                    order_id TEXT PRIMARY KEY,
+                    name TEXT,
+                    graphql_id TEXT,
+                    updated_at TEXT
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_order_keys (
+                    ali_key TEXT NOT NULL,
+                    order_id TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    attribute TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS webhook_order_keys_ali_key ON webhook_order_keys (ali_key)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS webhook_order_keys_order_id ON webhook_order_keys (order_id)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_fulfillment_orders (
+                    fulfillment_order_id TEXT PRIMARY KEY,
+                    order_id TEXT NOT NULL,
+                    status TEXT
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS webhook_fulfillment_orders_order_id ON webhook_fulfillment_orders (order_id)")
+            # Latest version applied per order, kept after its keys are removed
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_order_versions (
+                    order_id TEXT PRIMARY KEY,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+
+    def apply_order(self, payload):
+        """
+        Re-indexes one REST order payload. Closed, cancelled or fulfilled
+        orders are removed, since there is nothing left to fulfill.
+
+        Shopify does not deliver webhooks in order, so a payload older than
+        the version already applied for the order (by updated_at) is ignored.
+
+        Returns:
+            int: Number of keys now indexed for the order, or None if the
+                payload was older and ignored.
+        """
+        order_id = str(payload['id'])
+        done = payload.get('cancelled_at') or payload.get('closed_at') or payload.get('fulfillment_status') == 'fulfilled'
+
+        keys = set()
+        if not done:
+            keys = _keys_by_location({
+                'name': payload.get('name'),
+                'note': payload.get('note'),
+                'tags': payload.get('tags') or '',
+                'customAttributes': [
+                    {'key': a.get('name'), 'value': a.get('value')}
+                    for a in payload.get('note_attributes') or []
+                ],
+            })
+
+        updated_at = payload.get('updated_at') or datetime.now(timezone.utc).isoformat()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT updated_at FROM webhook_order_versions WHERE order_id = ?", (order_id,)
+            ).fetchone()
+            if row and _is_older(updated_at, row[0]):
+                return None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO webhook_order_versions (order_id, updated_at) VALUES (?, ?)",
+                (order_id, updated_at),
+            )
+            # Tags and attributes can change, so replace the order's keys wholesale
+            self.conn.execute("DELETE FROM webhook_order_keys WHERE order_id = ?", (order_id,))
+            if done:
+                self.conn.execute("DELETE FROM webhook_orders WHERE order_id = ?", (order_id,))
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO webhook_orders (order_id, name, graphql_id, updated_at) VALUES (?, ?, ?, ?)",
+                    (order_id, payload.get('name'), payload.get('admin_graphql_api_id'), updated_at),
+                )
+            self.conn.executemany(
+                "INSERT INTO webhook_order_keys (ali_key, order_id, location, attribute) VALUES (?, ?, ?, ?)",
+                [(key, order_id, location, attribute) for key, location, attribute in keys],
+            )
+            if done or payload.get('fulfillment_status'):
+                # A partial fulfillment may have closed fulfillment orders without a fulfillment_orders webhook
+                self.conn.execute("DELETE FROM webhook_fulfillment_orders WHERE order_id = ?", (order_id,))
+        return len({key for key, _, _ in keys})
+
+    def apply_fulfillment_orders(self, payload):
+        """
+        Records the fulfillment orders of one fulfillment_orders/* payload.
+
+        These payloads carry fulfillment order IDs and statuses but usually
+        not the order, so a fulfillment order is only recorded when the
+        payload names its order or another fulfillment order in it is
+        already known (moved, split and merged ones inherit its order).
+
+        Returns:
+            int: Number of fulfillment orders recorded.
+        """
+        fulfillment_orders = []
+        for field, value in payload.items():
+            if not field.endswith(('fulfillment_order', 'fulfillment_orders')):
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and item.get('id') is not None:
+                    fulfillment_orders.append(item)
+        if not fulfillment_orders:
+            raise KeyError('fulfillment_order')
+
+        ids = [_fulfillment_order_gid(item['id']) for item in fulfillment_orders]
+        with self.lock, self.conn:
+            known = dict(self.conn.execute(
+                f"SELECT fulfillment_order_id, order_id FROM webhook_fulfillment_orders "
+                f"WHERE fulfillment_order_id IN ({','.join('?' * len(ids))})", ids,
+            ).fetchall())
+            sibling_order = next(iter(known.values()), None)
+            recorded = 0
+            for gid, item in zip(ids, fulfillment_orders):
+                order_id = item.get('order_id')
+                order_id = str(order_id).rsplit('/', 1)[-1] if order_id else known.get(gid) or sibling_order
+                if order_id is None:
+                    continue
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO webhook_fulfillment_orders (fulfillment_order_id, order_id, status) VALUES (?, ?, ?)",
+                    (gid, order_id, str(item.get('status') or '').lower()),
+                )
+                recorded += 1
+        return recorded
+
+    def record_fulfillment_orders(self, order_id, fulfillment_order_ids):
+        """Replaces an order's fulfillment orders with the open ones read from the API."""
+        order_id = str(order_id)
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM webhook_fulfillment_orders WHERE order_id = ?", (order_id,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO webhook_fulfillment_orders (fulfillment_order_id, order_id, status) VALUES (?, ?, 'open')",
+                [(gid, order_id) for gid in fulfillment_order_ids],
+            )
+
+    def get(self, aliexpress_id):
+        return self.get_many([aliexpress_id]).get(str(aliexpress_id).strip())
+
+    def get_many(self, aliexpress_ids):
+        """
+        Returns AliExpress ID -> order dict for the IDs present in the index.
+
+        An order's `fulfillment_order_ids` lists its open fulfillment orders,
+        or is None when none are known to be open.
+        """
+        ids = [str(i).strip() for i in aliexpress_ids]
+        if self.location is None:
+            # Like OrderIndex, free-text notes are only searched when configured
+            where, params = "k.location != 'note'", []
+        elif self.location == 'note_attributes' and self.attribute_name:
+            where, params = "k.location = ? AND k.attribute = ?", [self.location, self.attribute_name]
+        else:
+            where, params = "k.location = ?", [self.location]
+
+        found = {}
+        with self.lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT k.ali_key, o.order_id, o.name, o.graphql_id FROM webhook_order_keys k "
+                    f"JOIN webhook_orders o ON o.order_id = k.order_id "
+                    f"WHERE k.ali_key IN ({','.join('?' * len(chunk))}) AND {where} ORDER BY o.updated_at",
+                    chunk + params,
+                ).fetchall()
+                # Ordered by updated_at, so a key shared by several orders maps to the latest one
+                for ali_key, order_id, name, graphql_id in rows:
+                    found[ali_key] = {
+                        "id": order_id,
+                        "name": name,
+                        "graphql_id": graphql_id,
+                        "fulfillment_order_ids": None,
+                    }
+
+            orders = {order['id']: order for order in found.values()}
+            order_ids = list(orders)
+            for start in range(0, len(order_ids), 500):
+                chunk = order_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT order_id, fulfillment_order_id FROM webhook_fulfillment_orders "
+                    f"WHERE order_id IN ({','.join('?' * len(chunk))}) AND status = 'open' ORDER BY rowid",
+                    chunk,
+                ).fetchall()
+                for order_id, gid in rows:
+                    if orders[order_id]['fulfillment_order_ids'] is None:
+                        orders[order_id]['fulfillment_order_ids'] = []
+                    orders[order_id]['fulfillment_order_ids'].append(gid)
+        return found
+
+    def close(self):
+        self.conn.close()
+
+
+def _keys_by_location(node):
+    """(key, location, attribute name) for every key OrderIndex would find in `node`, per location."""
+    keys = set()
+    for location in KEY_LOCATIONS:
+        if location == 'note_attributes':
+            # Kept per attribute so lookups can be restricted to one attribute name
+            for attr in node.get('customAttributes') or []:
+                for key in OrderIndex.keys_for_node({'customAttributes': [attr]}, location):
+                    keys.add((key, location, attr.get('key')))
+        else:
+            for key in OrderIndex.keys_for_node(node, location):
+                keys.add((key, location, None))
+    return keys
+
+
+def _fulfillment_order_gid(value):
+    """REST payloads give numeric fulfillment order IDs; GraphQL mutations take GIDs."""
+    value = str(value)
+    return value if value.startswith('gid://') else f"gid://shopify/FulfillmentOrder/{value}"
+
+
+def _parse_timestamp(value):
+    """Parses an ISO 8601 timestamp; naive values are taken as UTC. Returns None if unparseable."""
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _is_older(updated_at, applied_at):
+    """True if `updated_at` is strictly before `applied_at`; unparseable values never are."""
+    new, applied = _parse_timestamp(updated_at), _parse_timestamp(applied_at)
+    return new is not None and applied is not None and new < applied
+
+
+def verify_hmac(body, secret, received):
+    """Checks the X-Shopify-Hmac-Sha256 header against the raw request body."""
+    if not secret or not received:
+        return False
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode('utf-8'), received)
+
+
+def make_handler(index, secret):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            if not verify_hmac(body, secret, self.headers.get('X-Shopify-Hmac-Sha256')):
+                self._respond(401, "Invalid HMAC")
+                return
+
+            topic = self.headers.get('X-Shopify-Topic')
+            if topic not in TOPICS:
+                # Acknowledge so Shopify does not retry topics we do not use
+                self._respond(200, f"Ignored topic {topic}")
+                return
+
+            try:
+                payload = json.loads(body)
+                if topic in FULFILLMENT_ORDER_TOPICS:
+                    recorded = index.apply_fulfillment_orders(payload)
+                else:
+                    key_count = index.apply_order(payload)
+            except (ValueError, KeyError) as e:
+                self._respond(400, f"Bad payload: {e}")
+                return
+
+            if topic in FULFILLMENT_ORDER_TOPICS:
+                print(f"[WEBHOOK] {topic}: {recorded} fulfillment orders recorded")
+            elif key_count is None:
+                print(f"[WEBHOOK] {topic} {payload.get('name')}: older than the indexed version, ignored")
+            else:
+                print(f"[WEBHOOK] {topic} {payload.get('name')}: {key_count} keys indexed")
+            self._respond(200, "OK")
+
+        def _respond(self, status, message):
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain')
+            self.end_headers()
+            self.wfile.write(message.encode('utf-8'))
+
+        def log_message(self, format, *args):
+            # Requests are already summarized by do_POST
+            pass
+
+    return WebhookHandler
+
+
+def serve(host, port, db_path, secret):
+    index = WebhookOrderIndex(db_path)
+    server = ThreadingHTTPServer((host, port), make_handler(index, secret))
+    print(f"Listening for Shopify webhooks on http://{host}:{port} (index: {db_path})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        index.close()
+
+
+def replay(path, url, secret, topic):
+    """Posts a recorded webhook payload to a local receiver, signed like Shopify would."""
+    with open(path, 'rb') as f:
+        body = f.read()
+    signature = base64.b64encode(hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()).decode('utf-8')
+    request = Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'X-Shopify-Topic': topic,
+        'X-Shopify-Hmac-Sha256': signature,
+    })
+    with urlopen(request, timeout=10) as response:
+        print(f"{response.status} {response.read().decode('utf-8')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shopify order and fulfillment order webhook receiver")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the webhook receiver")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8080)
+
+    replay_parser = subparsers.add_parser("replay", help="Post a recorded payload to a running receiver")
+    replay_parser.add_argument("payload", help="Path to a recorded webhook JSON payload")
+    replay_parser.add_argument("--topic", default="orders/create", choices=TOPICS)
+    replay_parser.add_argument("--url", default="http://127.0.0.1:8080/")
+    args = parser.parse_args()
+
+    load_dotenv()
+    secret = os.getenv('SHOPIFY_WEBHOOK_SECRET')
+    if not secret:
+        print("SHOPIFY_WEBHOOK_SECRET is not set.")
+        return
+
+    if args.command == "serve":
+        serve(args.host, args.port, os.getenv('WEBHOOK_INDEX_DB', 'order_index.db'), secret)
+    else:
+        replay(args.payload, args.url, secret, args.topic)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from processed_store import connect_db
+
+PENDING = 'pending'
+MATCHED = 'matched'
+FULFILLED = 'fulfilled'
+FAILED = 'failed'
+
+
+class WorkQueue:
+    """
+    Persistent per-row progress: pending -> matched -> fulfilled / failed.
+
+    Lets a run that died halfway resume without repeating lookups that
+    already matched an order. Transitions are buffered and committed in
+    batches, every `commit_every` transitions or `commit_interval` seconds,
+    so the hot path never waits on the disk; a crash loses at most the last
+    uncommitted batch, which only means repeating those lookups.
+
+    Fulfilled IDs are still recorded immediately in ProcessedStore, since
+    repeating a fulfillment is not harmless.
+    """
+
+    def __init__(self, db_path="work_queue.db", commit_every=200, commit_interval=2.0):
+        self.db_path = db_path
+        self.conn = connect_db(db_path, check_same_thread=False)
+        self.commit_every = max(1, int(commit_every))
+        self.commit_interval = commit_interval
+        self.lock = threading.Lock()
+        self._buffer = {}
+        self._last_commit = time.monotonic()
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS work_items (
+                    ali_id TEXT PRIMARY KEY,
+                    row_number INTEGER,
+                    tracking_number TEXT,
+                    state TEXT NOT NULL,
+                    shopify_order TEXT,
+                    message TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    updated_at TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS work_items_state ON work_items (state)")
+
+    def enqueue(self, items):
+        """
+        Registers this run's WorkItems. New rows start as pending; rows that
+        failed last time go back to pending. Matched rows keep their order.
+
+        Returns:
+            dict: AliExpress ID -> stored order for rows still matched from
+                an earlier run (no lookup needed).
+        """
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO work_items (ali_id, row_number, tracking_number, state, updated_at)
+                VALUES (?, ?, ?, 'pending', ?)
+                ON CONFLICT (ali_id) DO UPDATE SET
+                    row_number = excluded.row_number,
+                    tracking_number = excluded.tracking_number,
+                    state = CASE WHEN state = 'failed' THEN 'pending' ELSE state END,
+                    shopify_order = CASE WHEN state = 'failed' THEN NULL ELSE shopify_order END
+                """,
+                [(item.ali_id, item.row_number, item.tracking_number, now) for item in items],
+            )
+        return self.matched_orders([item.ali_id for item in items])
+
+    def matched_orders(self, ali_ids, max_age_hours=24):
+        """Orders saved for matched rows, skipping matches older than `max_age_hours`."""
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        found = {}
+        with self.lock:
+            for start in range(0, len(ali_ids), 500):
+                chunk = ali_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT ali_id, shopify_order FROM work_items WHERE state = 'matched' AND updated_at >= ? "
+                    f"AND ali_id IN ({','.join('?' * len(chunk))})",
+                    [cutoff, *chunk],
+                ).fetchall()
+                for ali_id, order in rows:
+                    if order:
+                        found[ali_id] = json.loads(order)
+        return found
+
+    def mark_matched(self, orders_by_id):
+        for ali_id, order in orders_by_id.items():
+            self._transition(ali_id, MATCHED, order=order)
+
+    def mark_fulfilled(self, ali_id, message=None):
+        self._transition(ali_id, FULFILLED, message=message)
+
+    def mark_failed(self, ali_id, message):
+        self._transition(ali_id, FAILED, message=message)
+
+    def _transition(self, ali_id, state, order=None, message=None):
+        with self.lock:
+            # Only the latest state per row matters, so later transitions replace earlier ones
+            self._buffer[str(ali_id)] = (state, json.dumps(order) if order is not None else None, message)
+            due = (len(self._buffer) >= self.commit_every
+                   or time.monotonic() - self._last_commit >= self.commit_interval)
+        if due:
+            self.commit()
+
+    def commit(self):
+        """Writes every buffered transition in one transaction."""
+        with self.lock:
+            if not self._buffer:
+                return
+            now = datetime.now().isoformat()
+            with self.conn:
+                # A matched row keeps its order when it later fulfills or fails
+                self.conn.executemany(
+                    """
+                    UPDATE work_items SET state = ?, shopify_order = COALESCE(?, shopify_order),
+                        message = ?, attempts = attempts + (? != 'matched'), updated_at = ?
+                    WHERE ali_id = ?
+                    """,
+                    [(state, order, message, state, now, ali_id) for ali_id, (state, order, message) in self._buffer.items()],
+                )
+            self._buffer = {}
+            self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.conn.close()